@@ -0,0 +1,555 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from acispy.utils import mylog
+
+default_cache_dir = os.environ.get(
+    "ACISPY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".acispy", "cache"))
+
+
+class CachedMSID(object):
+    """
+    A minimal stand-in for a :class:`~Ska.engarchive.fetch.MSID` object
+    holding the times, values, bad flags and state codes of an MSID
+    which has been read from the telemetry cache.
+    """
+    def __init__(self, msid, times, vals, bads=None, state_codes=None):
+        self.msid = msid
+        self.times = times
+        self.vals = vals
+        self.bads = bads
+        self.state_codes = state_codes
+
+
+class TelemetryCache(object):
+    """
+    A persistent on-disk cache of MSID data fetched from the engineering
+    archive. Each (msid, stat, filter_bad) combination is stored as a
+    columnar NumPy ``.npz`` file covering a contiguous span of time. When
+    a request overlaps a cached span, only the missing head or tail of
+    the request is fetched from the archive and spliced onto the cached
+    data.
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        The directory to store the cache in. Default: the value of the
+        ACISPY_CACHE_DIR environment variable, or ~/.acispy/cache.
+    max_size : float, optional
+        The maximum size of the cache on disk in bytes. When it is exceeded,
+        the least recently used entries are removed. Default: 2 GB
+    enabled : boolean, optional
+        Whether or not :meth:`~acispy.msids.MSIDs.from_database` uses
+        this cache when it is not told otherwise. Default: False
+    """
+    def __init__(self, cache_dir=None, max_size=2.0e9, enabled=False):
+        if cache_dir is None:
+            cache_dir = default_cache_dir
+        self.cache_dir = os.path.join(cache_dir, "telem")
+        self.max_size = max_size
+        self.enabled = enabled
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self._index = None
+        self._lock = threading.RLock()
+
+    @property
+    def index(self):
+        if self._index is None:
+            index_file = os.path.join(self.cache_dir, "index.json")
+            if os.path.exists(index_file):
+                with open(index_file, "r") as f:
+                    self._index = json.load(f)
+            else:
+                self._index = {}
+        return self._index
+
+    def _write_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index_file = os.path.join(self.cache_dir, "index.json")
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(index_file + ".tmp", index_file)
+
+    @property
+    def size(self):
+        """
+        The total size of the cache on disk in bytes.
+        """
+        with self._lock:
+            return sum(entry["size"] for entry in self.index.values())
+
+    @property
+    def stats(self):
+        """
+        The hit, partial hit, and miss counts of the cache.
+        """
+        return {"hits": self.hits, "partial_hits": self.partial_hits,
+                "misses": self.misses}
+
+    def _key(self, msid, stat, filter_bad):
+        return "%s_%s_%d" % (msid.lower(), stat or "raw", int(filter_bad))
+
+    def _load(self, key):
+        entry = self.index.get(key, None)
+        if entry is None:
+            return None, None
+        filename = os.path.join(self.cache_dir, key + ".npz")
+        if not os.path.exists(filename):
+            self.index.pop(key)
+            return None, None
+        with np.load(filename) as f:
+            arrays = dict((k, f[k]) for k in f.files)
+        entry["atime"] = time.time()
+        return entry, arrays
+
+    def _store(self, key, span, arrays):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        filename = os.path.join(self.cache_dir, key + ".npz")
+        # Write to a temporary file first so that a crash never
+        # leaves behind a truncated entry
+        with open(filename + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(filename + ".tmp", filename)
+        self.index[key] = {"tstart": float(span[0]), "tstop": float(span[1]),
+                           "size": os.path.getsize(filename),
+                           "atime": time.time()}
+        self._evict(keep=key)
+        self._write_index()
+
+    def _evict(self, keep=None):
+        total = sum(entry["size"] for entry in self.index.values())
+        lru = sorted(self.index.items(), key=lambda item: item[1]["atime"])
+        for key, entry in lru:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= entry["size"]
+
+    def _remove(self, key):
+        filename = os.path.join(self.cache_dir, key + ".npz")
+        if os.path.exists(filename):
+            os.remove(filename)
+        self.index.pop(key, None)
+
+    def _fetch(self, msid, tstart, tstop, stat, filter_bad):
+        import Ska.engarchive.fetch_sci as fetch
+        m = fetch.MSID(msid, tstart, stop=tstop, stat=stat,
+                       filter_bad=filter_bad)
+        arrays = {"times": m.times, "vals": m.vals}
+        if m.bads is not None:
+            arrays["bads"] = m.bads
+        if m.state_codes:
+            arrays["raw_counts"] = np.array([sc[0] for sc in m.state_codes])
+            arrays["state_codes"] = np.array([sc[1] for sc in m.state_codes])
+        return arrays
+
+    def _splice(self, pieces):
+        pieces = [p for p in pieces if p["times"].size > 0] or pieces[:1]
+        arrays = dict((k, pieces[0][k]) for k in ["raw_counts", "state_codes"]
+                      if k in pieces[0])
+        for k in ["times", "vals"]:
+            arrays[k] = np.concatenate([p[k] for p in pieces])
+        if any("bads" in p for p in pieces):
+            arrays["bads"] = np.concatenate(
+                [p.get("bads", np.zeros(p["times"].size, dtype='bool'))
+                 for p in pieces])
+        return arrays
+
+    def fetch(self, msid, tstart, tstop, stat='5min', filter_bad=False):
+        """
+        Fetch an MSID between *tstart* and *tstop* (in seconds) using
+        the cache, going to the engineering archive only for the parts
+        of the time range which have not been cached already.
+
+        Returns a :class:`~acispy.cache.CachedMSID` instance.
+        """
+        key = self._key(msid, stat, filter_bad)
+        with self._lock:
+            entry, cached = self._load(key)
+        overlaps = entry is not None and \
+            entry["tstart"] <= tstop and tstart <= entry["tstop"]
+        if not overlaps:
+            arrays = self._fetch(msid, tstart, tstop, stat, filter_bad)
+            c_start, c_stop = tstart, tstart
+            counter = "misses"
+        else:
+            c_start = min(tstart, entry["tstart"])
+            c_stop = entry["tstop"]
+            pieces = [cached]
+            if tstart < entry["tstart"]:
+                head = self._fetch(msid, tstart, entry["tstart"], stat,
+                                   filter_bad)
+                if cached["times"].size > 0:
+                    head = self._select(head, head["times"] < cached["times"][0])
+                pieces.insert(0, head)
+            if tstop > entry["tstop"]:
+                tail = self._fetch(msid, entry["tstop"], tstop, stat,
+                                   filter_bad)
+                if cached["times"].size > 0:
+                    tail = self._select(tail, tail["times"] > cached["times"][-1])
+                pieces.append(tail)
+            if len(pieces) > 1:
+                arrays = self._splice(pieces)
+                counter = "partial_hits"
+            else:
+                arrays = cached
+                counter = "hits"
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if counter != "hits":
+                # Only claim coverage up to the last sample, since the
+                # archive may not have been updated through *tstop* yet
+                if arrays["times"].size > 0:
+                    c_stop = max(c_stop, min(tstop, arrays["times"][-1]))
+                try:
+                    self._store(key, (c_start, c_stop), arrays)
+                except OSError as e:
+                    mylog.warning("Unable to write %s to the telemetry "
+                                  "cache: %s" % (msid, e))
+        arrays = self._select(arrays, np.logical_and(arrays["times"] >= tstart,
+                                                     arrays["times"] < tstop))
+        if "state_codes" in arrays:
+            state_codes = list(zip(arrays["raw_counts"], arrays["state_codes"]))
+        else:
+            state_codes = None
+        return CachedMSID(msid, arrays["times"], arrays["vals"],
+                          bads=arrays.get("bads", None),
+                          state_codes=state_codes)
+
+    def _select(self, arrays, idxs):
+        out = dict(arrays)
+        for k in ["times", "vals", "bads"]:
+            if k in out:
+                out[k] = out[k][idxs]
+        return out
+
+    def clear(self, msid=None):
+        """
+        Remove all entries from the cache, or only those for *msid*.
+        """
+        with self._lock:
+            for key in list(self.index.keys()):
+                if msid is None or key.startswith(msid.lower() + "_"):
+                    self._remove(key)
+            self._write_index()
+
+
+telem_cache = TelemetryCache()
+
+
+class StatesCache(object):
+    """
+    A cache of commanded states retrieved from kadi, kept both in memory
+    and on disk. States are cached per set of state keys, as a single
+    contiguous table covering a span of time. A request for a time range
+    inside the cached span is answered by slicing the cached table, while
+    a request which extends the span fetches the union of the two ranges
+    in a single kadi call.
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        The directory to store the cache in. Default: the value of the
+        ACISPY_CACHE_DIR environment variable, or ~/.acispy/cache.
+    enabled : boolean, optional
+        Whether or not :meth:`~acispy.states.States.from_kadi_states`
+        uses this cache when it is not told otherwise. Default: False
+    """
+    def __init__(self, cache_dir=None, enabled=False):
+        if cache_dir is None:
+            cache_dir = default_cache_dir
+        self.cache_dir = os.path.join(cache_dir, "states")
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._lock = threading.RLock()
+
+    @property
+    def stats(self):
+        """
+        The hit and miss counts of the cache.
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _key(self, state_keys):
+        if state_keys is None:
+            return "default"
+        import hashlib
+        keys = ",".join(sorted(k.lower() for k in state_keys))
+        return hashlib.md5(keys.encode()).hexdigest()
+
+    def _load(self, key):
+        if key not in self._memory:
+            filename = os.path.join(self.cache_dir, key + ".npy")
+            if not os.path.exists(filename):
+                return None
+            self._memory[key] = np.load(filename, allow_pickle=False)
+        return self._memory[key]
+
+    def _store(self, key, states):
+        self._memory[key] = states
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            filename = os.path.join(self.cache_dir, key + ".npy")
+            with open(filename + ".tmp", "wb") as f:
+                np.save(f, states, allow_pickle=False)
+            os.replace(filename + ".tmp", filename)
+        except OSError as e:
+            mylog.warning("Unable to write states to the states cache: %s" % e)
+
+    def _fetch(self, tstart, tstop, state_keys):
+        from kadi.commands import states
+        t = states.get_states(tstart, tstop, state_keys=state_keys,
+                              merge_identical=True).as_array()
+        # Object columns such as the transition keys cannot be stored
+        # without pickling, so turn them into plain strings
+        cols = {}
+        for name in t.dtype.names:
+            if t[name].dtype.char != "O":
+                cols[name] = t[name]
+            elif name == "trans_keys":
+                cols[name] = np.array([",".join(sorted(v)) for v in t[name]])
+            else:
+                cols[name] = np.array([str(v) for v in t[name]])
+        out = np.zeros(t.size, dtype=[(name, cols[name].dtype.str)
+                                      for name in t.dtype.names])
+        for name in t.dtype.names:
+            out[name] = cols[name]
+        return out
+
+    def get_states(self, tstart, tstop, state_keys=None):
+        """
+        Get the commanded states between *tstart* and *tstop* (in seconds)
+        as a NumPy structured array, in the same form as returned by
+        ``kadi.commands.states.get_states(...).as_array()``.
+        """
+        from Chandra.Time import secs2date
+        key = self._key(state_keys)
+        with self._lock:
+            cached = self._load(key)
+            if cached is not None and cached.size > 0 and \
+                    cached["tstart"][0] <= tstart and cached["tstop"][-1] >= tstop:
+                self.hits += 1
+            else:
+                self.misses += 1
+                start, stop = tstart, tstop
+                if cached is not None and cached.size > 0 and \
+                        cached["tstart"][0] <= tstop and tstart <= cached["tstop"][-1]:
+                    start = min(start, cached["tstart"][0])
+                    stop = max(stop, cached["tstop"][-1])
+                cached = self._fetch(start, stop, state_keys)
+                self._store(key, cached)
+        idxs = np.logical_and(cached["tstop"] > tstart, cached["tstart"] < tstop)
+        t = cached[idxs]
+        if t.size > 0:
+            t["tstart"][0] = max(t["tstart"][0], tstart)
+            t["datestart"][0] = secs2date(t["tstart"][0])
+            t["tstop"][-1] = min(t["tstop"][-1], tstop)
+            t["datestop"][-1] = secs2date(t["tstop"][-1])
+        return t
+
+    def invalidate(self, state_keys=None):
+        """
+        Remove the cached states for the set of *state_keys*, e.g. after
+        the kadi command archive has been updated. If *state_keys* is
+        None, the cached default set of states is removed.
+        """
+        key = self._key(state_keys)
+        with self._lock:
+            self._memory.pop(key, None)
+            filename = os.path.join(self.cache_dir, key + ".npy")
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def clear(self):
+        """
+        Remove all cached states, both in memory and on disk.
+        """
+        with self._lock:
+            self._memory.clear()
+            if os.path.exists(self.cache_dir):
+                for fn in os.listdir(self.cache_dir):
+                    if fn.endswith(".npy"):
+                        os.remove(os.path.join(self.cache_dir, fn))
+
+
+states_cache = StatesCache()
+
+
+def _nbytes(value):
+    """
+    The number of bytes held by the arrays of a cached field value,
+    including its times and mask, counting shared arrays once.
+    """
+    from acispy.units import get_mask
+    arrays = {}
+    # String arrays hold their values or the codes of their values
+    data = getattr(value, "codes", getattr(value, "value", value))
+    mask = getattr(get_mask(value), "bits", None)
+    for obj in [data, getattr(value, "times", None), mask]:
+        if isinstance(obj, np.ndarray):
+            arrays[id(obj)] = obj.nbytes
+    return sum(arrays.values())
+
+
+class FieldCache(object):
+    """
+    An in-memory least-recently-used cache of the field values, times,
+    and dates computed by a :class:`~acispy.dataset.Dataset`, which is
+    kept under a budget of *max_size* bytes. Derived values are evicted
+    when the budget is exceeded, since they can always be computed
+    again. Output fields are only references to the arrays of the MSIDs,
+    states, or model tables, so they are never evicted and do not count
+    against the budget.
+
+    The cache acts like a dict of field values, while times and dates
+    are stored and retrieved with the *kind* argument of :meth:`get`,
+    :meth:`put`, and :meth:`pop`. All access to the cache is guarded by
+    a lock, so it may be shared between threads.
+
+    Parameters
+    ----------
+    max_size : float, optional
+        The maximum size of the evictable entries in bytes. Default: 1 GB
+    """
+    def __init__(self, max_size=1.0e9):
+        from collections import OrderedDict
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value):
+        with self._lock:
+            self._max_size = value
+            self._evict()
+
+    @property
+    def stats(self):
+        """
+        The hit, miss, and eviction counts of the cache, and the size
+        of its evictable entries in bytes.
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": self.size}
+
+    def get(self, field, kind="data", default=None):
+        """
+        Get the cached value of a *kind* ("data", "times", or "dates")
+        for a field, or *default* if it is not in the cache.
+        """
+        with self._lock:
+            entry = self._entries.get((kind, field), None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end((kind, field))
+            return entry[0]
+
+    def put(self, field, value, kind="data", evictable=True):
+        """
+        Store a value of a *kind* ("data", "times", or "dates") for a
+        field in the cache, evicting the least recently used entries
+        if the cache is over its budget.
+        """
+        with self._lock:
+            self._remove((kind, field))
+            size = _nbytes(value) if evictable else 0
+            self._entries[kind, field] = (value, size)
+            self.size += size
+            self._evict(keep=[(kind, field)])
+
+    def put_many(self, entries):
+        """
+        Store a number of field values in the cache at once, where
+        *entries* is a list of (field, value, evictable) tuples. No other
+        thread sees the cache with only some of them stored.
+        """
+        with self._lock:
+            for field, value, evictable in entries:
+                self._remove(("data", field))
+                size = _nbytes(value) if evictable else 0
+                self._entries["data", field] = (value, size)
+                self.size += size
+            self._evict(keep=[("data", field) for field, _, _ in entries])
+
+    def pop(self, field, default=None, kind=None):
+        """
+        Remove the entry of a *kind* ("data", "times", or "dates") for a
+        field from the cache, and return it. If *kind* is None, entries
+        of all kinds are removed and the data value is returned.
+        """
+        with self._lock:
+            if kind is None:
+                value = self._remove(("data", field), default)
+                self._remove(("times", field))
+                self._remove(("dates", field))
+                return value
+            return self._remove((kind, field), default)
+
+    def clear(self, kind=None):
+        """
+        Remove all of the entries of a *kind* from the cache, or all
+        entries if *kind* is None.
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if kind is None or key[0] == kind:
+                    self._remove(key)
+
+    def _remove(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.size -= entry[1]
+        return entry[0]
+
+    def _evict(self, keep=()):
+        if self._max_size is None:
+            return
+        for key in list(self._entries.keys()):
+            if self.size <= self._max_size:
+                break
+            if key in keep or self._entries[key][1] == 0:
+                continue
+            self._remove(key)
+            self.evictions += 1
+
+    def keys(self):
+        with self._lock:
+            return [key[1] for key in self._entries if key[0] == "data"]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, field):
+        with self._lock:
+            return ("data", field) in self._entries
+
+    def __getitem__(self, field):
+        with self._lock:
+            if ("data", field) not in self._entries:
+                raise KeyError(field)
+            return self.get(field)
+
+    def __setitem__(self, field, value):
+        self.put(field, value)
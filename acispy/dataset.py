@@ -1,18 +1,261 @@
 from acispy.msids import MSIDs, CombinedMSIDs, ConcatenatedMSIDs
-from acispy.states import States, cmd_state_codes
+from acispy.states import States, cmd_state_codes, sample_states, \
+    StateIndex
 from acispy.model import Model
-from acispy.units import APQuantity, APStringArray
+from acispy.units import APQuantity, APStringArray, concatenate, \
+    APCategoricalArray
 from acispy.fields import create_builtin_derived_msids, \
     DerivedField, FieldContainer, OutputFieldFunction, \
-    OutputFieldsNotFound, create_builtin_derived_states
+    OutputFieldsNotFound, create_builtin_derived_states, \
+    add_earth_solid_angle_field
 from acispy.time_series import TimeSeriesData, EmptyTimeSeries
 from acispy.utils import get_display_name, moving_average, \
     ensure_list, get_time
-from acispy.units import get_units
+from acispy.units import get_units, Quantity, RegularTimes, \
+    write_hdf5_times, get_mask, align_array, get_alignment
+from acispy.cache import FieldCache
+from Chandra.Time import secs2date, date2secs
 import numpy as np
+from collections import OrderedDict
 import Ska.engarchive.fetch_sci as fetch
 
 
+def _window_mask(v, idxs):
+    mask = get_mask(v)
+    return None if mask is None else mask[idxs]
+
+
+def _window_value(v, idxs, times):
+    if isinstance(v, APCategoricalArray):
+        return APCategoricalArray(v.codes[idxs], v.categories, times,
+                                  mask=_window_mask(v, idxs))
+    elif isinstance(v, APStringArray):
+        return APStringArray(v.value[idxs], times, mask=_window_mask(v, idxs))
+    else:
+        return APQuantity(v.value[idxs], times, unit=v.unit, dtype=v.dtype,
+                          mask=_window_mask(v, idxs), copy=False)
+
+
+def _write_hdf5_values(g, k, v):
+    # Categorical values are written as their codes, with the
+    # categories in an attribute
+    if isinstance(v, APCategoricalArray):
+        d = g.create_dataset(k, data=v.codes)
+        d.attrs["categories"] = np.char.encode(v.categories.astype("str"),
+                                               "utf-8")
+        return d
+    return g.create_dataset(k, data=v.value)
+
+
+def _window_series(obj, tstart, tstop, time_bases):
+    """
+    Return a TimeSeriesData whose fields are views of the fields of *obj*
+    between *tstart* and *tstop*. *time_bases* maps the id of each time
+    array which has already been windowed to the slice and the windowed
+    times, so that each time base is only searched once.
+    """
+    table = {}
+    for k, v in obj.items():
+        t = v.times
+        if id(t) not in time_bases:
+            if isinstance(t, RegularTimes):
+                # The window of regular times is found arithmetically
+                idxs = slice(t.searchsorted(tstart, side='left'),
+                             t.searchsorted(tstop, side='right'))
+                time_bases[id(t)] = idxs, t[idxs]
+            elif t.ndim == 2:
+                # States overlapping the window, with the first and last
+                # intervals clipped to its edges
+                tv = t.value
+                i0 = np.searchsorted(tv[1], tstart, side='right')
+                i1 = np.searchsorted(tv[0], tstop, side='left')
+                idxs = slice(i0, max(i0, i1))
+                tw = np.clip(tv[:, idxs], tstart, tstop)
+                time_bases[id(t)] = idxs, Quantity(tw, "s", copy=False)
+            else:
+                tv = t.value
+                idxs = slice(np.searchsorted(tv, tstart, side='left'),
+                             np.searchsorted(tv, tstop, side='right'))
+                time_bases[id(t)] = idxs, Quantity(tv[idxs], "s", copy=False)
+        idxs, tw = time_bases[id(t)]
+        if tw.ndim == 2 and k in ["tstart", "tstop"]:
+            v = APQuantity(tw.value[int(k == "tstop")], tw, unit=v.unit,
+                           dtype=v.dtype, mask=_window_mask(v, idxs))
+        elif tw.ndim == 2 and k in ["datestart", "datestop"] and tw.shape[1] > 0:
+            # Only the first and last dates can have been clipped
+            vals = v.value[idxs].copy()
+            row = tw.value[int(k == "datestop")]
+            vals[[0, -1]] = secs2date(row[[0, -1]])
+            v = APStringArray(vals, tw, mask=_window_mask(v, idxs))
+        else:
+            v = _window_value(v, idxs, tw)
+        table[k] = v
+    return TimeSeriesData(table=table)
+
+
+resample_methods = ["mean", "min", "max", "last", "interp"]
+
+
+def _good_samples(v):
+    mask = get_mask(v)
+    return None if mask is None else mask.unpack()
+
+
+def _resampled_value(v, out, times, good):
+    if isinstance(v, APCategoricalArray):
+        return APCategoricalArray(out, v.categories, times, mask=good)
+    elif isinstance(v, APStringArray):
+        return APStringArray(out, times, mask=good)
+    else:
+        return APQuantity(out, times, unit=v.unit, mask=good, copy=False)
+
+
+def _empty_values(n, dtype):
+    # Values of empty bins, which are masked out
+    if dtype.kind == 'f':
+        return np.full(n, np.nan, dtype=dtype)
+    return np.zeros(n, dtype=dtype)
+
+
+def _resample_samples(v, grid, bins, how):
+    """
+    Resample a field with one time for each sample onto the bins of the
+    regular times *grid*. *bins* is the bin of each sample and whether
+    it falls in the grid, which are shared by fields with the same times.
+    """
+    n = grid.size
+    vals = v.codes if isinstance(v, APCategoricalArray) else v.value
+    good = _good_samples(v)
+    numeric = vals.dtype.kind in "biuf" and not isinstance(v, APStringArray)
+    if how == "interp":
+        # Values are interpolated to the middle of each bin from the
+        # good samples, or taken from the nearest one for strings
+        method = "linear" if numeric else "nearest"
+        t = v.times
+        if good is not None:
+            t = np.asarray(t.value)[good]
+            vals = vals[good]
+        if t.size == 0:
+            return _resampled_value(v, _empty_values(n, vals.dtype), grid,
+                                    np.zeros(n, dtype='bool'))
+        out = get_alignment(t, grid, method=method).take(vals)
+        centers = grid.value
+        tv = np.asarray(getattr(t, "value", t))
+        covered = (centers >= tv[0]) & (centers <= tv[-1])
+        return _resampled_value(v, out, grid, covered)
+    idxs, in_grid = bins
+    keep = in_grid if good is None else in_grid & good
+    b = idxs[keep]
+    x = vals[keep]
+    # Samples are in time order, so the samples of each bin are contiguous
+    first = np.flatnonzero(np.concatenate([[True], b[1:] != b[:-1]])) \
+        if b.size > 0 else np.zeros(0, dtype='int64')
+    filled = b[first]
+    # Strings can only take the last sample of each bin
+    method = how if numeric else "last"
+    if method == "mean":
+        counts = np.bincount(b, minlength=n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = np.bincount(b, weights=x, minlength=n) / counts
+    elif method in ["min", "max"]:
+        ufunc = np.minimum if method == "min" else np.maximum
+        out = _empty_values(n, x.dtype)
+        if first.size > 0:
+            out[filled] = ufunc.reduceat(x, first)
+    else:
+        last = np.concatenate([first[1:], [b.size]]) - 1
+        out = _empty_values(n, x.dtype)
+        out[filled] = x[last]
+    covered = np.zeros(n, dtype='bool')
+    covered[filled] = True
+    return _resampled_value(v, out, grid, covered)
+
+
+def _state_integral(tstart, tstop, w, x):
+    # The integral of a piecewise-constant function, which is w[i]
+    # within [tstart[i], tstop[i]) and zero elsewhere, up to the times x
+    cum = np.concatenate([[0.0], np.cumsum(w*(tstop - tstart))])
+    k = np.maximum(np.searchsorted(tstart, x, side='right') - 1, 0)
+    return cum[k] + w[k]*np.clip(x - tstart[k], 0.0, tstop[k] - tstart[k])
+
+
+def _resample_state(v, grid, edges, how):
+    """
+    Resample a state onto the bins of the grid, weighting each state by
+    the time it overlaps each bin.
+    """
+    n = grid.size
+    tstart, tstop = np.asarray(v.times.value)
+    vals = v.codes if isinstance(v, APCategoricalArray) else v.value
+    good = _good_samples(v)
+    if good is not None:
+        tstart, tstop, vals = tstart[good], tstop[good], vals[good]
+    if tstart.size == 0:
+        return _resampled_value(v, _empty_values(n, vals.dtype), edges,
+                                np.zeros(n, dtype='bool'))
+    numeric = vals.dtype.kind in "biuf" and not isinstance(v, APStringArray)
+    if how == "interp":
+        # The state in the middle of each bin
+        idxs, covered = StateIndex(tstart, tstop).locate(grid.value)
+        return _resampled_value(v, vals[idxs], edges, covered)
+    e0, e1 = edges.value
+    # The first and last states which overlap each bin
+    k0 = np.searchsorted(tstop, e0, side='right')
+    k1 = np.searchsorted(tstart, e1, side='left') - 1
+    covered = k1 >= k0
+    method = how if numeric else "last"
+    if method == "mean":
+        w = vals.astype('float64')
+        ones = np.ones_like(w)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = (_state_integral(tstart, tstop, w, e1) -
+                   _state_integral(tstart, tstop, w, e0)) / \
+                  (_state_integral(tstart, tstop, ones, e1) -
+                   _state_integral(tstart, tstop, ones, e0))
+        out[~covered] = np.nan
+    elif method in ["min", "max"]:
+        ufunc = np.minimum if method == "min" else np.maximum
+        # Reduce over [k0, k1] for each bin with interleaved indices,
+        # and an extra value so that k1 + 1 is always a valid index
+        x = np.append(vals, vals[-1])
+        lo = np.clip(k0, 0, vals.size - 1)
+        hi = np.clip(k1 + 1, lo + 1, vals.size)
+        out = ufunc.reduceat(x, np.ravel(np.column_stack([lo, hi])))[::2]
+        out[~covered] = _empty_values(1, out.dtype)[0]
+    else:
+        out = vals[np.clip(k1, 0, vals.size - 1)]
+        out[~covered] = _empty_values(1, out.dtype)[0]
+    return _resampled_value(v, out, edges, covered)
+
+
+def _resample_series(obj, grid, edges, how, time_bases):
+    """
+    Return a TimeSeriesData whose fields are the fields of *obj*
+    resampled onto the regular times *grid*, or onto the bins between
+    *edges* for states. *time_bases* maps the id of each time array
+    which has already been binned to its bins.
+    """
+    table = {}
+    t0 = grid.t0 - 0.5*grid.dt
+    for k, v in obj.items():
+        t = v.times
+        if t.ndim == 2:
+            if k in ["tstart", "tstop"]:
+                table[k] = APQuantity(edges.value[int(k == "tstop")], edges,
+                                      unit=v.unit, copy=False)
+            elif k in ["datestart", "datestop"]:
+                dates = secs2date(edges.value[int(k == "datestop")])
+                table[k] = APStringArray(np.asarray(dates), edges)
+            else:
+                table[k] = _resample_state(v, grid, edges, how)
+            continue
+        if id(t) not in time_bases:
+            idxs = np.floor((np.asarray(t.value) - t0) / grid.dt).astype('int64')
+            time_bases[id(t)] = t, (idxs, (idxs >= 0) & (idxs < grid.size))
+        table[k] = _resample_samples(v, grid, time_bases[id(t)][1], how)
+    return TimeSeriesData(table=table)
+
+
 class Dataset(object):
     def __init__(self, msids, states, model):
         self.msids = msids
@@ -33,15 +276,12 @@ class Dataset(object):
             create_builtin_derived_msids(self)
         if not isinstance(self.states, EmptyTimeSeries):
             create_builtin_derived_states(self)
-        self.data = {}
+        self.data = FieldCache()
         self.state_codes = {}
         if hasattr(self.msids, "state_codes"):
             for k, v in self.msids.state_codes.items():
                 self.state_codes["msids", k] = v
         self.state_codes.update(cmd_state_codes)
-        self._times = {}
-        self._dates = {}
-        self._checked_fields = []
 
     def _populate_fields(self, ftype, obj):
         for fname in obj.keys():
@@ -50,51 +290,42 @@ class Dataset(object):
             display_name = get_display_name(ftype, fname)
             df = DerivedField(ftype, fname, func, unit,
                               display_name=display_name)
-            self.fields.output_fields[ftype, fname] = df
-            if ftype not in self.fields.types:
-                self.fields.types.append(ftype)
+            self.fields.add_output_field(df)
             self.field_list.append((ftype, fname))
 
     def __getitem__(self, item):
         fd = self._determine_field(item)
-        if fd not in self.data:
-            self.data[fd] = self.fields[fd](self)
-        return self.data[fd]
+        value = self.data.get(fd)
+        if value is None:
+            value = self.fields[fd](self)
+            self.data.put(fd, value,
+                          evictable=fd in self.fields.derived_fields)
+        return value
 
     def __contains__(self, item):
         fd = self._determine_field(item)
         return fd in self.fields
 
     def _determine_field(self, field):
-        if field not in self._checked_fields:
-            if isinstance(field, tuple):
-                if len(field) != 2:
-                    raise RuntimeError("Invalid field specification {}!".format(field))
-                fd = (field[0].lower(), field[1].lower())
-                if fd in self.fields:
-                    checked_field = fd
-                else:
-                    raise RuntimeError("Cannot find field {}!".format(field))
-            elif isinstance(field, str):
-                fd = field.lower()
-                candidates = []
-                for ftype in self.fields.types:
-                    if (ftype, fd) in self.fields:
-                        candidates.append((ftype, fd))
-                if len(candidates) > 1:
-                    msg = "Multiple field types for field name %s!\n" % field
-                    for c in candidates:
-                        msg += "    {}\n".format(c)
-                    raise RuntimeError(msg)
-                elif len(candidates) == 0:
-                    raise RuntimeError("Cannot find field {}!".format(field))
-                else:
-                    checked_field = candidates[0]
-            else:
+        if isinstance(field, tuple):
+            if len(field) != 2:
                 raise RuntimeError("Invalid field specification {}!".format(field))
+            fd = (field[0].lower(), field[1].lower())
+            if fd not in self.fields:
+                raise RuntimeError("Cannot find field {}!".format(field))
+            return fd
+        elif isinstance(field, str):
+            candidates = self.fields.names.get(field.lower(), [])
+            if len(candidates) > 1:
+                msg = "Multiple field types for field name %s!\n" % field
+                for c in candidates:
+                    msg += "    {}\n".format(c)
+                raise RuntimeError(msg)
+            elif len(candidates) == 0:
+                raise RuntimeError("Cannot find field {}!".format(field))
+            return candidates[0]
         else:
-            checked_field = field
-        return checked_field
+            raise RuntimeError("Invalid field specification {}!".format(field))
 
     @property
     def derived_field_list(self):
@@ -104,11 +335,270 @@ class Dataset(object):
         if df.depends is not None:
             dep_list = []
             for fd in df.depends:
-                if fd not in self.fields.list_all_fields():
+                if fd not in self.fields:
                     dep_list.append(fd)
             if len(dep_list) > 0:
                 raise OutputFieldsNotFound(field, dep_list)
 
+    def _extend_fields(self, num_new, states_changed=False):
+        """
+        Update the cached field data after new samples have been appended
+        to the MSIDs, where *num_new* is a dict of the number of new
+        samples for each MSID, and *states_changed* is whether the states
+        have been replaced. The number of new samples is carried through
+        the dependency graph of the fields: elementwise derived fields
+        whose dependencies all gained the same number of new samples are
+        only computed for those samples and joined onto their cached
+        values, fields whose dependencies are unchanged are kept, and
+        everything else is dropped from the cache to be recomputed when
+        it is next needed.
+        """
+        # The number of new samples of each field, or None if it has
+        # changed in some other way
+        counts = {}
+        for fd in self.fields.sort_fields():
+            df = self.fields.derived_fields.get(fd, None)
+            if df is None:
+                if fd[0] == "msids":
+                    counts[fd] = num_new.get(fd[1], 0)
+                elif fd[0] == "states" and states_changed:
+                    counts[fd] = None
+                else:
+                    counts[fd] = 0
+            elif df.depends is None:
+                counts[fd] = None
+            else:
+                dep_counts = set(counts[dep] for dep in df.depends)
+                if df.elementwise:
+                    # States are looked up at the times of the samples,
+                    # so unchanged states do not stop the new samples
+                    # from being computed alone
+                    sample_counts = set(counts[dep] for dep in df.depends
+                                        if dep[0] != "states" or
+                                        counts[dep] != 0)
+                if dep_counts == {0}:
+                    counts[fd] = 0
+                elif df.elementwise and len(sample_counts) == 1 and \
+                        None not in sample_counts:
+                    counts[fd] = sample_counts.pop()
+                else:
+                    counts[fd] = None
+        tail = CombinedMSIDs([])
+        for k, n in num_new.items():
+            if n > 0:
+                tail.table[k] = self.msids[k][-n:]
+        tail_ds = Dataset(tail, self.states, EmptyTimeSeries())
+        tail_ds.fields = self.fields
+        for fd in list(self.data.keys()):
+            n = counts.get(fd, None)
+            if n is None or \
+                    (n > 0 and fd not in self.fields.derived_fields):
+                self.data.pop(fd)
+            elif n > 0:
+                self.data[fd] = concatenate([self.data[fd], tail_ds[fd]])
+        self.data.clear("times")
+        self.data.clear("dates")
+
+    def invalidate(self, fields):
+        """
+        Drop the computed values of one or more fields from the cache,
+        along with those of every derived field which depends on them,
+        so that they are computed again when they are next needed. Use
+        this after changing the data underlying a field in place.
+
+        Parameters
+        ----------
+        fields : field or list of fields
+            The fields to invalidate.
+
+        Examples
+        --------
+        >>> ds.invalidate(("msids", "1dpamzt"))
+        """
+        if isinstance(fields, tuple):
+            fields = [fields]
+        fields = [self._determine_field(field) for field in ensure_list(fields)]
+        for fd in self.fields.get_dependents(fields):
+            self.data.pop(fd)
+
+    def compute(self, fields, max_workers=4):
+        """
+        Compute a number of fields at once. The fields and the fields
+        they depend on are grouped into levels, where each field only
+        depends on fields in the levels before it. The fields in each
+        level are independent of each other, so they are computed
+        concurrently on a thread pool, and stored in the field cache
+        together once the whole level is done. Returns a dict of the
+        values of the fields.
+
+        Parameters
+        ----------
+        fields : list of fields
+            The fields to compute.
+        max_workers : integer, optional
+            The maximum number of threads to compute the fields with.
+            If less than 2, the fields are computed one at a time in
+            dependency order. Default: 4
+
+        Examples
+        --------
+        >>> vals = ds.compute([("msids", "dpa_a_power"), "avg_1dpamzt"])
+        """
+        if isinstance(fields, tuple):
+            fields = [fields]
+        fields = [self._determine_field(field) for field in ensure_list(fields)]
+        order = self.fields.sort_fields(fields)
+        if max_workers is None or max_workers < 2:
+            for fd in order:
+                self[fd]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            levels = {}
+            waves = []
+            for fd in order:
+                df = self.fields.derived_fields.get(fd, None)
+                deps = [] if df is None or df.depends is None else df.depends
+                level = max([levels[dep] + 1 for dep in deps], default=0)
+                levels[fd] = level
+                if level == len(waves):
+                    waves.append([])
+                waves[level].append(fd)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for wave in waves:
+                    todo = [fd for fd in wave if fd not in self.data]
+                    values = executor.map(lambda fd: self.fields[fd](self), todo)
+                    self.data.put_many(
+                        [(fd, value, fd in self.fields.derived_fields)
+                         for fd, value in zip(todo, values)])
+        return dict((fd, self[fd]) for fd in fields)
+
+    def window(self, tstart, tstop):
+        """
+        Return a view of this Dataset between two times. The fields of
+        the view share their data with the fields of this Dataset,
+        and each distinct set of times is only searched once. States
+        which overlap the window are included, with the first and last
+        of them clipped to its edges. Derived fields are computed on the
+        view when they are first accessed, from its own data, and derived
+        fields added to the view are not added to this Dataset.
+
+        Parameters
+        ----------
+        tstart : string or float
+            The start time of the window in YYYY:DOY:HH:MM:SS format
+            or seconds from the beginning of the mission.
+        tstop : string or float
+            The stop time of the window in YYYY:DOY:HH:MM:SS format
+            or seconds from the beginning of the mission.
+
+        Examples
+        --------
+        >>> dsw = ds.window("2017:100:00:00:00", "2017:102:00:00:00")
+        >>> dsw["msids", "1dpamzt"].max()
+        """
+        tstart = get_time(tstart, fmt='secs')
+        tstop = get_time(tstop, fmt='secs')
+        time_bases = {}
+        windows = {}
+        for ftype in set(fd[0] for fd in self.fields.output_fields):
+            windows[ftype] = _window_series(getattr(self, ftype), tstart,
+                                            tstop, time_bases)
+        msids = windows.pop("msids", EmptyTimeSeries())
+        states = windows.pop("states", EmptyTimeSeries())
+        if not windows:
+            model = EmptyTimeSeries()
+        elif list(windows.keys()) == ["model"]:
+            model = windows["model"]
+        else:
+            model = windows
+        msids.state_codes = getattr(self.msids, "state_codes", {})
+        msids.derived_msids = getattr(self.msids, "derived_msids", [])
+        ds = Dataset(msids, states, model)
+        ds.fields = self.fields.copy()
+        ds.field_list = list(self.field_list)
+        ds.state_codes = self.state_codes
+        return ds
+
+    def resample(self, dt, how="mean", tstart=None, tstop=None):
+        """
+        Return a new Dataset with every field resampled onto one grid of
+        regular times, which are the middles of bins of width *dt*. The
+        samples in each bin are reduced with one vectorized operation for
+        each field, and bad samples are left out. Bins without any good
+        samples are marked as bad. String-valued fields take the last
+        sample in each bin. States become states with one interval for
+        each bin, and are weighted by the time they overlap each bin.
+        Derived fields are computed on the new Dataset when they are
+        first accessed, from its own data.
+
+        Parameters
+        ----------
+        dt : float
+            The width of the bins in seconds.
+        how : string, optional
+            How the samples in each bin are combined. "mean", "min", and
+            "max" reduce them, "last" takes the last of them, and
+            "interp" interpolates linearly to the middle of each bin.
+            Default: "mean"
+        tstart : string or float, optional
+            The start of the first bin in YYYY:DOY:HH:MM:SS format or
+            seconds from the beginning of the mission. Default: None,
+            which is the earliest time of any field.
+        tstop : string or float, optional
+            The time which the last bin must include. Default: None,
+            which is the latest time of any field.
+
+        Examples
+        --------
+        >>> ds_hr = ds.resample(3600.0, how="max")
+        >>> ds_hr.write_msids("hourly.dat", [("msids", "1dpamzt"),
+        ...                                  ("model", "1dpamzt")])
+        """
+        if how not in resample_methods:
+            raise RuntimeError("The resampling method must be one of %s, "
+                               "not '%s'!" % (resample_methods, how))
+        if dt <= 0.0:
+            raise RuntimeError("The bin width must be positive!")
+        ftypes = set(fd[0] for fd in self.fields.output_fields)
+        if tstart is None or tstop is None:
+            first = []
+            last = []
+            for ftype in ftypes:
+                for v in getattr(self, ftype).values():
+                    tv = np.asarray(v.times.value)
+                    if tv.size > 0:
+                        first.append(tv.min())
+                        last.append(tv.max())
+            if not first:
+                raise RuntimeError("There are no times to resample!")
+        tstart = min(first) if tstart is None else get_time(tstart, fmt='secs')
+        tstop = max(last) if tstop is None else get_time(tstop, fmt='secs')
+        n = int((tstop - tstart) // dt) + 1
+        grid = RegularTimes(tstart + 0.5*dt, dt, n)
+        edges = Quantity([tstart + np.arange(n)*dt,
+                          tstart + np.arange(1, n+1)*dt], "s")
+        edges.flags.writeable = False
+        time_bases = {}
+        series = {}
+        for ftype in ftypes:
+            series[ftype] = _resample_series(getattr(self, ftype), grid,
+                                             edges, how, time_bases)
+        msids = series.pop("msids", EmptyTimeSeries())
+        states = series.pop("states", EmptyTimeSeries())
+        if not series:
+            model = EmptyTimeSeries()
+        elif list(series.keys()) == ["model"]:
+            model = series["model"]
+        else:
+            model = series
+        msids.state_codes = getattr(self.msids, "state_codes", {})
+        msids.derived_msids = getattr(self.msids, "derived_msids", [])
+        ds = Dataset(msids, states, model)
+        ds.fields = self.fields.copy()
+        ds.field_list = list(self.field_list)
+        ds.state_codes = self.state_codes
+        return ds
+
     @classmethod
     def from_hdf5(cls, filename):
         import h5py
@@ -137,9 +627,9 @@ class Dataset(object):
         if not self.msids._is_empty:
             gmsids = f.create_group("msids")
             for k, v in self.msids.items():
-                d = gmsids.create_dataset(k, data=v.value)
-                d.attrs["times"] = v.times
-                if hasattr(v, "mask"):
+                d = _write_hdf5_values(gmsids, k, v)
+                write_hdf5_times(d.attrs, v.times)
+                if get_mask(v) is not None:
                     d.attrs["mask"] = v.mask
                 if hasattr(v, "unit"):
                     d.attrs["unit"] = v.unit
@@ -148,7 +638,7 @@ class Dataset(object):
         if not self.states._is_empty:
             gstates = f.create_group("states")
             for k, v in self.states.items():
-                d = gstates.create_dataset(k, data=v.value)
+                d = _write_hdf5_values(gstates, k, v)
                 d.attrs["times"] = v.times
                 if hasattr(v, "unit"):
                     d.attrs["unit"] = v.unit
@@ -156,15 +646,15 @@ class Dataset(object):
             gmodel = f.create_group("model")
             for k, v in self.model.items():
                 d = gmodel.create_dataset(k, data=v.value)
-                d.attrs["times"] = v.times
-                if hasattr(v, "mask"):
+                write_hdf5_times(d.attrs, v.times)
+                if get_mask(v) is not None:
                     d.attrs["mask"] = v.mask
                 d.attrs["unit"] = v.unit
         f.flush()
         f.close()
 
     def add_derived_field(self, ftype, fname, function, units,
-                          display_name=None, depends=None):
+                          display_name=None, depends=None, elementwise=False):
         """
         Add a new derived field.
 
@@ -185,6 +675,15 @@ class Dataset(object):
             times for this field will be used.
         display_name : string, optional
             The name to use when displaying the field in plots. 
+        depends : list of (type, name) tuples, optional
+            The fields which this field is computed from.
+        elementwise : boolean, optional
+            Whether or not each sample of this field only depends on
+            the samples of its dependencies at the same time, so that
+            it can be computed for new samples alone. States which the
+            field depends on are taken to be the states in effect at
+            those times, so the whole field is only computed again if
+            the states have changed. Default: False
 
         Examples
         --------
@@ -195,11 +694,12 @@ class Dataset(object):
         """
         df = DerivedField(ftype, fname, function, units,
                           display_name=display_name, 
-                          depends=depends)
+                          depends=depends, elementwise=elementwise)
         self._check_derived_field((ftype, fname), df)
-        self.fields.derived_fields[ftype, fname] = df
-        if ftype not in self.fields.types:
-            self.fields.types.append(ftype)
+        if self.fields.add_derived_field(df):
+            # The field has been redefined, so its old values and those
+            # of the fields which depend on it are out of date
+            self.invalidate((ftype, fname))
 
     def add_averaged_field(self, field, n=10):
         """
@@ -220,7 +720,7 @@ class Dataset(object):
         def _avg(ds):
             v = ds[ftype, fname]
             return APQuantity(moving_average(v.value, n=n), v.times,
-                              unit=v.unit, mask=v.mask)
+                              unit=v.unit, mask=get_mask(v))
         display_name = "Average %s" % self.fields[ftype, fname].display_name
         units = get_units(ftype, fname)
         self.add_derived_field(ftype, "avg_%s" % fname, _avg, units,
@@ -245,22 +745,111 @@ class Dataset(object):
         --------
         >>> ds.map_state_to_msid("ccd_count", "1dpamzt")
         """
-        state = state.lower()
+        self.map_states_to_msid([state], msid, ftype=ftype)
+
+    def map_states_to_msid(self, states, msid, ftype="msids"):
+        """
+        Create new derived fields by interpolating several states to the
+        times of a MSID or model component. The states which each time
+        falls in are only found once, and all of the states are taken
+        from them together when the first of the fields is computed.
+
+        Parameters
+        ----------
+        states : list of strings
+            The states to be interpolated.
+        msid : string
+            The msid or model component to interpolate the states to.
+        ftype : string, optional
+            The field type to use. "msids" or "model". Default: "msids"
+
+        Examples
+        --------
+        >>> ds.map_states_to_msid(["ccd_count", "pitch", "simpos"], "1dpamzt")
+        """
+        states = [state.lower() for state in ensure_list(states)]
         msid = msid.lower()
         ftype = ftype.lower()
-        units = get_units("states", state)
-        def _state(ds):
+        # The states and times of the most recent samples, and the samples
+        last = [None]
+
+        def _sample(ds):
             msid_times = ds.times(ftype, msid)
-            state_times = ds.times("states", state)[1]
-            indexes = np.searchsorted(state_times, msid_times)
-            v = ds["states", state][indexes].value
-            if v.dtype.char in ['S', 'U']:
-                return APStringArray(v, msid_times)
+            samples = last[0]
+            if samples is None or samples[0] is not ds.states or \
+                    samples[1] is not msid_times:
+                samples = ds.states, msid_times, \
+                    sample_states(ds.states, states, msid_times)
+                last[0] = samples
+            return samples[2]
+
+        for state in states:
+            def _state(ds, state=state):
+                return _sample(ds)[state]
+            self.add_derived_field(ftype, state, _state,
+                                   get_units("states", state),
+                                   display_name=self.fields["states", state].display_name,
+                                   depends=[(ftype, msid), ("states", state)],
+                                   elementwise=True)
+
+    def align(self, fields, to, method="linear"):
+        """
+        Align fields with different times to a common set of times. The
+        indices and weights which align one set of times to another are
+        only found once, and are shared by all of the fields with the
+        same times. States are piecewise constant, so they always take
+        the value of the state each time falls in, with times outside
+        of the states marked as bad.
+
+        Parameters
+        ----------
+        fields : field or list of fields
+            The fields to align.
+        to : field or array of times
+            The field whose times the fields are aligned to, or an array
+            of times in seconds or dates.
+        method : string, optional
+            How values are aligned. "nearest" takes the value at the
+            nearest time, "linear" interpolates linearly between the
+            values at the two nearest times, and "previous" takes the
+            value at the last time at or before each time. String-valued
+            fields, such as state codes, are taken from the nearest time
+            when this is "linear". Default: "linear"
+
+        Returns an OrderedDict of the aligned fields, which all share
+        the same times.
+
+        Examples
+        --------
+        >>> aligned = ds.align(["1deamzt", "1dp28avo"], "1dpamzt")
+        >>> aligned = ds.align(["1deamzt", "pitch"], times, method="nearest")
+        """
+        if isinstance(fields, tuple):
+            fields = [fields]
+        fields = [self._determine_field(field) for field in ensure_list(fields)]
+        if isinstance(to, (str, tuple)):
+            times = self.times(self._determine_field(to))
+            if times.ndim == 2:
+                raise RuntimeError("Fields cannot be aligned to the times "
+                                   "of a state!")
+        elif isinstance(to, (Quantity, RegularTimes)):
+            times = to
+        else:
+            t = np.asarray(to)
+            if t.dtype.char in ['S', 'U']:
+                t = date2secs(t)
+            times = Quantity(np.asarray(t, dtype='float64'), "s")
+            times.flags.writeable = False
+        aligned = OrderedDict()
+        states = [fd[1] for fd in fields if fd[0] == "states"]
+        if states:
+            sampled = sample_states(self.states, states, times)
+        for fd in fields:
+            if fd[0] == "states":
+                aligned[fd] = sampled[fd[1]]
             else:
-                return APQuantity(v, msid_times, unit=units)
-        self.add_derived_field(ftype, state, _state, units,
-                               display_name=self.fields["states", state].display_name,
-                               depends=[(ftype, msid)])
+                aligned[fd] = align_array(self[fd], times, method=method)
+        return aligned
 
     def add_diff_data_model_field(self, msid, ftype_model="model"):
         r"""
@@ -286,6 +875,33 @@ class Dataset(object):
                                display_name="$\mathrm{\Delta(%s)}$" % display_name,
                                depends=[("msids", msid), (ftype_model, msid)])
 
+    def configure_earth_solid_angle(self, nprocs=1, tolerance=None):
+        """
+        Change how the "earth_solid_angle" derived MSID field is
+        computed. Any value of the field which has already been
+        computed is discarded.
+
+        Parameters
+        ----------
+        nprocs : integer, optional
+            The number of processes to compute the field with. Default: 1
+        tolerance : float, optional
+            If set, the field is only computed exactly on a coarse grid
+            of samples and where it or the attitude change quickly, and
+            is interpolated elsewhere to within roughly this tolerance
+            in steradians. The number of exact evaluations which were
+            saved is logged. Default: None, which computes the field
+            exactly at every sample.
+
+        Examples
+        --------
+        >>> ds.configure_earth_solid_angle(nprocs=4, tolerance=1.0e-3)
+        """
+        if ("msids", "earth_solid_angle") not in self.fields.derived_fields:
+            raise RuntimeError("This Dataset does not have the "
+                               "earth_solid_angle field!")
+        add_earth_solid_angle_field(self, nprocs=nprocs, tolerance=tolerance)
+
     def times(self, *args):
         """
         Return the timing information in seconds from the beginning of the mission
@@ -299,10 +915,13 @@ class Dataset(object):
             field = args[0], args[1]
         else:
             field = args[0]
-        ftype, fname = self._determine_field(field)
-        if (ftype, fname) not in self._times:
-            self._times[ftype, fname] = self[ftype, fname].times
-        return self._times[ftype, fname]
+        fd = self._determine_field(field)
+        times = self.data.get(fd, kind="times")
+        if times is None:
+            times = self[fd].times
+            self.data.put(fd, times, kind="times",
+                          evictable=fd in self.fields.derived_fields)
+        return times
 
     def dates(self, *args):
         """
@@ -316,10 +935,12 @@ class Dataset(object):
             field = args[0], args[1]
         else:
             field = args[0]
-        ftype, fname = self._determine_field(field)
-        if (ftype, fname) not in self._dates:
-            self._dates[ftype, fname] = self[ftype, fname].dates
-        return self._dates[ftype, fname]
+        fd = self._determine_field(field)
+        dates = self.data.get(fd, kind="dates")
+        if dates is None:
+            dates = self[fd].dates
+            self.data.put(fd, dates, kind="dates")
+        return dates
 
     def write_msids(self, filename, fields, mask=None, overwrite=False):
         """
@@ -459,11 +1080,26 @@ class EngArchiveData(Dataset):
         Whether or not to interpolate to a common set of times, either
         "nearest" or "linear" interpolation. If the *interpolate_times* 
         argument is not set, then the default is to interpolate at 328
-        second intervals. Default: None, indicating no interpolation. 
+        second intervals. Like the engineering archive, the sample
+        indexes are interpolated, so each value and its bad flag are
+        taken from one of the fetched samples. To interpolate the values
+        themselves, use :meth:`~acispy.dataset.Dataset.align`.
+        Default: None, indicating no interpolation. 
     interpolate_times : array_like of times, optional
         An array-like object of times to interpolate the MSID data
         to. Default: None, which means that if *interpolate* is not
         None the MSIDs will be interpolated at 328 second intervals.
+    max_workers : integer, optional
+        If greater than one, the MSIDs will be split into this many
+        groups which are fetched from the engineering archive
+        concurrently. Default: None, which fetches all of the MSIDs
+        in a single call.
+    use_cache : boolean, optional
+        Whether or not to fetch the MSIDs and states through the
+        on-disk telemetry and states caches, which only fetch the parts
+        of the time range which have not been fetched before. Default:
+        None, which uses each cache if it has been enabled, e.g. with
+        ``acispy.cache.telem_cache.enabled = True``.
 
     Examples
     --------
@@ -475,16 +1111,20 @@ class EngArchiveData(Dataset):
     """
     def __init__(self, tstart, tstop, msids, get_states=True, 
                  filter_bad=False, stat='5min', state_keys=None, 
-                 interpolate=None, interpolate_times=None):
+                 interpolate=None, interpolate_times=None, max_workers=None,
+                 use_cache=None):
         tstart = get_time(tstart)
         tstop = get_time(tstop)
         msids = MSIDs.from_database(msids, tstart, tstop=tstop,
                                     filter_bad=filter_bad, stat=stat,
                                     interpolate=interpolate,
-                                    interpolate_times=interpolate_times)
+                                    interpolate_times=interpolate_times,
+                                    max_workers=max_workers,
+                                    use_cache=use_cache)
         if get_states:
             states = States.from_kadi_states(tstart, tstop, 
-                                             state_keys=state_keys)
+                                             state_keys=state_keys,
+                                             use_cache=use_cache)
         else:
             states = EmptyTimeSeries()
         model = EmptyTimeSeries()
@@ -515,17 +1155,30 @@ class MaudeData(Dataset):
     state_keys : list of strings, optional
         The states to pull from kadi. If not specified, a default set will
         be pulled.
+    stat : string, optional
+        Roll the MSIDs up into 5-minute or daily statistics ('5min' or
+        'daily') like those of the engineering archive, or None for raw
+        data. Default: None
 
     """
     def __init__(self, tstart, tstop, msids, get_states=True, 
                  user=None, password=None, other_msids=None, 
-                 state_keys=None):
+                 state_keys=None, stat=None):
         tstart = get_time(tstart)
         tstop = get_time(tstop)
         msids = MSIDs.from_maude(msids, tstart, tstop=tstop, user=user,
                                  password=password)
+        if stat is not None:
+            msids = msids.rollup(stat)
         if other_msids is not None:
-            msids2 = MSIDs.from_database(other_msids, tstart, tstop)
+            # The archive MSIDs are 5-minute statistics unless others
+            # have been asked for
+            if stat is None:
+                archive_stat = '5min'
+            else:
+                archive_stat = stat
+            msids2 = MSIDs.from_database(other_msids, tstart, tstop,
+                                         stat=archive_stat)
             msids = CombinedMSIDs([msids, msids2])
         if get_states:
             states = States.from_kadi_states(tstart, tstop,
@@ -536,7 +1189,7 @@ class MaudeData(Dataset):
         super(MaudeData, self).__init__(msids, states, model)
 
 
-def _parse_tracelogs(tbegin, tend, filenames, other_msids):
+def _parse_tracelogs(tbegin, tend, filenames, other_msids, stat=None):
     filenames = ensure_list(filenames)
     if tbegin is not None:
         tbegin = get_time(tbegin)
@@ -554,9 +1207,18 @@ def _parse_tracelogs(tbegin, tend, filenames, other_msids):
             msids = MSIDs.from_mit_file(filename, tbegin=tbegin, tend=tend)
         else:
             raise RuntimeError("I cannot parse this file!")
+        if stat is not None:
+            msids = msids.rollup(stat)
         msid_objs.append(msids)
     if other_msids is not None:
-        msid_objs.append(MSIDs.from_database(other_msids, tbegin, tend))
+        # The archive MSIDs are 5-minute statistics unless others have
+        # been asked for
+        if stat is None:
+            archive_stat = '5min'
+        else:
+            archive_stat = stat
+        msid_objs.append(MSIDs.from_database(other_msids, tbegin, tend,
+                                             stat=archive_stat))
     all_msids = CombinedMSIDs(msid_objs)
     return all_msids
 
@@ -582,6 +1244,10 @@ class TracelogData(Dataset):
     state_keys : list of strings, optional
         The states to pull from kadi. If not specified, a default set will
         be pulled.
+    stat : string, optional
+        Roll the MSIDs up into 5-minute or daily statistics ('5min' or
+        'daily') like those of the engineering archive, or None for raw
+        data. Default: None
 
     Examples
     --------
@@ -589,11 +1255,15 @@ class TracelogData(Dataset):
     >>> ds = TracelogData("acisENG10d_00985114479.70.tl")
     """
     def __init__(self, filenames, tbegin=None, tend=None,
-                 other_msids=None, get_states=True, state_keys=None):
-        msids = _parse_tracelogs(tbegin, tend, filenames, other_msids)
+                 other_msids=None, get_states=True, state_keys=None,
+                 stat=None):
+        msids = _parse_tracelogs(tbegin, tend, filenames, other_msids,
+                                 stat=stat)
         tmin = 1.0e55
         tmax = -1.0e55
         for v in msids.values():
+            if v.size == 0:
+                continue
             tmin = min(v.times[0].value, tmin)
             tmax = max(v.times[-1].value, tmax)
         if get_states:
@@ -603,6 +1273,35 @@ class TracelogData(Dataset):
             states = EmptyTimeSeries()
         model = EmptyTimeSeries()
         super(TracelogData, self).__init__(msids, states, model)
+        self._tmin = tmin
+        self._state_keys = state_keys
+
+    def refresh(self):
+        """
+        Read the lines which have been appended to the tracelog files
+        since they were last read and add them to the MSIDs in place,
+        without parsing the rest of the files again. Derived fields which
+        have already been computed are only computed for the new samples,
+        and the states are extended if the new samples run past them.
+        Returns a dict of the number of new samples for each MSID.
+
+        Examples
+        --------
+        >>> ds = EngineeringTracelogData()
+        >>> num_new = ds.refresh()
+        """
+        num_new = self.msids.update_from_tracelog()
+        if not any(num_new.values()):
+            return num_new
+        tmax = max(v.times[-1].value for v in self.msids.values()
+                   if v.size > 0)
+        states_changed = False
+        if not self.states._is_empty and tmax > self.states["tstop"].value[-1]:
+            self.states = States.from_kadi_states(self._tmin, tmax,
+                                                  state_keys=self._state_keys)
+            states_changed = True
+        self._extend_fields(num_new, states_changed=states_changed)
+        return num_new
 
 
 class EngineeringTracelogData(TracelogData):
@@ -624,13 +1323,17 @@ class EngineeringTracelogData(TracelogData):
     state_keys : list of strings, optional
         The states to pull from kadi. If not specified, a default set will
         be pulled.
+    stat : string, optional
+        Roll the MSIDs up into 5-minute or daily statistics ('5min' or
+        'daily') like those of the engineering archive, or None for raw
+        data. Default: None
     """
     def __init__(self, tbegin=None, tend=None, other_msids=None, 
-                 get_states=True, state_keys=None):
+                 get_states=True, state_keys=None, stat=None):
         filename = "/data/acis/eng_plots/acis_eng_10day.tl"
         super(EngineeringTracelogData, self).__init__(
             filename, tbegin=tbegin, tend=tend, other_msids=other_msids,
-            get_states=get_states, state_keys=state_keys)
+            get_states=get_states, state_keys=state_keys, stat=stat)
 
 
 class DEAHousekeepingTracelogData(TracelogData):
@@ -652,13 +1355,17 @@ class DEAHousekeepingTracelogData(TracelogData):
     state_keys : list of strings, optional
         The states to pull from kadi. If not specified, a default set will
         be pulled.
+    stat : string, optional
+        Roll the MSIDs up into 5-minute or daily statistics ('5min' or
+        'daily') like those of the engineering archive, or None for raw
+        data. Default: None
     """
     def __init__(self, tbegin=None, tend=None, other_msids=None,
-                 get_states=True, state_keys=None):
+                 get_states=True, state_keys=None, stat=None):
         filename = "/data/acis/eng_plots/acis_dea_10day.tl"
         super(DEAHousekeepingTracelogData, self).__init__(
             filename, tbegin=tbegin, tend=tend, other_msids=other_msids,
-            get_states=get_states, state_keys=state_keys)
+            get_states=get_states, state_keys=state_keys, stat=stat)
 
 
 class TenDayTracelogData(TracelogData):
@@ -680,14 +1387,18 @@ class TenDayTracelogData(TracelogData):
     state_keys : list of strings, optional
         The states to pull from kadi. If not specified, a default set will
         be pulled.
+    stat : string, optional
+        Roll the MSIDs up into 5-minute or daily statistics ('5min' or
+        'daily') like those of the engineering archive, or None for raw
+        data. Default: None
     """
     def __init__(self, tbegin=None, tend=None, other_msids=None,
-                 get_states=True, state_keys=None):
+                 get_states=True, state_keys=None, stat=None):
         filenames = ["/data/acis/eng_plots/acis_eng_10day.tl",
                      "/data/acis/eng_plots/acis_dea_10day.tl"]
         super(TenDayTracelogData, self).__init__(
             filenames, tbegin=tbegin, tend=tend, other_msids=other_msids,
-            get_states=get_states, state_keys=state_keys)
+            get_states=get_states, state_keys=state_keys, stat=stat)
 
 
 class TelemData(Dataset):
@@ -712,7 +1423,9 @@ class TelemData(Dataset):
         Whether or not to filter out bad values of MSIDs. Default: False.
     stat : string, optional
         return 5-minute or daily statistics ('5min' or 'daily'), or 
-        None for raw data. Default: '5min'
+        None for raw data. The recent data are rolled up into the same
+        statistics, so that they join the archive data at the same
+        resolution. Default: '5min'
     user : string, optional
         OCCWEB username to access the MAUDE database with. Default: None,
         which will use the username in the ${HOME}/.netrc file.
@@ -725,10 +1438,14 @@ class TelemData(Dataset):
     state_keys : list of strings, optional
         The states to pull from kadi. If not specified, a default set will
         be pulled.
+    use_cache : boolean, optional
+        Whether or not to fetch the engineering archive MSIDs and the
+        states through the on-disk telemetry and states caches. Default:
+        None, which uses each cache if it has been enabled.
     """
     def __init__(self, tstart, tstop, msids, recent_source="maude",
                  filter_bad=False, stat='5min', user=None, password=None, 
-                 get_states=True, state_keys=None):
+                 get_states=True, state_keys=None, use_cache=None):
         msids = ensure_list(msids)
         tstart = get_time(tstart, fmt='secs')
         tstop = get_time(tstop, fmt='secs')
@@ -739,22 +1456,27 @@ class TelemData(Dataset):
         tmid = get_time(tmid, fmt='secs')
         if tmid < tstop:
             msids1 = MSIDs.from_database(msids, tstart, tstop=tmid,
-                                         filter_bad=filter_bad, stat=stat)
+                                         filter_bad=filter_bad, stat=stat,
+                                         use_cache=use_cache)
             if recent_source == "maude":
                 msids2 = MSIDs.from_maude(msids, tmid, tstop=tstop, user=user,
                                           password=password)
+                if stat is not None:
+                    msids2 = msids2.rollup(stat)
             elif recent_source == "tracelog":
                 msids2 = _parse_tracelogs(tmid, tstop,
                                           ["/data/acis/eng_plots/acis_eng_10day.tl",
                                            "/data/acis/eng_plots/acis_dea_10day.tl"],
-                                          None)
+                                          None, stat=stat)
             msids = ConcatenatedMSIDs(msids1, msids2)
         else:
             msids = MSIDs.from_database(msids, tstart, tstop=tstop,
-                                        filter_bad=filter_bad, stat=stat)
+                                        filter_bad=filter_bad, stat=stat,
+                                        use_cache=use_cache)
         if get_states:
             states = States.from_kadi_states(tstart, tstop,
-                                             state_keys=state_keys)
+                                             state_keys=state_keys,
+                                             use_cache=use_cache)
         else:
             states = EmptyTimeSeries()
         model = EmptyTimeSeries()
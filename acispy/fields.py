@@ -1,7 +1,9 @@
-from acispy.units import APQuantity, APStringArray
+from acispy.units import APQuantity, APCategoricalArray
 import numpy as np
 from itertools import count
+from contextlib import nullcontext
 from acis_taco import calc_earth_vis
+from acispy.utils import mylog
 
 builtin_deps = {("states", "grating"): [("states", "hetg"),
                                         ("states", "letg")],
@@ -47,12 +49,13 @@ class OutputFieldFunction(object):
 
 class DerivedField(object):
     def __init__(self, ftype, fname, function, units, display_name=None,
-                 depends=None):
+                 depends=None, elementwise=False):
         self.ftype = ftype
         self.fname = fname
         self.function = function
         self.units = units
         self.depends = depends
+        self.elementwise = elementwise
         if display_name is None:
             self.display_name = fname.upper()
         else:
@@ -67,6 +70,9 @@ class FieldContainer(object):
         self.output_fields = {}
         self.derived_fields = {}
         self.types = []
+        self.dependents = {}
+        # Index of the fields with each name, across all field types
+        self.names = {}
 
     def __getitem__(self, item):
         if item in self.derived_fields:
@@ -82,6 +88,116 @@ class FieldContainer(object):
     def list_all_fields(self):
         return list(self.output_fields.keys())+list(self.derived_fields.keys())
 
+    def copy(self):
+        """
+        Return a copy of the container, which shares the fields
+        themselves, so that fields can be added to or redefined in
+        either one without changing the other.
+        """
+        fc = FieldContainer()
+        fc.output_fields = self.output_fields.copy()
+        fc.derived_fields = self.derived_fields.copy()
+        fc.types = list(self.types)
+        fc.dependents = dict((k, set(v)) for k, v in self.dependents.items())
+        fc.names = dict((k, list(v)) for k, v in self.names.items())
+        return fc
+
+    def _add_name(self, field):
+        if field[0] not in self.types:
+            self.types.append(field[0])
+        fields = self.names.setdefault(field[1], [])
+        if field not in fields:
+            fields.append(field)
+
+    def add_output_field(self, df):
+        """
+        Add the output field *df* to the container.
+        """
+        self.output_fields[df.ftype, df.fname] = df
+        self._add_name((df.ftype, df.fname))
+
+    def add_derived_field(self, df):
+        """
+        Add the derived field *df* to the container, replacing any
+        derived field with the same name, and record it as a dependent
+        of each of the fields it depends on. Returns True if a field was
+        replaced.
+        """
+        field = df.ftype, df.fname
+        if df.depends is not None and \
+                field in self.get_dependencies(df.depends):
+            raise RuntimeError("Derived field {} cannot depend ".format(field) +
+                               "on itself!")
+        old = self.derived_fields.get(field, None)
+        if old is not None and old.depends is not None:
+            for fd in old.depends:
+                self.dependents.get(fd, set()).discard(field)
+        self.derived_fields[field] = df
+        self._add_name(field)
+        for fd in df.depends or []:
+            self.dependents.setdefault(fd, set()).add(field)
+        return old is not None
+
+    def get_dependencies(self, fields):
+        """
+        Return the set of fields which the *fields* depend on, directly
+        or through other derived fields, including the *fields* themselves.
+        """
+        seen = set()
+        stack = list(fields)
+        while stack:
+            fd = stack.pop()
+            if fd in seen:
+                continue
+            seen.add(fd)
+            df = self.derived_fields.get(fd, None)
+            if df is not None and df.depends is not None:
+                stack.extend(df.depends)
+        return seen
+
+    def get_dependents(self, fields):
+        """
+        Return the set of fields which depend on the *fields*, directly
+        or through other derived fields, including the *fields* themselves.
+        """
+        seen = set()
+        stack = list(fields)
+        while stack:
+            fd = stack.pop()
+            if fd in seen:
+                continue
+            seen.add(fd)
+            stack.extend(self.dependents.get(fd, []))
+        return seen
+
+    def sort_fields(self, fields=None):
+        """
+        Return the *fields* (all fields by default) and the fields which
+        they depend on, in an order in which each field comes after the
+        fields it depends on.
+        """
+        if fields is None:
+            fields = self.list_all_fields()
+        order = []
+        done = set()
+        for field in fields:
+            # Depth-first search, with the dependencies of each field
+            # pushed on top of it on the stack
+            stack = [(field, False)]
+            while stack:
+                fd, expanded = stack.pop()
+                if fd in done:
+                    continue
+                df = self.derived_fields.get(fd, None)
+                if expanded or df is None or df.depends is None:
+                    done.add(fd)
+                    order.append(fd)
+                    continue
+                stack.append((fd, True))
+                stack.extend((dep, False) for dep in df.depends
+                             if dep not in done)
+        return order
+
 
 def create_builtin_derived_states(dset):
 
@@ -91,7 +207,7 @@ def create_builtin_derived_states(dset):
         grat = np.array(["NONE"] * ds.states["hetg"].value.size)
         grat[ds.states["hetg"] == "INSR"] = "HETG"
         grat[ds.states["letg"] == "INSR"] = "LETG"
-        return APStringArray(grat, ds.states["hetg"].times)
+        return APCategoricalArray.from_array(grat, ds.states["hetg"].times)
 
     dset.add_derived_field("states", "grating", _grating, "",
                            display_name="Grating",
@@ -105,7 +221,7 @@ def create_builtin_derived_states(dset):
         inst[np.logical_and(82108 >= simpos, simpos >= 70736)] = "ACIS-S"
         inst[np.logical_and(-20000 >= simpos, simpos >= -86147)] = "HRC-I"
         inst[np.logical_and(-86148 >= simpos, simpos >= -104362)] = "HRC-S"
-        return APStringArray(inst, ds.states["simpos"].times)
+        return APCategoricalArray.from_array(inst, ds.states["simpos"].times)
 
     dset.add_derived_field("states", "instrument", _instrument, "",
                            display_name="Instrument",
@@ -122,7 +238,8 @@ def create_builtin_derived_msids(dset):
 
         dset.add_derived_field("msids", "dpa_a_power", _dpaa_power,
                                "W", display_name="DPA-A Power",
-                               depends=builtin_deps[("msids", "dpa_a_power")])
+                               depends=builtin_deps[("msids", "dpa_a_power")],
+                               elementwise=True)
 
     if "dpa_b_power" in dset.msids.derived_msids:
         def _dpab_power(ds):
@@ -130,7 +247,8 @@ def create_builtin_derived_msids(dset):
 
         dset.add_derived_field("msids", "dpa_b_power", _dpab_power,
                                "W", display_name="DPA-B Power",
-                               depends=builtin_deps[("msids", "dpa_b_power")])
+                               depends=builtin_deps[("msids", "dpa_b_power")],
+                               elementwise=True)
 
     if "dea_a_power" in dset.msids.derived_msids:
         def _deaa_power(ds):
@@ -138,7 +256,8 @@ def create_builtin_derived_msids(dset):
 
         dset.add_derived_field("msids", "dea_a_power", _deaa_power,
                                "W", display_name="DEA-A Power",
-                               depends=builtin_deps[("msids", "dea_a_power")])
+                               depends=builtin_deps[("msids", "dea_a_power")],
+                               elementwise=True)
 
     if "dea_b_power" in dset.msids.derived_msids:
         def _deab_power(ds):
@@ -146,7 +265,8 @@ def create_builtin_derived_msids(dset):
 
         dset.add_derived_field("msids", "dea_b_power", _deab_power,
                                "W", display_name="DEA-B Power",
-                               depends=builtin_deps[("msids", "dea_b_power")])
+                               depends=builtin_deps[("msids", "dea_b_power")],
+                               elementwise=True)
 
     # SIM position
 
@@ -155,29 +275,211 @@ def create_builtin_derived_msids(dset):
             return ds['msids', '3tscpos']*397.7225924607
         dset.add_derived_field("msids", "simpos", _simpos,
                                "", display_name="SIM Position",
-                               depends=builtin_deps[("msids", "simpos")])
+                               depends=builtin_deps[("msids", "simpos")],
+                               elementwise=True)
 
     # Earth solid angle in ACIS radiator field of view
 
     if "earth_solid_angle" in dset.msids.derived_msids:
-        def _earth_solid_angle(ds):
-            # Collect individual MSIDs for use in calc_earth_vis()
-            ephem_xyzs = [ds["msids", "orbitephem0_{}".format(x)]
-                          for x in "xyz"]
-            aoattqt_1234s = [ds["msids","aoattqt{}".format(x)]
-                             for x in range(1, 5)]
-            ephems = np.array([x.value for x in ephem_xyzs]).transpose()
-            q_atts = np.array([x.value for x in aoattqt_1234s]).transpose()
-            ret = np.empty(ds["msids", "orbitephem0_x"].shape, dtype=float)
-            for i, ephem, q_att in zip(count(), ephems, q_atts):
-                q_norm = np.sqrt(np.sum(q_att ** 2))
-                if q_norm < 0.9:
-                    q_att = np.array([0.0, 0.0, 0.0, 1.0])
-                else:
-                    q_att = q_att / q_norm
-                _, illums, _ = calc_earth_vis(ephem, q_att)
-                ret[i] = illums.sum()
-            return APQuantity(ret, ds.msids["orbitephem0_x"].times, "sr")
-        dset.add_derived_field("msids", "earth_solid_angle", _earth_solid_angle,
-                               "sr", display_name="Effective Earth Solid Angle",
-                               depends=builtin_deps[("msids", "earth_solid_angle")])
+        add_earth_solid_angle_field(dset)
+
+
+def _earth_solid_angle_chunk(ephems, q_atts):
+    # Runs in the worker processes, so must be defined at module level
+    ret = np.empty(ephems.shape[0], dtype=float)
+    for i, ephem, q_att in zip(count(), ephems, q_atts):
+        _, illums, _ = calc_earth_vis(ephem, q_att)
+        ret[i] = illums.sum()
+    return ret
+
+
+def _normalize_quaternions(q_atts):
+    # Quaternions with a norm less than 0.9 (bad telemetry) are
+    # replaced by the identity
+    q_atts = np.asarray(q_atts, dtype='float64')
+    q_norms = np.sqrt(np.sum(q_atts**2, axis=1))
+    bad = q_norms < 0.9
+    q_atts = q_atts / np.where(bad, 1.0, q_norms)[:, np.newaxis]
+    q_atts[bad] = [0.0, 0.0, 0.0, 1.0]
+    return q_atts
+
+
+def _process_pool(nprocs):
+    # A pool of *nprocs* processes to evaluate the solid angles on, or
+    # None to evaluate them in this process
+    if nprocs is None or nprocs < 2:
+        return nullcontext()
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=nprocs)
+
+
+def _eval_earth_solid_angles(ephems, q_atts, chunk_size, executor=None):
+    n = ephems.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    bounds = list(range(0, n, chunk_size)) + [n]
+    chunks = [(ephems[i:j], q_atts[i:j]) for i, j in zip(bounds[:-1], bounds[1:])]
+    if executor is None or len(chunks) < 2:
+        results = [_earth_solid_angle_chunk(*c) for c in chunks]
+    else:
+        results = list(executor.map(_earth_solid_angle_chunk, *zip(*chunks)))
+    return np.concatenate(results)
+
+
+def calc_earth_solid_angles(ephems, q_atts, nprocs=1, chunk_size=1000):
+    """
+    Compute the effective earth solid angle in the ACIS radiator field
+    of view for arrays of ephemeris positions and attitude quaternions.
+    The quaternions are normalized all at once, and quaternions with a
+    norm less than 0.9 (bad telemetry) are replaced by the identity. The
+    results are identical to calling ``calc_earth_vis`` on each sample
+    in turn, since that is what is done for each chunk of samples.
+
+    Parameters
+    ----------
+    ephems : (N, 3) array
+        The ephemeris positions of the spacecraft in meters.
+    q_atts : (N, 4) array
+        The attitude quaternions of the spacecraft.
+    nprocs : integer, optional
+        The number of processes to spread the chunks of samples over.
+        Default: 1, which computes them in this process.
+    chunk_size : integer, optional
+        The number of samples in each chunk. Default: 1000
+    """
+    ephems = np.asarray(ephems, dtype='float64')
+    q_atts = _normalize_quaternions(q_atts)
+    num_chunks = -(-ephems.shape[0] // chunk_size)
+    if nprocs is not None:
+        nprocs = min(nprocs, num_chunks)
+    with _process_pool(nprocs) as executor:
+        return _eval_earth_solid_angles(ephems, q_atts, chunk_size,
+                                        executor=executor)
+
+
+def calc_earth_solid_angles_adaptive(times, ephems, q_atts, tolerance,
+                                     stride=16, max_att_step=0.05,
+                                     nprocs=1, chunk_size=1000):
+    """
+    Compute the effective earth solid angle in the ACIS radiator field
+    of view like :func:`calc_earth_solid_angles`, but only evaluate it
+    exactly where it is needed, and interpolate it linearly in time
+    everywhere else.
+
+    The solid angle is first evaluated on a coarse grid of every
+    *stride*-th sample, and at every sample on either side of a change
+    in attitude of more than *max_att_step* degrees (e.g., during a
+    maneuver). Each interval between exactly evaluated samples is then
+    bisected: the solid angle is evaluated at its midpoint, and if that
+    differs from the linear interpolation across the interval by more
+    than *tolerance*, both halves are refined in the same way. Samples
+    in an interval whose ends have the same time are all evaluated
+    exactly, since there is nothing to interpolate across. If *nprocs*
+    is greater than one, one pool of processes is used for all of the
+    evaluations.
+
+    Parameters
+    ----------
+    times : (N,) array
+        The times of the samples in seconds from the beginning of the
+        mission.
+    ephems : (N, 3) array
+        The ephemeris positions of the spacecraft in meters.
+    q_atts : (N, 4) array
+        The attitude quaternions of the spacecraft.
+    tolerance : float
+        The largest allowed error of the interpolated solid angle at
+        the midpoints of the intervals, in steradians.
+    stride : integer, optional
+        The number of samples between the points of the coarse grid.
+        Default: 16
+    max_att_step : float, optional
+        The change in attitude between two samples, in degrees, above
+        which both samples are evaluated exactly. Default: 0.05
+    nprocs : integer, optional
+        The number of processes to spread the evaluations over.
+        Default: 1
+    chunk_size : integer, optional
+        The number of samples in each chunk of evaluations. Default: 1000
+
+    Returns the solid angles and the number of samples at which they
+    were evaluated exactly.
+    """
+    times = np.asarray(times, dtype='float64')
+    ephems = np.asarray(ephems, dtype='float64')
+    q_atts = _normalize_quaternions(q_atts)
+    n = times.size
+    vals = np.zeros(n)
+    exact = np.zeros(n, dtype='bool')
+
+    def _evaluate(idxs, executor):
+        vals[idxs] = _eval_earth_solid_angles(ephems[idxs], q_atts[idxs],
+                                              chunk_size, executor=executor)
+        exact[idxs] = True
+
+    exact[::stride] = True
+    exact[-1:] = True
+    # Angle between the attitudes of consecutive samples
+    dots = np.abs(np.sum(q_atts[1:]*q_atts[:-1], axis=1))
+    steps = np.degrees(2.0*np.arccos(np.clip(dots, 0.0, 1.0)))
+    moving = np.flatnonzero(steps > max_att_step)
+    exact[moving] = True
+    exact[moving+1] = True
+    idxs = np.flatnonzero(exact)
+    with _process_pool(nprocs) as executor:
+        _evaluate(idxs, executor)
+        left, right = idxs[:-1], idxs[1:]
+        while True:
+            split = right - left > 1
+            left, right = left[split], right[split]
+            # Intervals of no length (repeated times) cannot be
+            # interpolated across, so all of their samples are exact
+            flat = times[right] == times[left]
+            if flat.any():
+                lens = right[flat] - left[flat] - 1
+                starts = np.repeat(left[flat] + 1, lens)
+                offsets = np.arange(lens.sum()) - \
+                    np.repeat(np.cumsum(lens) - lens, lens)
+                _evaluate(starts + offsets, executor)
+                left, right = left[~flat], right[~flat]
+            if left.size == 0:
+                break
+            mid = (left + right) // 2
+            _evaluate(mid, executor)
+            w = (times[mid] - times[left]) / (times[right] - times[left])
+            interp = vals[left] + w*(vals[right] - vals[left])
+            bad = np.abs(vals[mid] - interp) > tolerance
+            left, mid, right = left[bad], mid[bad], right[bad]
+            left, right = np.concatenate([left, mid]), np.concatenate([mid, right])
+    if not exact.all():
+        vals[~exact] = np.interp(times[~exact], times[exact], vals[exact])
+    return vals, int(exact.sum())
+
+
+def add_earth_solid_angle_field(dset, nprocs=1, tolerance=None):
+    """
+    Add the "earth_solid_angle" derived MSID field to *dset*, which is
+    computed from the ephemeris and attitude quaternion MSIDs with
+    *nprocs* processes. If *tolerance* is given, the field is computed
+    using :func:`calc_earth_solid_angles_adaptive` with that tolerance,
+    otherwise it is computed exactly at every sample.
+    """
+    def _earth_solid_angle(ds):
+        ephems = np.array([ds["msids", "orbitephem0_{}".format(x)].value
+                           for x in "xyz"]).transpose()
+        q_atts = np.array([ds["msids", "aoattqt{}".format(x)].value
+                           for x in range(1, 5)]).transpose()
+        times = ds.msids["orbitephem0_x"].times
+        if tolerance is None:
+            ret = calc_earth_solid_angles(ephems, q_atts, nprocs=nprocs)
+        else:
+            ret, num_evals = calc_earth_solid_angles_adaptive(
+                times.value, ephems, q_atts, tolerance, nprocs=nprocs)
+            mylog.info("Evaluated the earth solid angle exactly at %d of "
+                       "%d samples, saving %d evaluations." %
+                       (num_evals, ret.size, ret.size-num_evals))
+        return APQuantity(ret, times, "sr")
+    dset.add_derived_field("msids", "earth_solid_angle", _earth_solid_angle,
+                           "sr", display_name="Effective Earth Solid Angle",
+                           depends=builtin_deps[("msids", "earth_solid_angle")],
+                           elementwise=True)
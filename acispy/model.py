@@ -1,8 +1,8 @@
 import requests
 from astropy.io import ascii
-import Ska.Numpy
 from acispy.utils import get_time, mylog, find_load
-from acispy.units import APQuantity, Quantity, get_units
+from acispy.units import APQuantity, Quantity, get_units, RegularTimes,\
+    read_hdf5_times, TimeAlignment, align_array
 from acispy.utils import ensure_list
 from acispy.time_series import TimeSeriesData
 import numpy as np
@@ -22,7 +22,7 @@ class Model(TimeSeriesData):
     def from_hdf5(cls, g):
         table = {}
         for k in g:
-            times = Quantity(g[k].attrs["times"])
+            times = read_hdf5_times(g[k].attrs)
             table[k] = APQuantity(g[k][()], times, g[k].attrs["unit"],
                                   mask=g[k].attrs.get("mask", None))
         return cls(table=table)
@@ -36,6 +36,13 @@ class Model(TimeSeriesData):
         else:
             t = interp_times
         table = {}
+        times = RegularTimes.from_array(t)
+        if times is None:
+            times = Quantity(t, "s")
+            times.flags.writeable = False
+        if interp_times is not None:
+            # All of the components share the times of the model
+            alignment = TimeAlignment(model.times, times)
         for k in components:
             if k == "roll":
                 key = "off_nominal_roll"
@@ -58,8 +65,7 @@ class Model(TimeSeriesData):
             if interp_times is None:
                 v = mvals
             else:
-                v = Ska.Numpy.interpolate(mvals, model.times, interp_times)
-            times = Quantity(t, "s")
+                v = alignment.take(mvals)
             table[key] = APQuantity(v, times, unit, dtype=v.dtype, mask=mask)
         return cls(table=table)
 
@@ -123,11 +129,8 @@ class Model(TimeSeriesData):
     def get_values(self, time):
         time = get_time(time, fmt='secs')
         t = Quantity(time, "s")
+        t.flags.writeable = False
         values = {}
         for key in self.keys():
-            v = Ska.Numpy.interpolate(self[key].value, 
-                                      self[key].times.value,
-                                      [time], method='linear')[0]
-            unit = get_units("model", key)
-            values[key] = APQuantity(v, t, unit=unit, dtype=v.dtype)
+            values[key] = align_array(self[key], t)
         return values
@@ -1,7 +1,8 @@
 from acispy.utils import get_time, mit_trans_table, ensure_list, \
-    get_state_codes
+    get_state_codes, ydoy2secs
 from acispy.units import get_units, APQuantity, APStringArray, \
-    Quantity
+    Quantity, concatenate, intern_times, read_hdf5_times, Mask, get_mask, \
+    APCategoricalArray, encode_categories
 import Ska.engarchive.fetch_sci as fetch
 from astropy.io import ascii
 import numpy as np
@@ -9,7 +10,13 @@ from acispy.time_series import TimeSeriesData
 from Chandra.Time import date2secs, DateTime
 import Ska.Numpy
 from acispy.fields import builtin_deps
+from acispy.cache import telem_cache
+from acispy.tracelog import read_tracelog_header, read_tracelog, \
+    read_lines, read_last_line, TracelogIndex
+from acispy.rollup import StatsRollup
 from astropy.table import Table
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 def check_depends(msids):
@@ -24,6 +31,87 @@ def check_depends(msids):
     return output_msids, derived_msids
 
 
+def fetch_msidset(msids, tstart, tstop=None, filter_bad=False, stat='5min',
+                  max_workers=None, use_cache=False):
+    """
+    Fetch a set of MSIDs from the engineering archive. If *max_workers*
+    is greater than one, the MSID list is split into that many groups
+    which are fetched concurrently on a thread pool and then joined
+    back together in the original order. If *use_cache* is True, each
+    MSID is fetched through the on-disk telemetry cache.
+
+    Returns the MSIDs as an ordered dict along with the start and stop
+    times of the fetch in seconds.
+    """
+    if not use_cache and (max_workers is None or max_workers < 2 or
+                          len(msids) < 2):
+        data = fetch.MSIDset(msids, tstart, stop=tstop,
+                             filter_bad=filter_bad, stat=stat)
+        return data, data.tstart, data.tstop
+    start = DateTime(tstart).secs
+    stop = DateTime(tstop).secs
+
+    def _fetch_group(group):
+        if use_cache:
+            return [telem_cache.fetch(msid, start, stop, stat=stat,
+                                      filter_bad=filter_bad)
+                    for msid in group]
+        else:
+            return list(fetch.MSIDset(group, tstart, stop=tstop,
+                                      filter_bad=filter_bad,
+                                      stat=stat).values())
+
+    if max_workers is None or max_workers < 2:
+        max_workers = 1
+    num_groups = min(max_workers, len(msids))
+    groups = [msids[i::num_groups] for i in range(num_groups)]
+    with ThreadPoolExecutor(max_workers=num_groups) as executor:
+        results = list(executor.map(_fetch_group, groups))
+    fetched = OrderedDict()
+    for result in results:
+        fetched.update((msid.msid.lower(), msid) for msid in result)
+    data = OrderedDict((k, fetched.pop(k)) for k in msids if k in fetched)
+    # Anything left over came from a glob pattern in the MSID list
+    data.update(fetched)
+    return data, start, stop
+
+
+def _set_good_bits(buf, start, stop):
+    # Mark the samples from *start* to *stop* of a packed mask as good
+    b0, b1 = start >> 3, (stop + 7) >> 3
+    bits = np.unpackbits(buf[b0:b1])
+    bits[start - 8*b0:stop - 8*b0] = 1
+    buf[b0:b1] = np.packbits(bits)
+
+
+def _rollup_samples(v, start=0):
+    # The times and values of the good samples of the MSID *v* from
+    # *start* on, with state-valued MSIDs rolled up by their codes
+    if isinstance(v, APCategoricalArray):
+        values = v.codes[start:]
+    else:
+        values = np.asarray(v.value)[start:]
+    times = v.times.value[start:]
+    mask = get_mask(v)
+    if mask is not None:
+        good = np.asarray(mask[start:])
+        times = times[good]
+        values = values[good]
+    return times, values
+
+
+def _rollup_values(v, stats, dtype):
+    # The archive values of the intervals, which are the means of
+    # numerical MSIDs and the midvals of state-valued MSIDs
+    if stats is None:
+        return np.zeros(0, dtype=dtype)
+    elif isinstance(v, APCategoricalArray):
+        return v.categories[stats["midvals"]]
+    elif isinstance(v, APStringArray):
+        return stats["midvals"]
+    return stats["means"]
+
+
 class MSIDs(TimeSeriesData):
     def __init__(self, table, times, state_codes=None, masks=None,
                  derived_msids=None):
@@ -32,11 +120,15 @@ class MSIDs(TimeSeriesData):
             state_codes = {}
         if masks is None:
             masks = {}
+        # MSIDs which share the same times share one read-only time base
+        times = intern_times(dict((k, times[k]) for k in table))
         for k, v in table.items():
             mask = masks.get(k, None)
-            t = Quantity(times[k], "s")
+            t = times[k]
             if v.dtype.char in ['S', 'U']:
-                self.table[k] = APStringArray(v, t, mask=mask)
+                # String-valued MSIDs are state codes, which only take
+                # a few distinct values
+                self.table[k] = APCategoricalArray.from_array(v, t, mask=mask)
             else:
                 unit = get_units("msids", k)
                 self.table[k] = APQuantity(v, t, unit=unit, dtype=v.dtype,
@@ -45,6 +137,192 @@ class MSIDs(TimeSeriesData):
         if derived_msids is None:
             derived_msids = []
         self.derived_msids = derived_msids
+        self.filename = None
+        self._tracelog = None
+        self._rollup = None
+        self._buffers = {}
+        self._time_buffers = {}
+
+    def _append(self, table, times):
+        """
+        Append new samples to the MSIDs in place. The values, times, and
+        masks live in buffers which grow geometrically, so that repeated
+        appends take amortized constant time per sample and the MSIDs
+        are views of the filled part of the buffers. MSIDs with no bad
+        samples have no mask buffer, and the others have a buffer of
+        packed bits.
+        """
+        new_times = {}
+        for k, v in table.items():
+            old = self.table[k]
+            n = old.size
+            size = n + v.size
+            categories = None
+            if isinstance(old, APCategoricalArray):
+                # The buffer holds the codes of the values
+                v, categories = encode_categories(v, old.categories)
+                dtype = np.promote_types(old.codes.dtype, v.dtype)
+                old_value = old.codes
+            else:
+                dtype = old.dtype
+                old_value = old.value
+            if k not in self._buffers or size > self._buffers[k][0].size or \
+                    self._buffers[k][0].dtype != dtype:
+                vbuf = np.empty(max(2*size, 1024), dtype=dtype)
+                vbuf[:n] = old_value
+                self._buffers[k] = vbuf, None
+            vbuf, mbuf = self._buffers[k]
+            vbuf[n:size] = v
+            mask = get_mask(old)
+            if mask is not None:
+                if mbuf is None:
+                    mbuf = np.zeros((vbuf.size + 7) >> 3, dtype='uint8')
+                    mbuf[:mask.bits.size] = mask.bits
+                    self._buffers[k] = vbuf, mbuf
+                # The new samples are all good
+                _set_good_bits(mbuf, n, size)
+                mask = Mask(mbuf[:(size + 7) >> 3], size)
+            # MSIDs which shared their old times and are given the same
+            # new times share the buffer of their time base
+            key = id(old.times), id(times[k])
+            if key not in new_times:
+                tbuf = self._time_buffers.pop(id(old.times), (None, None))[0]
+                if tbuf is None or size > tbuf.size:
+                    tbuf = np.empty(max(2*size, 1024), dtype='float64')
+                    tbuf[:n] = old.times.value
+                tbuf[n:size] = times[k]
+                t = Quantity(tbuf[:size], "s", copy=False)
+                t.flags.writeable = False
+                new_times[key] = t
+                self._time_buffers[id(t)] = (tbuf, t)
+            t = new_times[key]
+            if categories is not None:
+                self.table[k] = APCategoricalArray(vbuf[:size], categories, t,
+                                                   mask=mask)
+            elif v.dtype.char in ['S', 'U']:
+                self.table[k] = APStringArray(vbuf[:size], t, mask=mask)
+            else:
+                self.table[k] = APQuantity(vbuf[:size], t, unit=old.unit,
+                                           dtype=old.dtype, mask=mask,
+                                           copy=False)
+
+    def update_from_tracelog(self):
+        """
+        Read the lines which have been appended to the tracelog file
+        these MSIDs were read from since it was last read, and append
+        them to the MSIDs in place. Returns a dict of the number of new
+        samples for each MSID.
+        """
+        if self._rollup is not None:
+            return self._update_rollup()
+        if self._tracelog is None:
+            raise RuntimeError("These MSIDs were not read from a tracelog file!")
+        tl = self._tracelog
+        last_line = read_last_line(self.filename, tl["offset"])
+        if last_line == tl["last_line"]:
+            start = tl["offset"]
+        else:
+            # The file has been rewritten, so find our place with the index
+            start, _ = TracelogIndex(self.filename).find_offsets(
+                tbegin=tl["last_time"])
+        data, offset = read_tracelog(self.filename, tl["dtype"], start=start)
+        data['time'] -= 410227200.
+        idxs = np.logical_and(data['time'] >= tl["tbegin"],
+                              data['time'] <= tl["tend"])
+        if tl["last_time"] is not None:
+            idxs &= data['time'] > tl["last_time"]
+        tl["offset"] = offset
+        tl["last_line"] = read_last_line(self.filename, offset)
+        num_new = int(idxs.sum())
+        if num_new > 0:
+            tl["last_time"] = data['time'][idxs][-1]
+            table = dict((k, data[k][idxs]) for k in self.table)
+            t = data["time"][idxs]
+            times = dict((k, t) for k in self.table)
+            self._append(table, times)
+        return dict((k, num_new) for k in self.table)
+
+    def _is_tracelog(self):
+        if self._rollup is not None:
+            return self._rollup[0]._is_tracelog()
+        return self._tracelog is not None
+
+    def rollup(self, stat="5min"):
+        """
+        Compute the 5-minute or daily statistics of these MSIDs in the
+        same intervals as the engineering archive, so that they can be
+        joined with MSIDs fetched from the archive with the same *stat*.
+        The values of the returned MSIDs are the time-weighted means of
+        numerical MSIDs and the midvals of state-valued MSIDs at the
+        midpoints of the intervals, and all of the statistics are in
+        their :attr:`stats`. Only the intervals which are complete are
+        included, i.e. which have a sample after them and which do not
+        begin before the first sample, so that an interval which is cut
+        off at the start of these MSIDs, and which the engineering
+        archive may already have, is left out. If these MSIDs were read
+        from a tracelog file, :meth:`update_from_tracelog` on the
+        returned MSIDs reads the new lines of the file and adds the
+        intervals they complete, without computing the other intervals
+        again.
+
+        Parameters
+        ----------
+        stat : string, optional
+            The statistic interval, either "5min" or "daily".
+            Default: "5min"
+
+        Examples
+        --------
+        >>> msids = MSIDs.from_tracelog("acisENG10d_archive.txt")
+        >>> msids_5min = msids.rollup("5min")
+        >>> msids_5min.stats["1deamzt"]["maxes"]
+        """
+        rollups = {}
+        table = {}
+        times = {}
+        for k, v in self.table.items():
+            numeric = not isinstance(v, APStringArray)
+            r = StatsRollup(stat, numeric=numeric)
+            r.update(*_rollup_samples(v))
+            rollups[k] = r
+            table[k] = _rollup_values(v, r.stats, v.dtype)
+            times[k] = np.zeros(0) if r.stats is None else r.stats["times"]
+        msids = MSIDs(table, times, state_codes=self.state_codes,
+                      derived_msids=self.derived_msids)
+        msids.filename = self.filename
+        msids._rollup = (self, rollups,
+                         dict((k, v.size) for k, v in self.table.items()))
+        return msids
+
+    @property
+    def stats(self):
+        """
+        The statistics of each interval of MSIDs which were computed by
+        :meth:`rollup`, as a dict of arrays of the "times", "samples",
+        "midvals", and, for numerical MSIDs, the "means", "stds", "mins",
+        and "maxes" for each MSID. None if these are not rolled-up MSIDs.
+        """
+        if self._rollup is None:
+            return None
+        return dict((k, r.stats) for k, r in self._rollup[1].items())
+
+    def _update_rollup(self):
+        source, rollups, nread = self._rollup
+        source.update_from_tracelog()
+        table = {}
+        times = {}
+        num_new = {}
+        for k, r in rollups.items():
+            v = source.table[k]
+            new = r.update(*_rollup_samples(v, start=nread[k]))
+            nread[k] = v.size
+            num_new[k] = 0 if new is None else new["times"].size
+            if num_new[k] > 0:
+                table[k] = _rollup_values(v, new, v.dtype)
+                times[k] = new["times"]
+        if table:
+            self._append(table, times)
+        return num_new
 
     @classmethod
     def from_hdf5(cls, g):
@@ -53,7 +331,9 @@ class MSIDs(TimeSeriesData):
         masks = {}
         for k in g:
             table[k] = g[k][()]
-            times[k] = g[k].attrs["times"]
+            if "categories" in g[k].attrs:
+                table[k] = g[k].attrs["categories"].astype("str")[table[k]]
+            times[k] = read_hdf5_times(g[k].attrs)
             if "mask" in g[k].attrs:
                 masks[k] = g[k].attrs["mask"]
         state_codes = g.attrs.get("state_codes", None)
@@ -63,6 +343,7 @@ class MSIDs(TimeSeriesData):
 
     @classmethod
     def from_mit_file(cls, filename, tbegin=None, tend=None):
+        bounded = tbegin is not None or tend is not None
         if tbegin is None:
             tbegin = -1.0e22
         else:
@@ -86,17 +367,21 @@ class MSIDs(TimeSeriesData):
             year = "#YEAR"
         else:
             year = "YEAR"
-        data = Table(ascii.read(filename, guess=False, format='csv',
-                                delimiter=delimiter), masked=True)
-        mins, hours = np.modf(data["SEC"].data/3600.)
-        secs, mins = np.modf(mins*60.)
-        secs *= 60.0
-        time_arr = ["%04d:%03d:%02d:%02d:%06.3f" % (y, d, h, m, s)
-                    for y, d, h, m, s in zip(data[year].data,
-                                             data["DOY"].data,
-                                             hours, mins, secs)]
-        tsecs = date2secs(time_arr)
+        if bounded and line.lstrip("#").split(delimiter.strip() or None)[:3] == \
+                ["YEAR", "DOY", "SEC"]:
+            # Only read the lines around the time range using the index
+            index = TracelogIndex(filename, delimiter=delimiter)
+            start, stop = index.find_offsets(tbegin, tend)
+            text = line + read_lines(filename, start, stop).decode()
+            data = ascii.read(text, guess=False, format='csv',
+                              delimiter=delimiter)
+        else:
+            data = ascii.read(filename, guess=False, format='csv',
+                              delimiter=delimiter)
+        data = Table(data, masked=True)
+        tsecs = ydoy2secs(data[year].data, data["DOY"].data, data["SEC"].data)
         idxs = np.logical_and(tsecs >= tbegin, tsecs <= tend)
+        t = tsecs[idxs]
         table = {}
         times = {}
         masks = {}
@@ -108,7 +393,7 @@ class MSIDs(TimeSeriesData):
                 else:
                     key = k.lower()
                 table[key] = np.array(data[k].data[idxs])
-                times[key] = tsecs[idxs]
+                times[key] = t
                 if key == "bilevels":
                     masks[key] = np.array(table[key] != "0")
                 else:
@@ -117,17 +402,22 @@ class MSIDs(TimeSeriesData):
         # Now we split the bilevel into its components
         bmask = masks["bilevels"]
         bilevels = np.char.strip(table["bilevels"], "b")[bmask]
+        # View each 8-character bilevel string as a row of 8 characters
+        bits = bilevels.astype("U8").view("U1").reshape(-1, 8)
+        # The bilevel components all share the packed mask of the bilevels
+        masks["bilevels"] = Mask.from_array(bmask)
         for i in range(8):
             key = "1stat%dst" % (7-i)
-            table[key] = np.array(["BAD"]*bmask.size)
-            table[key][bmask] = np.array([b[i] for b in bilevels])
+            table[key] = np.full(bmask.size, "BAD")
+            table[key][bmask] = bits[:, i]
             times[key] = times["bilevels"]
-            masks[key] = bmask
+            masks[key] = masks["bilevels"]
             state_codes[key] = get_state_codes(key)
         return cls(table, times, masks=masks, state_codes=state_codes)
 
     @classmethod
     def from_tracelog(cls, filename, tbegin=None, tend=None):
+        bounded = tbegin is not None or tend is not None
         if tbegin is None:
             tbegin = -1.0e22
         else:
@@ -138,8 +428,7 @@ class MSIDs(TimeSeriesData):
         else:
             if isinstance(tend, str):
                 tend = date2secs(tend)
-        f = open(filename, "r")
-        header = f.readline().split()
+        header, offset = read_tracelog_header(filename)
         dtype = []
         state_codes = {}
         for msid in header:
@@ -150,31 +439,43 @@ class MSIDs(TimeSeriesData):
                 dtype.append((msid.lower(), "|U4"))
             else:
                 dtype.append((msid.lower(), '<f8'))
-        data = []
-        for line in f:
-            words = line.split()
-            if len(words) == len(header):
-                data.append(tuple(words))
-        f.close()
-        data = np.array(data, dtype=dtype)
+        if bounded:
+            # Only read the lines around the time range using the index
+            index = TracelogIndex(filename)
+            offset, stop = index.find_offsets(tbegin, tend)
+        else:
+            stop = None
+        data, end = read_tracelog(filename, dtype, start=offset, stop=stop)
         # Convert times in the TIME column to Chandra 1998 time
         data['time'] -= 410227200.
         idxs = np.logical_and(data['time'] >= tbegin, data['time'] <= tend)
         table = dict((k.lower(), data[k][idxs]) for k in data.dtype.names if k != "time")
-        times = dict((k.lower(), data["time"][idxs]) for k in header if k != "time")
+        t = data["time"][idxs]
+        times = dict((k.lower(), t) for k in header if k != "time")
         derived_msids = ["dpa_a_power", "dpa_b_power", "dea_a_power", "dea_b_power"]
-        return cls(table, times, state_codes=state_codes, derived_msids=derived_msids)
+        msids = cls(table, times, state_codes=state_codes, derived_msids=derived_msids)
+        # Remember where we stopped so that appended lines can be read later
+        msids.filename = filename
+        msids._tracelog = {"dtype": dtype, "tbegin": tbegin, "tend": tend,
+                           "offset": end,
+                           "last_line": read_last_line(filename, end),
+                           "last_time": data['time'][idxs][-1] if idxs.any() else None}
+        return msids
 
     @classmethod
     def from_database(cls, msids, tstart, tstop=None, filter_bad=False,
-                      stat='5min', interpolate=None, interpolate_times=None):
+                      stat='5min', interpolate=None, interpolate_times=None,
+                      max_workers=None, use_cache=None):
         tstart = get_time(tstart)
         tstop = get_time(tstop)
         msids = ensure_list(msids)
         msids, derived_msids = check_depends(msids)
         msids = [msid.lower() for msid in msids]
-        data = fetch.MSIDset(msids, tstart, stop=tstop, filter_bad=filter_bad,
-                             stat=stat)
+        if use_cache is None:
+            use_cache = telem_cache.enabled
+        data, fetch_tstart, fetch_tstop = fetch_msidset(
+            msids, tstart, tstop=tstop, filter_bad=filter_bad, stat=stat,
+            max_workers=max_workers, use_cache=use_cache)
         table = {}
         times = {}
         state_codes = {}
@@ -185,27 +486,43 @@ class MSIDs(TimeSeriesData):
                 max_fetch_tstart = max(msid.times[0] for msid in data.values())
                 min_fetch_tstop = min(msid.times[-1] for msid in data.values())
                 dt = 328.0
-                start = DateTime(tstart).secs if tstart else data.tstart
-                stop = DateTime(tstop).secs if tstop else data.tstop
+                start = DateTime(tstart).secs if tstart else fetch_tstart
+                stop = DateTime(tstop).secs if tstop else fetch_tstop
                 start = max(start, max_fetch_tstart)
                 stop = min(stop, min_fetch_tstop)
                 interpolate_times = np.arange((stop - start) // dt + 1) * dt + start
             else:
                 interpolate_times = DateTime(interpolate_times).secs
+            interpolate_times = Quantity(interpolate_times, "s")
+            interpolate_times.flags.writeable = False
+        # The interpolation indexes are found once for each distinct
+        # set of times of the fetched MSIDs
+        time_bases = intern_times(dict((k, msid.times) for k, msid in data.items()))
+        interp_indexes = {}
         for k, msid in data.items():
+            mask = None if msid.bads is None else Mask.from_array(~msid.bads)
             if interpolate is not None:
-                indexes = Ska.Numpy.interpolate(np.arange(len(msid.times)),
-                                                msid.times, interpolate_times,
-                                                method=interpolate, sorted=True)
+                # The sample indexes are interpolated, like the engineering
+                # archive's MSIDset.interpolate, so that each value and its
+                # bad flag come from one of the fetched samples
+                base = time_bases[k]
+                if id(base) not in interp_indexes:
+                    interp_indexes[id(base)] = Ska.Numpy.interpolate(
+                        np.arange(len(msid.times)), base.value,
+                        interpolate_times.value, method=interpolate,
+                        sorted=True)
+                indexes = interp_indexes[id(base)]
+                vals = msid.vals[indexes]
+                if mask is not None:
+                    mask = mask[indexes]
                 times[k.lower()] = interpolate_times
             else:
-                indexes = slice(None, None, None)
+                vals = msid.vals
                 times[k.lower()] = data[k].times
             if msid.state_codes:
                 state_codes[k] = dict((k, v) for v, k in msid.state_codes)
-            table[k.lower()] = msid.vals[indexes]
-            if msid.bads is not None:
-                masks[k.lower()] = (~msid.bads)[indexes]
+            table[k.lower()] = vals
+            masks[k.lower()] = mask
         return cls(table, times, state_codes=state_codes, masks=masks,
                    derived_msids=derived_msids)
 
@@ -242,6 +559,20 @@ class CombinedMSIDs(TimeSeriesData):
             self.state_codes.update(msids.state_codes)
             derived_msids += msids.derived_msids
         self.derived_msids = derived_msids
+        self.msid_list = msid_list
+
+    def update_from_tracelog(self):
+        """
+        Append the lines which have been added to the tracelog files of
+        any of the combined MSIDs since they were last read. Returns a
+        dict of the number of new samples for each MSID.
+        """
+        num_new = {}
+        for msids in self.msid_list:
+            if isinstance(msids, MSIDs) and msids._is_tracelog():
+                num_new.update(msids.update_from_tracelog())
+                self.table.update(msids.table)
+        return num_new
 
 
 class ConcatenatedMSIDs(TimeSeriesData):
@@ -251,12 +582,5 @@ class ConcatenatedMSIDs(TimeSeriesData):
         for key in msids1.table:
             v1 = msids1.table[key]
             v2 = msids2.table[key]
-            v = np.concatenate([v1.value, v2.value])
-            t = Quantity(np.concatenate([v1.times.value, v2.times.value]), "s")
-            mask = np.concatenate([v1.mask, v2.mask])
-            if v1.dtype.char in ['S', 'U']:
-                self.table[key] = APStringArray(v, t, mask)
-            else:
-                self.table[key] = APQuantity(v, t, unit=v1.unit, dtype=v.dtype,
-                                             mask=mask)
+            self.table[key] = concatenate([v1, v2])
         self.derived_msids = msids1.derived_msids
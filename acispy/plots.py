@@ -12,6 +12,7 @@ from matplotlib.backends.backend_agg import \
 from io import BytesIO
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from acispy.utils import convert_state_code, get_time
+from acispy.units import time_plotdates, get_mask
 import numpy as np
 from astropy.units import Quantity
 
@@ -654,7 +655,7 @@ class DatePlot(CustomDatePlot):
             src_name, fd = field
             drawstyle = drawstyles.get(fd, None)
             state_codes = ds.state_codes.get(field, None)
-            if not plot_bad:
+            if not plot_bad and get_mask(ds[field]) is not None:
                 mask = ds[field].mask
             else:
                 mask = slice(None, None, None)
@@ -722,7 +723,7 @@ class DatePlot(CustomDatePlot):
                 self.ax.patch.set_visible(False)
             drawstyle = drawstyles.get(fd2, None)
             state_codes = ds.state_codes.get(field2, None)
-            if not plot_bad:
+            if not plot_bad and get_mask(ds[field2]) is not None:
                 mask2 = ds[field2].mask
             else:
                 mask2 = slice(None, None, None)
@@ -773,21 +774,23 @@ class DatePlot(CustomDatePlot):
         for field in self.fields:
             if field[0] != "states":
                 times.append(self.times[field])
-                masks.append(self.y[field].mask)
+                masks.append(get_mask(self.y[field]))
         axes = [self.ax]*len(times)
         if self.field2 and self.field2[0] != "states":
             axes.append(self.ax2)
             times.append(self.times[self.field2])
-            masks.append(self.y[self.field2].mask)
+            masks.append(get_mask(self.y[self.field2]))
         for mask, ax, x in zip(masks, axes, times):
-            if np.any(~mask):
+            # Fields without a mask have no bad times to fill
+            if mask is None:
+                continue
+            bad_int = mask.bad_intervals()
+            if bad_int.size > 0:
                 ybot, ytop = ax.get_ylim()
-                all_time = cxctime2plotdate(x.value)
-                bad = np.concatenate([[False], ~mask, [False]])
-                bad_int = np.flatnonzero(bad[1:] != bad[:-1]).reshape(-1, 2)
+                all_time = time_plotdates(x)
                 for ii, jj in bad_int:
                     ax.fill_between(all_time[ii:jj], ybot, ytop, 
-                                    where=~mask[ii:jj], color='cyan', alpha=0.5)
+                                    color='cyan', alpha=0.5)
 
     def set_ylim(self, ymin, ymax):
         """
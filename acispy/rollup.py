@@ -0,0 +1,119 @@
+import numpy as np
+
+# The lengths of the intervals of the engineering archive statistics,
+# in seconds. The intervals are aligned to multiples of these from the
+# start of Chandra time.
+stat_intervals = {"5min": 328.0, "daily": 86400.0}
+
+
+def _bin_stats(times, values, dt, next_time, numeric=True):
+    """
+    Compute the statistics of the samples *values* at the sorted *times*
+    in each interval, in one pass over all of the intervals, where
+    *next_time* is the time of the sample after the last one. Like the
+    engineering archive, the means and stds are weighted by the time
+    from each sample to the next, up to the end of its interval. Only
+    intervals with samples are returned.
+    """
+    index = np.floor(times / dt).astype('int64')
+    first = np.flatnonzero(np.concatenate([[True], index[1:] != index[:-1]]))
+    n = np.diff(np.append(first, index.size))
+    stats = {"times": (index[first] + 0.5) * dt,
+             "samples": n,
+             "midvals": values[first + n // 2]}
+    if numeric:
+        x = values.astype('float64')
+        w = np.minimum(np.append(times[1:], next_time),
+                       (index + 1) * dt) - times
+        wsum = np.add.reduceat(w, first)
+        # Intervals whose samples all have the same time are unweighted
+        same = wsum <= 0.0
+        if same.any():
+            w[np.repeat(same, n)] = 1.0
+            wsum = np.add.reduceat(w, first)
+        means = np.add.reduceat(w * x, first) / wsum
+        resid = x - np.repeat(means, n)
+        stats["means"] = means
+        stats["stds"] = np.sqrt(np.add.reduceat(w * resid * resid, first) / wsum)
+        stats["mins"] = np.minimum.reduceat(values, first)
+        stats["maxes"] = np.maximum.reduceat(values, first)
+    return stats
+
+
+class StatsRollup(object):
+    """
+    Compute the 5-minute or daily statistics of the samples of a single
+    MSID, in the same intervals as the engineering archive, from samples
+    which are added to it incrementally. An interval is complete once a
+    sample has been added which falls after it, and only complete
+    intervals are rolled up. The samples of the last interval are kept
+    until it is complete, so that each sample is only rolled up once.
+    The interval of the first sample is skipped unless the sample is at
+    its start, since the samples before it are missing, e.g. because
+    they are in the engineering archive, which has that interval.
+
+    Parameters
+    ----------
+    stat : string
+        The statistic interval, either "5min" or "daily".
+    numeric : boolean, optional
+        Whether or not the samples are numbers. If False, such as for
+        state-valued MSIDs, only the number of samples and the midvals
+        of each interval are computed. Default: True
+    """
+    def __init__(self, stat, numeric=True):
+        if stat not in stat_intervals:
+            raise RuntimeError("Unknown statistic '%s'! Valid statistics are %s."
+                               % (stat, list(stat_intervals)))
+        self.stat = stat
+        self.dt = stat_intervals[stat]
+        self.numeric = numeric
+        self.stats = None
+        self._times = np.zeros(0)
+        self._values = None
+        self._tstart = None
+
+    @property
+    def size(self):
+        """
+        The number of complete intervals which have been rolled up.
+        """
+        return 0 if self.stats is None else self.stats["times"].size
+
+    def update(self, times, values):
+        """
+        Add the samples *values* at the sorted *times* (in seconds),
+        which must all come after the samples which have already been
+        added. Returns the statistics of the intervals which have been
+        completed by these samples, as a dict of arrays.
+        """
+        if self._values is not None:
+            times = np.concatenate([self._times, times])
+            values = np.concatenate([self._values, values])
+        if times.size == 0:
+            return None
+        if self._tstart is None:
+            # The start of the first complete interval
+            self._tstart = np.ceil(times[0] / self.dt) * self.dt
+        if times[0] < self._tstart:
+            i = np.searchsorted(times, self._tstart)
+            times = times[i:]
+            values = values[i:]
+            if times.size == 0:
+                return None
+        index = np.floor(times / self.dt).astype('int64')
+        ndone = np.searchsorted(index, index[-1])
+        self._times = times[ndone:]
+        self._values = values[ndone:]
+        if ndone == 0:
+            return None
+        # The first sample of the last interval ends the weight of the
+        # last sample of the complete intervals
+        new = _bin_stats(times[:ndone], values[:ndone], self.dt,
+                         times[ndone], numeric=self.numeric)
+        if self.stats is None:
+            self.stats = new
+        else:
+            self.stats = dict((k, np.concatenate([v, new[k]]))
+                              for k, v in self.stats.items())
+        return new
@@ -2,8 +2,10 @@ from astropy.io import ascii
 import requests
 from acispy.units import get_units
 from acispy.utils import get_time, ensure_list, find_load, calc_off_nom_rolls
-from acispy.units import APQuantity, APStringArray, Quantity
+from acispy.units import APQuantity, APStringArray, Quantity, \
+    APCategoricalArray, RegularTimes, Mask, get_mask
 from acispy.time_series import TimeSeriesData
+from acispy.cache import states_cache
 import numpy as np
 from Chandra.Time import date2secs
 from collections import OrderedDict
@@ -26,6 +28,117 @@ state_dtypes = {"ccd_count": "int",
                 "clocking":  "int"}
 
 
+class StateIndex(object):
+    """
+    An index of the time intervals of a set of states, which finds the
+    state that each of an array of times falls in with one search.
+
+    State *i* covers the times from *tstart[i]* up to but not including
+    *tstop[i]*, except for the last state, which also covers its stop
+    time. So a time on the boundary between two states is in the later
+    one. Times before the first state, after the last state, or in a
+    gap between two states are not covered by any state.
+
+    Parameters
+    ----------
+    tstart : NumPy array
+        The start times of the states in seconds, in increasing order.
+    tstop : NumPy array
+        The stop times of the states in seconds.
+    """
+    def __init__(self, tstart, tstop):
+        self.tstart = np.asarray(tstart, dtype='float64')
+        self.tstop = np.asarray(tstop, dtype='float64')
+        self.size = self.tstart.size
+        self._last = None
+
+    def locate(self, times):
+        """
+        Find the states which the *times* in seconds fall in. Returns the
+        index of the state for each time and a boolean array which is
+        False for the times which are not covered by any state. Those
+        times are given the index of the last state to start before
+        them, or of the first state if there is none.
+        """
+        # The result for a shared, read-only time base is kept, since
+        # many states are usually sampled at the same times
+        last = self._last
+        if last is not None and last[0] is times:
+            return last[1], last[2]
+        t = np.asarray(getattr(times, "value", times), dtype='float64')
+        if self.size == 0:
+            raise RuntimeError("There are no states to look up times in!")
+        idxs = np.searchsorted(self.tstart, t, side='right') - 1
+        covered = idxs >= 0
+        idxs = np.maximum(idxs, 0)
+        stop = self.tstop[idxs]
+        covered &= (t < stop) | ((idxs == self.size - 1) & (t == stop))
+        if isinstance(times, RegularTimes) or \
+                (isinstance(times, Quantity) and not times.flags.writeable):
+            self._last = times, idxs, covered
+        return idxs, covered
+
+
+def get_state_index(states):
+    """
+    Return the :class:`StateIndex` of the states *states*, which is
+    built the first time it is needed and kept with them.
+    """
+    index = getattr(states, "_state_index", None)
+    if index is None:
+        index = StateIndex(states["tstart"].value, states["tstop"].value)
+        states._state_index = index
+    return index
+
+
+def _take_state(v, idxs, times, mask):
+    mask2 = get_mask(v)
+    if mask2 is not None:
+        mask = mask2[idxs] & mask
+    if isinstance(v, APCategoricalArray):
+        return APCategoricalArray(v.codes[idxs], v.categories, times, mask=mask)
+    elif isinstance(v, APStringArray):
+        return APStringArray(v.value[idxs], times, mask=mask)
+    else:
+        return APQuantity(v.value[idxs], times, unit=v.unit, dtype=v.dtype,
+                          mask=mask, copy=False)
+
+
+def sample_states(states, keys, times):
+    """
+    Sample the states *states* at an array of times. Each time takes the
+    values of the state it falls in, as defined by :class:`StateIndex`.
+    Times which are not covered by any state take the values of the last
+    state to start before them (or of the first state, for times before
+    all of them), and are marked as bad in the masks of the results.
+
+    Parameters
+    ----------
+    states : :class:`States`
+        The states to sample.
+    keys : string or list of strings
+        The names of the states to sample.
+    times : array of times
+        The times to sample the states at, in seconds from the beginning
+        of the mission or as date strings.
+
+    Returns an OrderedDict of the sampled states, which share the
+    *times* as their time base.
+    """
+    keys = ensure_list(keys)
+    t = getattr(times, "value", times)
+    if not isinstance(times, (Quantity, RegularTimes)):
+        t = np.atleast_1d(t)
+        if t.dtype.char in ['S', 'U']:
+            t = date2secs(t)
+        times = Quantity(np.asarray(t, dtype='float64'), "s")
+        times.flags.writeable = False
+    idxs, covered = get_state_index(states).locate(times)
+    mask = Mask.from_array(covered)
+    return OrderedDict((k, _take_state(states[k], idxs, times, mask))
+                       for k in keys)
+
+
 class States(TimeSeriesData):
 
     def __init__(self, table):
@@ -50,10 +163,13 @@ class States(TimeSeriesData):
         for k in state_names:
             v = np.asarray(table[k])
             if k == "trans_keys" and v.dtype.char == "O":
-                new_table[k] = APStringArray(
+                new_table[k] = APCategoricalArray.from_array(
                     np.array([",".join(d) for d in v]), times)
-            elif v.dtype.char in ['S', 'U', 'O']:
+            elif k in ["datestart", "datestop"]:
                 new_table[k] = APStringArray(v, times)
+            elif v.dtype.char in ['S', 'U', 'O']:
+                # Text states only take a few distinct values
+                new_table[k] = APCategoricalArray.from_array(v, times)
             else:
                 new_table[k] = APQuantity(v, times, get_units("states", k),
                                           dtype=v.dtype)
@@ -64,18 +180,28 @@ class States(TimeSeriesData):
 
     @classmethod
     def from_hdf5(cls, g):
-        table = dict((k, g[k][()]) for k in g)
-        cls(table)
+        table = {}
+        for k in g:
+            table[k] = g[k][()]
+            if "categories" in g[k].attrs:
+                table[k] = g[k].attrs["categories"].astype("str")[table[k]]
+        return cls(table)
 
     @classmethod
-    def from_kadi_states(cls, tstart, tstop, state_keys=None):
+    def from_kadi_states(cls, tstart, tstop, state_keys=None, use_cache=None):
         from kadi.commands import states
         tstart = get_time(tstart)
         tstop = get_time(tstop)
         if state_keys is not None:
             state_keys = ensure_list(state_keys)
-        t = states.get_states(tstart, tstop, state_keys=state_keys,
-                              merge_identical=True).as_array()
+        if use_cache is None:
+            use_cache = states_cache.enabled
+        if use_cache:
+            t = states_cache.get_states(date2secs(tstart), date2secs(tstop),
+                                        state_keys=state_keys)
+        else:
+            t = states.get_states(tstart, tstop, state_keys=state_keys,
+                                  merge_identical=True).as_array()
         return cls(t)
 
     @classmethod
@@ -124,15 +250,26 @@ class States(TimeSeriesData):
                               merge_identical=True).as_array()
         return cls(t)
 
+    def sample(self, keys, times):
+        """
+        Sample the states *keys* at an array of *times* in seconds or
+        date strings, returning an OrderedDict of the sampled states.
+        See :func:`sample_states` for how times on the boundaries of
+        or outside of the states are handled.
+        """
+        return sample_states(self, keys, times)
+
     def get_states(self, time):
         """
         Get the commanded states at a given *time*.
         """
         time = get_time(time, 'secs')
-        state = {}
-        for key in self.keys():
-            state[key] = self[key][time]
-        return state
+        index = get_state_index(self)
+        if index.size == 0 or time < index.tstart[0] or time > index.tstop[-1]:
+            raise RuntimeError("The time %s is outside the bounds of these "
+                               "states!" % time)
+        samples = self.sample(list(self.keys()), [time])
+        return dict((k, v[0]) for k, v in samples.items())
 
     def as_array(self):
         dtype = [(k, str(v.dtype)) for k, v in self.table.items()]
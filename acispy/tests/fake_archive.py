@@ -0,0 +1,58 @@
+"""
+A fake engineering archive backend for the tests and benchmarks, which
+stands in for ``Ska.engarchive.fetch_sci.MSIDset`` and makes up the
+values of each MSID from its name, optionally taking some time to fetch
+each MSID like a real archive does.
+"""
+import time
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from Chandra.Time import DateTime
+import Ska.engarchive.fetch_sci as fetch
+
+
+class FakeMSID(object):
+    def __init__(self, msid, tstart, tstop, stat='5min', filter_bad=False):
+        dt = {None: 32.8, "5min": 328.0, "daily": 86400.0}[stat]
+        seed = sum(ord(c) for c in msid)
+        self.msid = msid.upper()
+        self.times = np.arange(tstart, tstop, dt)
+        self.vals = np.sin(self.times/1.0e4 + seed) * 10.0 + seed
+        bads = (np.arange(self.times.size) + seed) % 97 == 0
+        if filter_bad:
+            self.times = self.times[~bads]
+            self.vals = self.vals[~bads]
+            self.bads = None
+        else:
+            self.bads = bads
+        self.state_codes = None
+
+
+class FakeMSIDset(OrderedDict):
+    latency = 0.0
+
+    def __init__(self, msids, start, stop=None, filter_bad=False,
+                 stat='5min'):
+        super(FakeMSIDset, self).__init__()
+        self.tstart = DateTime(start).secs
+        self.tstop = DateTime(stop).secs
+        for msid in msids:
+            time.sleep(self.latency)
+            self[msid] = FakeMSID(msid, self.tstart, self.tstop, stat=stat,
+                                  filter_bad=filter_bad)
+
+
+@contextmanager
+def fake_archive(latency=0.0):
+    """
+    Replace the engineering archive with the fake one while in the
+    context, where fetching each MSID takes *latency* seconds.
+    """
+    old = fetch.MSIDset
+    FakeMSIDset.latency = latency
+    fetch.MSIDset = FakeMSIDset
+    try:
+        yield
+    finally:
+        fetch.MSIDset = old
@@ -0,0 +1,50 @@
+import numpy as np
+from acispy.cache import FieldCache
+
+field = ("msids", "1deamzt")
+
+
+def _make_cache():
+    cache = FieldCache()
+    cache.put(field, np.arange(10.0))
+    cache.put(field, np.arange(10.0) + 100.0, kind="times")
+    cache.put(field, np.array(["2020:001"]*10), kind="dates")
+    return cache
+
+
+def test_pop_data():
+    cache = _make_cache()
+    value = cache.pop(field, kind="data")
+    np.testing.assert_array_equal(value, np.arange(10.0))
+    assert field not in cache
+    assert cache.get(field, kind="times") is not None
+    assert cache.get(field, kind="dates") is not None
+
+
+def test_pop_times():
+    cache = _make_cache()
+    value = cache.pop(field, kind="times")
+    np.testing.assert_array_equal(value, np.arange(10.0) + 100.0)
+    assert field in cache
+    assert cache.get(field, kind="times") is None
+    assert cache.get(field, kind="dates") is not None
+
+
+def test_pop_dates():
+    cache = _make_cache()
+    value = cache.pop(field, kind="dates")
+    assert value.size == 10
+    assert field in cache
+    assert cache.get(field, kind="times") is not None
+    assert cache.get(field, kind="dates") is None
+
+
+def test_pop_all():
+    cache = _make_cache()
+    value = cache.pop(field)
+    np.testing.assert_array_equal(value, np.arange(10.0))
+    assert field not in cache
+    assert cache.get(field, kind="times") is None
+    assert cache.get(field, kind="dates") is None
+    assert cache.size == 0
+    assert cache.pop(field, default=-1) == -1
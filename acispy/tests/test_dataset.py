@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from acispy.dataset import Dataset
+from acispy.msids import MSIDs
+from acispy.states import States
+from acispy.time_series import EmptyTimeSeries
+
+
+def _make_dataset():
+    t = np.arange(0.0, 1000.0, 10.0)
+    fmts = np.array(["FMT1"]*50 + ["FMT2"]*50)
+    msids = MSIDs({"1deamzt": np.arange(100.0), "ccsdstmf": fmts},
+                  {"1deamzt": t, "ccsdstmf": t + 3.0})
+    states = States({"tstart": np.array([0.0, 300.0, 600.0]),
+                     "tstop": np.array([300.0, 600.0, 1000.0]),
+                     "datestart": np.array(["D0", "D300", "D600"]),
+                     "datestop": np.array(["D300", "D600", "D1000"]),
+                     "pitch": np.array([90.0, 100.0, 110.0]),
+                     "pcad_mode": np.array(["NPNT", "NMAN", "NPNT"]),
+                     "hetg": np.array(["RETR"]*3),
+                     "letg": np.array(["RETR"]*3),
+                     "simpos": np.array([75000.0]*3),
+                     "off_nom_roll": np.zeros(3)})
+    return Dataset(msids, states, EmptyTimeSeries())
+
+
+def test_align_strings():
+    ds = _make_dataset()
+    fields = [("msids", "1deamzt"), ("msids", "ccsdstmf"),
+              ("states", "pcad_mode")]
+    aligned = ds.align(fields, ("msids", "1deamzt"))
+    t = ds.times("msids", "1deamzt").value
+    for v in aligned.values():
+        np.testing.assert_array_equal(v.times.value, t)
+    np.testing.assert_array_equal(aligned["msids", "1deamzt"].value,
+                                  np.arange(100.0))
+    # String MSIDs are taken from the nearest sample
+    fmt = aligned["msids", "ccsdstmf"].value
+    assert fmt[49] == "FMT1"
+    assert fmt[50] == "FMT2"
+    # States take the state each time falls in
+    mode = aligned["states", "pcad_mode"].value
+    assert mode[29] == "NPNT"
+    assert mode[30] == "NMAN"
+    assert mode[60] == "NPNT"
+
+
+def test_determine_field():
+    ds = _make_dataset()
+    assert ds._determine_field("1DEAMZT") == ("msids", "1deamzt")
+    assert ds._determine_field(("MSIDS", "ccsdstmf")) == ("msids", "ccsdstmf")
+    assert ds._determine_field("pcad_mode") == ("states", "pcad_mode")
+    with pytest.raises(RuntimeError, match="Cannot find field"):
+        ds._determine_field("1pdeaat")
+    # Fields added later are found by name, and names which are now in
+    # more than one field type are reported as ambiguous
+    ds.add_averaged_field("1deamzt")
+    assert ds._determine_field("avg_1deamzt") == ("msids", "avg_1deamzt")
+    ds.map_state_to_msid("pitch", "1deamzt")
+    with pytest.raises(RuntimeError, match="Multiple field types") as exc:
+        ds._determine_field("pitch")
+    assert "('msids', 'pitch')" in str(exc.value)
+    assert "('states', 'pitch')" in str(exc.value)
@@ -0,0 +1,65 @@
+import warnings
+import concurrent.futures
+import numpy as np
+import acispy.fields
+from acispy.fields import calc_earth_solid_angles, \
+    calc_earth_solid_angles_adaptive
+
+
+def _fake_earth_vis(ephem, q_att):
+    # A smooth stand-in for acis_taco.calc_earth_vis
+    return None, np.array([1.0e-3*np.sin(ephem[0]/1.0e7), 1.0e-4]), None
+
+
+class _CountingExecutor(object):
+    # Runs the work in this process and counts the pools created
+    created = 0
+
+    def __init__(self, max_workers=None):
+        _CountingExecutor.created += 1
+
+    def map(self, func, *iterables):
+        return map(func, *iterables)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def _make_inputs(n=4000):
+    times = np.arange(n) * 32.8
+    ephems = np.zeros((n, 3))
+    ephems[:, 0] = np.linspace(0.0, 1.0e8, n)
+    q_atts = np.tile([0.0, 0.0, 0.0, 1.0], (n, 1))
+    return times, ephems, q_atts
+
+
+def test_adaptive_one_pool(monkeypatch):
+    monkeypatch.setattr(acispy.fields, "calc_earth_vis", _fake_earth_vis)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor",
+                        _CountingExecutor)
+    _CountingExecutor.created = 0
+    times, ephems, q_atts = _make_inputs()
+    exact = calc_earth_solid_angles(ephems, q_atts)
+    vals, num_evals = calc_earth_solid_angles_adaptive(
+        times, ephems, q_atts, 1.0e-7, nprocs=4, chunk_size=10)
+    assert _CountingExecutor.created == 1
+    assert num_evals < times.size
+    np.testing.assert_allclose(vals, exact, rtol=0, atol=1.0e-6)
+
+
+def test_adaptive_repeated_times(monkeypatch):
+    monkeypatch.setattr(acispy.fields, "calc_earth_vis", _fake_earth_vis)
+    times, ephems, q_atts = _make_inputs(200)
+    # A run of samples with the same time
+    times[40:60] = times[40]
+    times[60:] -= times[60] - times[40]
+    exact = calc_earth_solid_angles(ephems, q_atts)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        vals, num_evals = calc_earth_solid_angles_adaptive(
+            times, ephems, q_atts, 1.0e-7)
+    assert np.isfinite(vals).all()
+    np.testing.assert_array_equal(vals[40:60], exact[40:60])
@@ -0,0 +1,72 @@
+import numpy as np
+from acispy.msids import MSIDs
+from acispy.tests.fake_archive import fake_archive
+
+msid_list = ["1deamzt", "1dpamzt", "1pdeaat", "1pin1at", "tmp_fep1_mong",
+             "1dp28avo", "1dpicacu"]
+
+
+def test_concurrent_fetch():
+    with fake_archive():
+        serial = MSIDs.from_database(msid_list, "2020:001:00:00:00",
+                                     "2020:011:00:00:00", use_cache=False)
+        parallel = MSIDs.from_database(msid_list, "2020:001:00:00:00",
+                                       "2020:011:00:00:00", max_workers=4,
+                                       use_cache=False)
+    assert list(serial.keys()) == list(parallel.keys())
+    for k in serial.keys():
+        np.testing.assert_array_equal(serial[k].value, parallel[k].value)
+        np.testing.assert_array_equal(serial[k].times.value,
+                                      parallel[k].times.value)
+        np.testing.assert_array_equal(serial[k].mask, parallel[k].mask)
+    assert not parallel["1deamzt"].mask.all()
+
+
+def test_interpolate_samples():
+    with fake_archive():
+        raw = MSIDs.from_database(msid_list, "2020:001:00:00:00",
+                                  "2020:003:00:00:00", use_cache=False)
+        t = raw["1deamzt"].times.value
+        new_times = 0.5*(t[1:] + t[:-1]) + 10.0
+        for method in ["nearest", "linear"]:
+            interp = MSIDs.from_database(msid_list, "2020:001:00:00:00",
+                                         "2020:003:00:00:00",
+                                         interpolate=method,
+                                         interpolate_times=new_times,
+                                         use_cache=False)
+            for k in msid_list:
+                # Each value and its bad flag come from a fetched sample
+                v = interp[k].value
+                idxs = np.searchsorted(raw[k].value, v,
+                                       sorter=np.argsort(raw[k].value))
+                idxs = np.argsort(raw[k].value)[idxs]
+                np.testing.assert_array_equal(raw[k].value[idxs], v)
+                np.testing.assert_array_equal(raw[k].mask[idxs],
+                                              interp[k].mask)
+                np.testing.assert_array_equal(interp[k].times.value,
+                                              new_times)
+
+
+def test_mit_file(tmpdir):
+    from Chandra.Time import date2secs
+    filename = str(tmpdir.join("test.mit"))
+    bilevels = ["b01100110", "0", "b11110000", "b00000001"]
+    with open(filename, "w") as f:
+        f.write("YEAR,DOY,SEC,BEP_PCB,BILEVELS\n")
+        f.write("2016,366,86399.5,10.5,b01100110\n")
+        f.write("2017,1,0.25,11.0,0\n")
+        f.write("2017,1,3600.0,11.5,b11110000\n")
+        f.write("2017,32,43200.125,12.0,b00000001\n")
+    msids = MSIDs.from_mit_file(filename)
+    expected = date2secs(["2016:366:23:59:59.500", "2017:001:00:00:00.250",
+                          "2017:001:01:00:00.000", "2017:032:12:00:00.125"])
+    np.testing.assert_allclose(msids["tmp_bep_pcb"].times.value, expected,
+                               rtol=0, atol=1.0e-3)
+    np.testing.assert_array_equal(msids["tmp_bep_pcb"].value,
+                                  [10.5, 11.0, 11.5, 12.0])
+    good = np.array([b != "0" for b in bilevels])
+    for i in range(8):
+        v = msids["1stat%dst" % (7-i)]
+        np.testing.assert_array_equal(v.mask, good)
+        np.testing.assert_array_equal(
+            v.value, [b[i+1] if b != "0" else "BAD" for b in bilevels])
@@ -0,0 +1,76 @@
+import numpy as np
+from acispy.rollup import StatsRollup
+
+
+def _make_samples(n=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    # Irregular sampling, with a gap of a few intervals
+    dts = rng.uniform(1.0, 60.0, n)
+    dts[n//2] = 2000.0
+    times = 6.0e8 + 17.0 + np.cumsum(dts)
+    values = rng.normal(20.0, 3.0, n)
+    return times, values
+
+
+def _naive_stats(times, values, dt):
+    # Weight each sample by the time to the next sample, up to the end
+    # of its interval, and only roll up the complete intervals
+    index = np.floor(times / dt).astype('int64')
+    stats = dict((k, []) for k in ["times", "means", "stds", "samples"])
+    # The interval of the first sample is partial
+    for i in np.unique(index)[1:-1]:
+        idxs = np.flatnonzero(index == i)
+        w = np.minimum(times[idxs + 1], (i + 1) * dt) - times[idxs]
+        mean = np.sum(w * values[idxs]) / np.sum(w)
+        std = np.sqrt(np.sum(w * (values[idxs] - mean)**2) / np.sum(w))
+        stats["times"].append((i + 0.5) * dt)
+        stats["means"].append(mean)
+        stats["stds"].append(std)
+        stats["samples"].append(idxs.size)
+    return stats
+
+
+def test_weighted_stats():
+    times, values = _make_samples()
+    r = StatsRollup("5min")
+    r.update(times, values)
+    expected = _naive_stats(times, values, 328.0)
+    for k, v in expected.items():
+        np.testing.assert_allclose(r.stats[k], v, rtol=1.0e-10)
+    # Evenly spaced samples have the unweighted mean
+    t = np.arange(0.0, 3280.0, 4.1) + 328.0 * 1000
+    r = StatsRollup("5min")
+    r.update(t, np.sin(t))
+    np.testing.assert_allclose(r.stats["means"][0], np.sin(t[:80]).mean())
+
+
+def test_incremental_update():
+    times, values = _make_samples()
+    r_all = StatsRollup("5min")
+    r_all.update(times, values)
+    r = StatsRollup("5min")
+    num_new = 0
+    for chunk in np.array_split(np.arange(times.size), 37):
+        new = r.update(times[chunk], values[chunk])
+        if new is not None:
+            num_new += new["times"].size
+    assert num_new == r.size == r_all.size
+    for k, v in r_all.stats.items():
+        np.testing.assert_allclose(r.stats[k], v, rtol=1.0e-12)
+
+
+def test_partial_first_interval():
+    t = np.arange(0.0, 3280.0, 32.8) + 328.0 * 1000
+    v = np.arange(t.size, dtype='float64')
+    r = StatsRollup("5min")
+    r.update(t, v)
+    assert r.stats["times"][0] == 328.0 * 1000.5
+    assert r.stats["samples"][0] == 10
+    # Starting partway into an interval skips it, even if none of its
+    # samples are after the first update
+    r2 = StatsRollup("5min")
+    assert r2.update(t[5:8], v[5:8]) is None
+    r2.update(t[8:], v[8:])
+    assert r2.size == r.size - 1
+    for k, s in r2.stats.items():
+        np.testing.assert_array_equal(s, r.stats[k][1:])
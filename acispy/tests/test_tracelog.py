@@ -0,0 +1,56 @@
+import numpy as np
+from acispy.tracelog import read_tracelog, read_tracelog_header
+
+dtype = [("time", "<f8"), ("1deamzt", "<f8"), ("ccsdstmf", "|U4"),
+         ("1dpamzt", "<f8")]
+
+
+def _write_tracelog(tmpdir, nlines=2000):
+    filename = str(tmpdir.join("test.tl"))
+    with open(filename, "w") as f:
+        f.write("TIME 1DEAMZT CCSDSTMF 1DPAMZT\n")
+        for i in range(nlines):
+            if i % 337 == 5:
+                # Malformed lines are skipped
+                f.write("%.2f %.3f\n" % (5.0e8 + i*32.8, i*0.5))
+            elif i % 401 == 7:
+                f.write("\n")
+            else:
+                f.write("%.2f\t%.3f  FMT%d %.3f\n" %
+                        (5.0e8 + i*32.8, i*0.5, i % 6 + 1, -i*0.25))
+    return filename
+
+
+def _read_tracelog_lines(filename):
+    # Parse the file a line at a time, for comparison
+    with open(filename, "r") as f:
+        f.readline()
+        data = [tuple(words) for words in (line.split() for line in f)
+                if len(words) == len(dtype)]
+    return np.array(data, dtype=dtype)
+
+
+def test_read_tracelog(tmpdir):
+    filename = _write_tracelog(tmpdir)
+    header, offset = read_tracelog_header(filename)
+    assert header == ["TIME", "1DEAMZT", "CCSDSTMF", "1DPAMZT"]
+    expected = _read_tracelog_lines(filename)
+    # Small chunks make lines straddle the chunk boundaries
+    for chunk_size in [1 << 24, 1000, 37]:
+        data, end = read_tracelog(filename, dtype, start=offset,
+                                  chunk_size=chunk_size)
+        assert end == len(open(filename, "rb").read())
+        for name, _ in dtype:
+            np.testing.assert_array_equal(data[name], expected[name])
+
+
+def test_read_tracelog_partial_line(tmpdir):
+    filename = _write_tracelog(tmpdir, nlines=100)
+    size = len(open(filename, "rb").read())
+    with open(filename, "a") as f:
+        f.write("%.2f %.3f FMT2" % (6.0e8, 1.0))
+    _, offset = read_tracelog_header(filename)
+    data, end = read_tracelog(filename, dtype, start=offset)
+    # A last line without a newline is still being written
+    assert end == size
+    assert data["time"][-1] < 6.0e8
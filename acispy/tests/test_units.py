@@ -0,0 +1,112 @@
+import numpy as np
+from astropy.units import Quantity
+from acispy.units import APQuantity, APStringArray, align_array
+
+
+def _make_quantity():
+    times = Quantity(np.arange(10.0), "s")
+    mask = np.ones(10, dtype='bool')
+    mask[[2, 5]] = False
+    return APQuantity(np.arange(10.0), times, unit="deg_C", mask=mask)
+
+
+def test_ufunc_mask():
+    q = _make_quantity()
+    q2 = q*2
+    np.testing.assert_array_equal(q2.mask, q.mask)
+    q3 = q + APQuantity(np.ones(10), q.times, unit="deg_C",
+                        mask=np.arange(10) != 7)
+    np.testing.assert_array_equal(q3.mask, q.mask & (np.arange(10) != 7))
+
+
+def test_scalar_mask():
+    q = _make_quantity()
+    for bad in [q - q[5], q[5] - q, q[5]*np.ones(10)]:
+        assert bad.shape == (10,)
+        assert not bad.mask.any()
+    good = q - q[4]
+    np.testing.assert_array_equal(good.mask, q.mask)
+    np.testing.assert_array_equal(good.value, q.value - 4.0)
+    assert q[5].mask.shape == ()
+    assert not (q[5]*2).mask
+
+
+def test_reduction_mask():
+    q = _make_quantity()
+    for ret in [q.sum(), np.mean(q), np.max(q), np.add.reduce(q)]:
+        assert ret.shape == ()
+        assert ret.mask.shape == ()
+    assert q.sum().value == 45.0
+
+
+def test_align_strings():
+    times = Quantity(np.arange(10.0), "s")
+    v = APStringArray(np.array(["A"]*5 + ["B"]*5), times)
+    new_times = Quantity(np.array([0.2, 4.4, 4.6, 9.0]), "s")
+    aligned = align_array(v, new_times)
+    np.testing.assert_array_equal(aligned.value, ["A", "A", "B", "B"])
+    assert aligned.times is new_times
+
+
+def test_regular_times_arithmetic():
+    from acispy.units import RegularTimes
+    rt = RegularTimes(100.0, 10.0, 5)
+    t = Quantity(np.arange(100.0, 150.0, 10.0), "s")
+    t0 = Quantity(100.0, "s")
+    np.testing.assert_array_equal((rt - t0).value, (t - t0).value)
+    np.testing.assert_array_equal((t0 + rt).value, (t0 + t).value)
+    np.testing.assert_array_equal((rt*1).value, t.value)
+    np.testing.assert_array_equal((2.0*rt).value, 2.0*t.value)
+    np.testing.assert_array_equal((rt/2.0).value, t.value/2.0)
+    np.testing.assert_array_equal((-rt).value, -t.value)
+    np.testing.assert_array_equal((rt[1:] - rt[:-1]).value, [10.0]*4)
+    np.testing.assert_array_equal((rt - t).value, np.zeros(5))
+    assert (rt - t0).unit == "s"
+    np.testing.assert_array_equal(np.subtract(rt, t0).value,
+                                  (t - t0).value)
+    np.testing.assert_array_equal(np.diff(rt), [10.0]*4)
+
+
+def test_regular_times_comparison():
+    from acispy.units import RegularTimes
+    rt = RegularTimes(100.0, 10.0, 5)
+    x = Quantity(120.0, "s")
+    np.testing.assert_array_equal(rt > x, [False, False, False, True, True])
+    np.testing.assert_array_equal(rt >= x, [False, False, True, True, True])
+    np.testing.assert_array_equal(rt < x, [True, True, False, False, False])
+    np.testing.assert_array_equal(rt <= x, [True, True, True, False, False])
+    np.testing.assert_array_equal(x < rt, rt > x)
+    np.testing.assert_array_equal(np.greater(rt, x), rt > x)
+    assert rt == RegularTimes(100.0, 10.0, 5)
+
+
+def test_lazy_mask():
+    from acispy.units import get_mask
+    times = Quantity(np.arange(10.0), "s")
+    v = APQuantity(np.full(10, 28.0), times, unit="V")
+    i = APQuantity(np.full(10, 1.5), times, unit="A")
+    assert get_mask(v) is None
+    assert get_mask(v*i) is None
+    np.testing.assert_array_equal(v.mask, np.ones(10, dtype='bool'))
+    q = _make_quantity()
+    np.testing.assert_array_equal(q[1:7].mask, q.mask[1:7])
+    np.testing.assert_array_equal((q*v.value).mask, q.mask)
+
+
+def test_views():
+    q = _make_quantity()
+    s = q[2:8]
+    assert np.shares_memory(s.value, q.value)
+    np.testing.assert_array_equal(s.times, q.times[2:8])
+    np.testing.assert_array_equal(s.mask, q.mask[2:8])
+    v = APQuantity(np.full(10, 28.0), q.times, unit="V", mask=q.mask)
+    i = APQuantity(np.full(10, 1.5), q.times, unit="A")
+    p = v*i
+    w = p.to("W")
+    assert w.unit == "W"
+    assert np.shares_memory(w.value, p.value)
+    np.testing.assert_array_equal(w.mask, q.mask)
+    np.testing.assert_allclose(w.value, 42.0)
+    mw = w.to("mW")
+    assert not np.shares_memory(mw.value, w.value)
+    np.testing.assert_allclose(mw.value, 42000.0)
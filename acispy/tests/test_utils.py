@@ -0,0 +1,44 @@
+import numpy as np
+from Chandra.Time import date2secs
+import acispy.utils
+from acispy.utils import ydoy2secs
+
+
+def test_ydoy2secs_leap_table():
+    # Build the leap table from Chandra.Time rather than a cached one
+    acispy.utils._leap_table = None
+    dates = [(1999, 1, 0.0), (2005, 365, 86399.5), (2006, 1, 0.0),
+             (2012, 182, 43200.25), (2016, 366, 86399.0),
+             (2017, 1, 0.0), (2020, 60, 1234.5)]
+    year, doy, sec = [np.array(a) for a in zip(*dates)]
+    secs = ydoy2secs(year, doy, sec)
+    expected = date2secs(["%04d:%03d:%02d:%02d:%06.3f" %
+                          (y, d, s // 3600, (s % 3600) // 60, s % 60)
+                          for y, d, s in dates])
+    np.testing.assert_allclose(secs, expected, rtol=0, atol=1.0e-3)
+
+
+def test_ydoy2secs_leap_second():
+    acispy.utils._leap_table = None
+    # 2016:366:23:59:60 is a leap second
+    secs = ydoy2secs([2016, 2016, 2017], [366, 366, 1],
+                     [86399.0, 86400.0, 0.0])
+    np.testing.assert_allclose(np.diff(secs), [1.0, 1.0], rtol=0,
+                               atol=1.0e-6)
+
+
+def test_calc_off_nom_rolls():
+    import Ska.Sun
+    from acispy.utils import calc_off_nom_rolls
+    rng = np.random.RandomState(42)
+    n = 200
+    tstart = np.sort(rng.uniform(5.0e8, 7.0e8, n))
+    q = rng.normal(size=(n, 4))
+    q /= np.sqrt(np.sum(q**2, axis=1))[:, np.newaxis]
+    states = {"tstart": tstart, "tstop": tstart + 3600.0}
+    for i in range(4):
+        states["q%d" % (i+1)] = q[:, i]
+    rolls = calc_off_nom_rolls(states)
+    expected = [Ska.Sun.off_nominal_roll(att, t)
+                for att, t in zip(q, tstart + 1800.0)]
+    np.testing.assert_allclose(rolls, expected, rtol=0, atol=1.0e-8)
@@ -8,6 +8,7 @@ import numpy as np
 from Chandra.Time import secs2date, DateTime, date2secs
 from acispy.states import States
 from acispy.model import Model
+from acispy.units import TimeAlignment, get_alignment, intern_times
 from acispy.msids import MSIDs
 from acispy.time_series import EmptyTimeSeries
 from acispy.utils import mylog, \
@@ -142,9 +143,8 @@ class ModelDataset(Dataset):
                 if self.states._is_empty:
                     out += [("model", state) for state in states_to_map]
                 else:
-                    for state in states_to_map:
-                        self.map_state_to_msid(state, msid)
-                        out.append(("msids", state))
+                    self.map_states_to_msid(states_to_map, msid)
+                    out += [("msids", state) for state in states_to_map]
             out.append(("model", msid))
             if ("msids", msid) in self.field_list:
                 self.add_diff_data_model_field(msid)
@@ -513,17 +513,21 @@ class ThermalModelRunner(ModelDataset):
         ephem = {}
         if self.ephem_file is None:
             e = fetch.MSIDset(msids, tstart - 2000.0, tstop + 2000.0)
+            # The ephemeris MSIDs usually share their times
+            bases = intern_times(dict((msid, e[msid].times) for msid in msids))
+            times = Quantity(times, "s")
+            times.flags.writeable = False
             for msid in msids:
-                ephem[msid] = Ska.Numpy.interpolate(e[msid].vals, e[msid].times,
-                                                    times)
+                alignment = get_alignment(bases[msid], times)
+                ephem[msid] = alignment.take(e[msid].vals)
         else:
             e = ascii.read(self.ephem_file)
             msids = ['orbitephem0_{}'.format(axis) for axis in "xyz"]
             idxs = np.logical_and(e["times"] >= tstart - 2000.0,
                                   e["times"] <= tstop + 2000.0)
+            alignment = TimeAlignment(e["times"][idxs], times)
             for msid in msids:
-                ephem[msid] = Ska.Numpy.interpolate(e[msid][idxs],
-                                                    e["times"][idxs], times)
+                ephem[msid] = alignment.take(np.asarray(e[msid][idxs]))
         return ephem
 
     def _compute_model(self, name, tstart, tstop, dt, T_init,
@@ -1037,8 +1041,8 @@ class SimulateSingleObs(ThermalModelRunner):
         past the beginning of the ECS run.
         """
         t += self.tstart.value
-        return Quantity(np.interp(t, self['model', self.name].times.value,
-                                  self['model', self.name].value), "deg_C")
+        mvals = self['model', self.name]
+        return Quantity(TimeAlignment(mvals.times, t).take(mvals.value), "deg_C")
 
     @property
     def mvals(self):
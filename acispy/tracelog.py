@@ -0,0 +1,311 @@
+import io
+import os
+import numpy as np
+
+# Lookup table of the bytes which separate the columns of a tracelog file
+is_whitespace = np.zeros(256, dtype='bool')
+is_whitespace[[ord(c) for c in " \t\r\n\v\f"]] = True
+
+
+def read_tracelog_header(filename):
+    """
+    Read the header line of the tracelog file *filename*. Returns the
+    list of column names and the byte offset of the first line of data.
+    """
+    with open(filename, "rb") as f:
+        line = f.readline()
+    return line.decode().split(), len(line)
+
+
+def _tokenize(a, ncols):
+    """
+    Find the tokens in the array of bytes *a*, which must contain whole
+    lines. Returns the start and end offsets of the tokens as (nlines,
+    ncols) arrays, dropping all lines which do not have exactly *ncols*
+    tokens.
+    """
+    is_token = np.ones(a.size + 2, dtype='i1')
+    is_token[0] = is_token[-1] = 0
+    is_token[1:-1] = ~is_whitespace[a]
+    edges = np.diff(is_token)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    newlines = np.flatnonzero(a == ord("\n"))
+    lines = np.searchsorted(newlines, starts)
+    counts = np.bincount(lines, minlength=newlines.size + 1)
+    keep = (counts == ncols)[lines]
+    return starts[keep].reshape(-1, ncols), ends[keep].reshape(-1, ncols)
+
+
+def _gather_column(a, starts, ends):
+    """
+    Gather the tokens of one column into a fixed-width bytes array,
+    without creating a Python object for each token. The array of bytes
+    *a* must be padded past the end of the last token by at least the
+    width of the widest token.
+    """
+    width = max(int((ends - starts).max(initial=1)), 1)
+    offsets = np.arange(width)
+    chars = a[starts[:, np.newaxis] + offsets]
+    chars[offsets >= (ends - starts)[:, np.newaxis]] = 0
+    return chars.view("S%d" % width).ravel()
+
+
+def parse_tracelog_block(buf, dtype):
+    """
+    Parse a block of bytes *buf* from a tracelog file, which must contain
+    whole lines, into a structured array with the given *dtype*. Lines
+    which do not have one token for each column are skipped.
+    """
+    if not buf.strip():
+        return np.zeros(0, dtype=dtype)
+    try:
+        # NumPy's parser handles the usual case where every line is
+        # whole in one pass
+        return np.loadtxt(io.BytesIO(buf), dtype=dtype, comments=None,
+                          ndmin=1)
+    except ValueError:
+        pass
+    # Some lines are malformed, so find the tokens of every line to
+    # skip them
+    a = np.frombuffer(buf, dtype='u1')
+    starts, ends = _tokenize(a, len(dtype))
+    data = np.zeros(starts.shape[0], dtype=dtype)
+    if data.size == 0:
+        return data
+    # The last token may end at the end of the block, so pad it for
+    # gathering the tokens
+    width = int((ends - starts).max(initial=1))
+    a = np.concatenate([a, np.zeros(width, dtype='u1')])
+    for i, (name, _) in enumerate(dtype):
+        data[name] = _gather_column(a, starts[:, i], ends[:, i])
+    return data
+
+
+def read_tracelog(filename, dtype, start=0, stop=None, chunk_size=1 << 24):
+    """
+    Read the data lines of a tracelog file into a structured array with
+    the given *dtype*, parsing it in blocks of *chunk_size* bytes.
+
+    Parameters
+    ----------
+    filename : string
+        The path to the tracelog file.
+    dtype : list of (name, type) tuples
+        The dtype of the columns of the tracelog file.
+    start : integer, optional
+        The byte offset to start reading from, which must be at the
+        beginning of a line. Default: 0
+    stop : integer, optional
+        The byte offset to stop reading at. Default: None, which reads
+        to the end of the file.
+    chunk_size : integer, optional
+        The size of the blocks the file is read in. Default: 16 MB
+
+    Returns the data and the byte offset just past the last complete
+    line which was read. A final line without a newline is assumed to
+    still be in the process of being written and is not read.
+    """
+    chunks = []
+    offset = start
+    leftover = b""
+    with open(filename, "rb") as f:
+        f.seek(start)
+        while stop is None or offset < stop:
+            size = chunk_size if stop is None else min(chunk_size, stop - offset)
+            buf = f.read(size)
+            if not buf:
+                break
+            offset += len(buf)
+            buf = leftover + buf
+            last = buf.rfind(b"\n") + 1
+            leftover = buf[last:]
+            if last > 0:
+                chunks.append(parse_tracelog_block(buf[:last], dtype))
+    if stop is not None and leftover:
+        # The last line runs past the stop offset, so finish it
+        with open(filename, "rb") as f:
+            f.seek(offset)
+            rest = f.readline()
+        if rest.endswith(b"\n"):
+            chunks.append(parse_tracelog_block(leftover + rest, dtype))
+            offset += len(rest)
+            leftover = b""
+    if not chunks:
+        return np.zeros(0, dtype=dtype), offset - len(leftover)
+    return np.concatenate(chunks), offset - len(leftover)
+
+
+def _tracelog_line_time(line, delimiter):
+    # TIME column of a tracelog, converted to Chandra 1998 time
+    return float(line.split()[0]) - 410227200.
+
+
+def _mit_line_time(line, delimiter):
+    # YEAR, DOY, and SEC columns at the beginning of a MIT file line
+    from acispy.utils import ydoy2secs
+    if delimiter == " ":
+        year, doy, sec = line.split()[:3]
+    else:
+        year, doy, sec = line.split(delimiter.encode())[:3]
+    return float(ydoy2secs(int(year), int(doy), float(sec)))
+
+
+class TracelogIndex(object):
+    """
+    An index of (time, byte offset) pairs for every *stride*-th line of
+    a tracelog or MIT file, which allows a read between two times to seek
+    directly to the part of the file it needs. The index is stored in the
+    cache directory, and is extended with the new lines when the file has
+    grown since it was last indexed, or rebuilt if the file has been
+    rewritten.
+
+    Parameters
+    ----------
+    filename : string
+        The path to the tracelog or MIT file.
+    stride : integer, optional
+        The number of lines between entries in the index. Default: 256
+    delimiter : string, optional
+        The delimiter between columns, for MIT files. Default: None,
+        which means the file is a tracelog file with whitespace-separated
+        columns and the time in the first column.
+    """
+    def __init__(self, filename, stride=256, delimiter=None):
+        import hashlib
+        from acispy.cache import default_cache_dir
+        self.filename = filename
+        self.stride = stride
+        self.delimiter = delimiter
+        if delimiter is None:
+            self._line_time = _tracelog_line_time
+        else:
+            self._line_time = _mit_line_time
+        path = os.path.abspath(filename)
+        self.index_file = os.path.join(
+            default_cache_dir, "tracelog",
+            hashlib.md5(path.encode()).hexdigest() + ".npz")
+        self.times = np.zeros(0)
+        self.offsets = np.zeros(0, dtype='int64')
+        self.nlines = 0
+        self.end = 0
+        self.first_line = b""
+        self.header_size = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        with np.load(self.index_file) as f:
+            if int(f["stride"]) != self.stride:
+                return
+            self.times = f["times"]
+            self.offsets = f["offsets"]
+            self.nlines = int(f["nlines"])
+            self.end = int(f["end"])
+            self.header_size = int(f["header_size"])
+            self.first_line = f["first_line"].tobytes()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            with open(self.index_file + ".tmp", "wb") as f:
+                np.savez(f, times=self.times, offsets=self.offsets,
+                         nlines=self.nlines, end=self.end, stride=self.stride,
+                         header_size=self.header_size,
+                         first_line=np.frombuffer(self.first_line, dtype='u1'))
+            os.replace(self.index_file + ".tmp", self.index_file)
+        except OSError:
+            pass
+
+    def _is_stale(self, f, size, header_size):
+        # The file has been rewritten if it has shrunk or if its
+        # header or first data line has changed
+        if size < self.end or header_size != self.header_size:
+            return True
+        f.seek(header_size)
+        return f.readline() != self.first_line
+
+    def update(self):
+        """
+        Bring the index up to date with the file on disk.
+        """
+        _, header_size = read_tracelog_header(self.filename)
+        size = os.path.getsize(self.filename)
+        with open(self.filename, "rb") as f:
+            if self._is_stale(f, size, header_size):
+                self.times = np.zeros(0)
+                self.offsets = np.zeros(0, dtype='int64')
+                self.nlines = 0
+                self.end = header_size
+                self.header_size = header_size
+                f.seek(header_size)
+                self.first_line = f.readline()
+            if size == self.end:
+                return
+            f.seek(self.end)
+            buf = f.read(size - self.end)
+        a = np.frombuffer(buf, dtype='u1')
+        # Offsets of the beginnings of all of the complete lines
+        line_ends = np.flatnonzero(a == ord("\n")) + 1
+        line_starts = np.concatenate([[0], line_ends[:-1]])
+        # Only every stride-th line of the file goes into the index
+        first = (-self.nlines) % self.stride
+        times = []
+        offsets = []
+        for start, stop in zip(line_starts[first::self.stride],
+                               line_ends[first::self.stride]):
+            try:
+                times.append(self._line_time(buf[start:stop], self.delimiter))
+            except (ValueError, IndexError):
+                # Malformed lines are skipped by the parsers too
+                continue
+            offsets.append(self.end + start)
+        self.times = np.append(self.times, times)
+        self.offsets = np.append(self.offsets, np.array(offsets, dtype='int64'))
+        self.nlines += line_ends.size
+        if line_ends.size > 0:
+            self.end += int(line_ends[-1])
+        self._save()
+
+    def find_offsets(self, tbegin=None, tend=None):
+        """
+        Find the byte offsets which bracket the lines between the times
+        *tbegin* and *tend* (in seconds), updating the index first. The
+        stop offset is None if the range runs to the end of the file.
+        """
+        self.update()
+        start = self.header_size
+        if tbegin is not None:
+            # The last indexed line before *tbegin*
+            i = np.searchsorted(self.times, tbegin) - 1
+            if i >= 0:
+                start = self.offsets[i]
+        stop = None
+        if tend is not None:
+            # The first indexed line after *tend*
+            i = np.searchsorted(self.times, tend, side='right')
+            if i < self.times.size:
+                stop = self.offsets[i]
+        return int(start), stop if stop is None else int(stop)
+
+
+def read_lines(filename, start, stop=None):
+    """
+    Read the bytes of a file between the offsets *start* and *stop*,
+    or to the end of the file if *stop* is None.
+    """
+    with open(filename, "rb") as f:
+        f.seek(start)
+        if stop is None:
+            return f.read()
+        return f.read(stop - start)
+
+
+def read_last_line(filename, offset):
+    """
+    Read the complete line of a file which ends at the byte *offset*.
+    """
+    start = max(offset - 4096, 0)
+    buf = read_lines(filename, start, offset)
+    return buf[buf.rfind(b"\n", 0, len(buf) - 1) + 1:]
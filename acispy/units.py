@@ -160,6 +160,365 @@ binary_operators = (
 )
 
 
+class RegularTimes(object):
+    """
+    Times in seconds from the beginning of the mission with a regular
+    cadence, which are described by the first time *t0*, the spacing
+    *dt*, and the number of times *n* rather than stored. Slicing,
+    searching, and looking up the index of a time are done
+    arithmetically, while anything else, including arithmetic,
+    comparisons, and NumPy functions, materializes the times as a
+    :class:`~astropy.units.Quantity`, so they can be used in place of
+    one.
+    """
+    ndim = 1
+
+    def __init__(self, t0, dt, n):
+        self.t0 = float(t0)
+        self.dt = float(dt)
+        self.n = int(n)
+
+    @classmethod
+    def from_array(cls, t, atol=1.0e-6):
+        """
+        Return a :class:`RegularTimes` for the array of times *t* if all
+        of them are within *atol* seconds of a regular cadence, and None
+        otherwise.
+        """
+        t = np.asarray(getattr(t, "value", t))
+        if t.ndim != 1 or t.size < 3 or t.dtype.kind != 'f':
+            return None
+        dt = (t[-1] - t[0]) / (t.size - 1)
+        if dt <= 0.0:
+            return None
+        times = cls(t[0], dt, t.size)
+        if np.abs(times.value - t).max() > atol:
+            return None
+        return times
+
+    @property
+    def size(self):
+        return self.n
+
+    @property
+    def shape(self):
+        return (self.n,)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def value(self):
+        return np.arange(self.n)*self.dt + self.t0
+
+    @property
+    def quantity(self):
+        return Quantity(self.value, "s", copy=False)
+
+    @property
+    def unit(self):
+        return u.s
+
+    def __array__(self, dtype=None, copy=None):
+        v = self.value
+        return v if dtype is None else v.astype(dtype)
+
+    def __iter__(self):
+        return iter(self.quantity)
+
+    def __eq__(self, other):
+        if isinstance(other, RegularTimes):
+            return (self.t0, self.dt, self.n) == (other.t0, other.dt, other.n)
+        return self.quantity == other
+
+    def __ne__(self, other):
+        return ~(self == other) if not isinstance(other, RegularTimes) \
+            else not (self == other)
+
+    __hash__ = None
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.n)
+            n = len(range(start, stop, step))
+            return RegularTimes(self.t0 + start*self.dt, step*self.dt, n)
+        elif isinstance(item, (int, np.integer)):
+            i = item + self.n if item < 0 else item
+            if i < 0 or i >= self.n:
+                raise IndexError("index %d is out of bounds for size %d" %
+                                 (item, self.n))
+            return Quantity(self.t0 + i*self.dt, "s")
+        else:
+            return self.quantity[item]
+
+    def searchsorted(self, v, side='left'):
+        """
+        Find the indices where the times *v* would be inserted to keep
+        the times in order, like :func:`numpy.searchsorted`.
+        """
+        v = np.asarray(getattr(v, "value", v), dtype='float64')
+        x = (v - self.t0) / self.dt
+        if side == 'left':
+            i = np.clip(np.ceil(x), 0, self.n).astype('int64')
+            # Correct for roundoff by comparing with the times themselves
+            i -= (i > 0) & (self.t0 + (i - 1)*self.dt >= v)
+            i += (i < self.n) & (self.t0 + i*self.dt < v)
+        else:
+            i = np.clip(np.floor(x) + 1, 0, self.n).astype('int64')
+            i -= (i > 0) & (self.t0 + (i - 1)*self.dt > v)
+            i += (i < self.n) & (self.t0 + i*self.dt <= v)
+        return i if i.ndim else int(i)
+
+    def to(self, unit, equivalencies=[]):
+        return self.quantity.to(unit, equivalencies=equivalencies)
+
+    def to_value(self, unit=None, equivalencies=[]):
+        if unit is None:
+            return self.value
+        return self.quantity.to_value(unit, equivalencies=equivalencies)
+
+    def __array_ufunc__(self, function, method, *inputs, **kwargs):
+        inputs = [_materialize(i) for i in inputs]
+        if "out" in kwargs:
+            kwargs["out"] = tuple(_materialize(o) for o in kwargs["out"])
+        return getattr(function, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name in ["t0", "dt", "n"]:
+            raise AttributeError(name)
+        return getattr(self.quantity, name)
+
+    def __repr__(self):
+        return "RegularTimes(t0=%r, dt=%r, n=%r)" % (self.t0, self.dt, self.n)
+
+
+def _materialize(a):
+    # The times of a RegularTimes as a Quantity, or anything else as is
+    return a.quantity if isinstance(a, RegularTimes) else a
+
+
+def _quantity_operator(name):
+    # An operator of RegularTimes, which is that of its Quantity
+    def _operator(self, *args):
+        return getattr(self.quantity, name)(*[_materialize(a) for a in args])
+    _operator.__name__ = name
+    return _operator
+
+
+for _name in ["__add__", "__radd__", "__sub__", "__rsub__", "__mul__",
+              "__rmul__", "__truediv__", "__rtruediv__", "__floordiv__",
+              "__rfloordiv__", "__mod__", "__rmod__", "__pow__", "__neg__",
+              "__pos__", "__abs__", "__lt__", "__le__", "__gt__", "__ge__"]:
+    setattr(RegularTimes, _name, _quantity_operator(_name))
+
+
+def intern_times(times):
+    """
+    Wrap the arrays of times in the dict *times* in read-only
+    :class:`~astropy.units.Quantity` objects in seconds, one for each
+    distinct time base, so that every key whose times are the same array,
+    or an array with the same values, refers to the same object. Times
+    with a regular cadence become :class:`RegularTimes` instead.
+    """
+    by_id = {}
+    bases = {}
+    ret = {}
+    for k, t in times.items():
+        if id(t) not in by_id:
+            if isinstance(t, RegularTimes):
+                regular = t
+            else:
+                tv = np.asarray(getattr(t, "value", t), dtype='float64')
+                regular = RegularTimes.from_array(tv)
+            if regular is not None:
+                key = ("regular", regular.t0, regular.dt, regular.n)
+                base = bases.setdefault(key, [regular])[0]
+            else:
+                key = (tv.shape,) + tuple(tv.ravel()[[0, -1]]) if tv.size else tv.shape
+                base = None
+                for other in bases.get(key, []):
+                    if np.array_equal(other.value, tv):
+                        base = other
+                        break
+                if base is None:
+                    base = Quantity(tv, "s", copy=False)
+                    base.flags.writeable = False
+                    bases.setdefault(key, []).append(base)
+            by_id[id(t)] = base
+        ret[k] = by_id[id(t)]
+    return ret
+
+
+def write_hdf5_times(attrs, times):
+    """
+    Store the *times* of a field in the HDF5 attributes *attrs*, as the
+    (t0, dt, n) of the time axis if they are :class:`RegularTimes`.
+    """
+    if isinstance(times, RegularTimes):
+        attrs["time_axis"] = [times.t0, times.dt, times.n]
+    else:
+        attrs["times"] = times
+
+
+def read_hdf5_times(attrs):
+    """
+    Read the times of a field stored by :func:`write_hdf5_times` from
+    the HDF5 attributes *attrs*.
+    """
+    if "time_axis" in attrs:
+        t0, dt, n = attrs["time_axis"]
+        return RegularTimes(t0, dt, n)
+    return Quantity(attrs["times"], "s")
+
+
+def _cached_on_times(times, name, func):
+    # Results of functions of the times are stored on read-only time
+    # bases, which are shared between fields and cannot change
+    if isinstance(times, RegularTimes) or times.flags.writeable:
+        return func(times.value)
+    if name not in times.__dict__:
+        setattr(times, name, func(times.value))
+    return getattr(times, name)
+
+
+def time_dates(times):
+    """
+    The dates of a Quantity of times, which are only computed once for
+    each read-only time base.
+    """
+    return _cached_on_times(times, "_dates", secs2date)
+
+
+def time_plotdates(times):
+    """
+    The matplotlib plot dates of a Quantity of times, which are only
+    computed once for each read-only time base.
+    """
+    from Ska.Matplotlib import cxctime2plotdate
+    return _cached_on_times(times, "_plotdates", cxctime2plotdate)
+
+
+align_methods = ["nearest", "linear", "previous"]
+
+
+class TimeAlignment(object):
+    """
+    The indices and weights which align values at the times *src* to
+    the times *dst*, so that any number of fields at the times *src*
+    can be aligned to *dst* with a few array operations each. Times in
+    *dst* outside of the range of *src* take the first or last value.
+
+    Parameters
+    ----------
+    src : array of times
+        The times in seconds of the values to be aligned, in increasing
+        order.
+    dst : array of times
+        The times in seconds to align the values to.
+    method : string, optional
+        How values are aligned. "nearest" takes the value at the nearest
+        time, "linear" interpolates linearly between the values at the
+        two nearest times, and "previous" takes the value at the last
+        time at or before each time. Default: "linear"
+    """
+    def __init__(self, src, dst, method="linear"):
+        if method not in align_methods:
+            raise RuntimeError("The alignment method must be one of %s, not "
+                               "'%s'!" % (align_methods, method))
+        self.method = method
+        s = np.asarray(getattr(src, "value", src), dtype='float64')
+        d = np.asarray(getattr(dst, "value", dst), dtype='float64')
+        if s.size == 0:
+            raise RuntimeError("There are no times to align values from!")
+        last = s.size - 1
+        # The last source time at or before each destination time
+        i = np.searchsorted(s, d, side='right') - 1
+        self.weights = None
+        self.idx1 = None
+        if method == "previous":
+            self.idx0 = np.clip(i, 0, last)
+        elif method == "nearest":
+            i0 = np.clip(i, 0, last)
+            i1 = np.minimum(i0 + 1, last)
+            self.idx0 = np.where(s[i1] - d < d - s[i0], i1, i0)
+        else:
+            i0 = np.clip(i, 0, max(last - 1, 0))
+            i1 = np.minimum(i0 + 1, last)
+            dt = s[i1] - s[i0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                w = np.where(dt > 0.0, (d - s[i0]) / dt, 0.0)
+            self.idx0 = i0
+            self.idx1 = i1
+            self.weights = np.clip(w, 0.0, 1.0)
+
+    def take(self, values):
+        """
+        Align the array *values* at the source times.
+        """
+        v0 = values[self.idx0]
+        if self.weights is None:
+            return v0
+        if values.dtype.kind not in "iuf":
+            raise RuntimeError("Only numerical values can be aligned with "
+                               "method='linear'!")
+        return v0 + self.weights*(values[self.idx1] - v0)
+
+    def take_mask(self, mask):
+        """
+        Align the :class:`Mask` *mask* at the source times. An aligned
+        value is good only if every value it was taken from is good.
+        """
+        if mask is None:
+            return None
+        if self.idx1 is None:
+            return mask[self.idx0]
+        return mask[self.idx0] & mask[self.idx1]
+
+
+def _is_time_base(times):
+    return isinstance(times, RegularTimes) or \
+        (isinstance(times, Quantity) and not times.flags.writeable)
+
+
+def get_alignment(src, dst, method="linear"):
+    """
+    Return the :class:`TimeAlignment` from the times *src* to the times
+    *dst*. If both are read-only time bases, it is only computed once
+    for each pair of them and method, and is stored on *dst*.
+    """
+    if not (_is_time_base(src) and _is_time_base(dst)):
+        return TimeAlignment(src, dst, method=method)
+    cache = dst.__dict__.setdefault("_alignments", {})
+    key = id(src), method
+    # The source times are kept with the alignment, so that their id
+    # cannot be reused by another array while it is cached
+    if key not in cache or cache[key][0] is not src:
+        cache[key] = src, TimeAlignment(src, dst, method=method)
+    return cache[key][1]
+
+
+def align_array(v, times, method="linear"):
+    """
+    Align the :class:`APQuantity` or :class:`APStringArray` *v* to the
+    *times*, which become its times, with the given *method* (see
+    :class:`TimeAlignment`). Strings cannot be interpolated, so they
+    are taken from the nearest time if *method* is "linear".
+    """
+    if isinstance(v, APStringArray) and method == "linear":
+        method = "nearest"
+    alignment = get_alignment(v.times, times, method=method)
+    mask = alignment.take_mask(get_mask(v))
+    if isinstance(v, APCategoricalArray):
+        return APCategoricalArray(alignment.take(v.codes), v.categories,
+                                  times, mask=mask)
+    elif isinstance(v, APStringArray):
+        return APStringArray(alignment.take(v.value), times, mask=mask)
+    else:
+        value = alignment.take(v.value)
+        return APQuantity(value, times, unit=v.unit, mask=mask,
+                          copy=not isinstance(value, np.ndarray))
+
+
 def parse_index(idx, times): 
     if isinstance(idx, (int, np.ndarray)) or idx is None:
         return idx
@@ -167,13 +526,54 @@ def parse_index(idx, times):
         orig_idx = idx
         if isinstance(idx, str):
             idx = DateTime(idx).secs
-        if idx < times[0] or idx > times[-1]:
+        if isinstance(times, RegularTimes):
+            tmin, tmax = times.t0, times.t0 + (times.n-1)*times.dt
+        else:
+            tmin, tmax = times[0], times[-1]
+        if idx < tmin or idx > tmax:
             raise RuntimeError("The time %s is outside the bounds of this dataset!" % orig_idx)
-        idx = np.searchsorted(times, idx)-1
+        if isinstance(times, RegularTimes):
+            idx = times.searchsorted(idx)-1
+        else:
+            idx = np.searchsorted(times, idx)-1
     return idx
 
 
+def _index_key(item):
+    # A hashable key for an item made of dates, times, and slices
+    # of them, or None if it is something else
+    if isinstance(item, tuple) and len(item) > 0:
+        item = item[0]
+    if isinstance(item, slice):
+        parts = (item.start, item.stop, item.step)
+    else:
+        parts = (item,)
+    if all(isinstance(p, (str, float)) or p is None for p in parts) and \
+            not isinstance(item, (int, type(None))):
+        return (isinstance(item, slice),) + parts
+    return None
+
+
 def find_indices(item, times):
+    if isinstance(times, RegularTimes):
+        if isinstance(item, slice):
+            idxs = slice(parse_index(item.start, times),
+                         parse_index(item.stop, times), item.step)
+        elif isinstance(item, tuple):
+            idxs = slice(parse_index(item[0].start, times),
+                         parse_index(item[0].stop, times), item[0].step)
+        else:
+            idxs = parse_index(item, times)
+        return idxs, times[idxs]
+    if isinstance(times, Quantity):
+        key = None if times.flags.writeable else _index_key(item)
+        if key is not None:
+            # Lookups by date on a shared time base are only done once
+            cache = times.__dict__.setdefault("_indices", {})
+            if key not in cache:
+                cache[key] = find_indices(item, times.value)
+            return cache[key]
+        times = times.value
     if getattr(times, "ndim", None) == 2:
         t1 = times[0]
         t2 = times[1]
@@ -193,31 +593,223 @@ def find_indices(item, times):
         t = times[:,idxs]
     else:
         t = times[idxs]
-    return idxs, Quantity(t, "s")
+    t = Quantity(t, "s")
+    if isinstance(idxs, slice):
+        t.flags.writeable = False
+    return idxs, t
+
+
+class Mask(object):
+    """
+    A mask of the good (True) and bad (False) samples of an array, which
+    is stored packed into one bit per sample. Masks in which every sample
+    is good are not stored at all, but are represented by None, which
+    :meth:`from_array` returns for them. Logical operations between masks
+    work on the packed bytes, and anything else unpacks the mask into a
+    boolean array, so it can be used in place of one.
+
+    Parameters
+    ----------
+    bits : NumPy array of uint8
+        The packed bits of the mask, in the order of :func:`numpy.packbits`.
+        The bits past *size* in the last byte are ignored.
+    size : integer
+        The number of samples in the mask.
+    """
+    ndim = 1
+
+    def __init__(self, bits, size):
+        self.bits = bits
+        self.size = int(size)
+
+    @classmethod
+    def from_array(cls, mask):
+        """
+        Pack the boolean array *mask*, returning None if all of its
+        samples are good. A :class:`Mask` or None is returned as is.
+        """
+        if mask is None or isinstance(mask, Mask):
+            return mask
+        mask = np.asarray(mask, dtype='bool').ravel()
+        if mask.all():
+            return None
+        return cls(np.packbits(mask), mask.size)
+
+    @property
+    def shape(self):
+        return (self.size,)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def unpack(self):
+        """
+        Unpack the mask into a boolean array.
+        """
+        return np.unpackbits(self.bits, count=self.size).view('bool')
+
+    def __array__(self, dtype=None, copy=None):
+        v = self.unpack()
+        return v if dtype is None else v.astype(dtype)
+
+    def _tail(self):
+        # The number of whole bytes and the bits of the last partial
+        # byte which belong to the mask
+        nfull, rem = divmod(self.size, 8)
+        return nfull, (0xff << (8 - rem)) & 0xff
+
+    def all(self):
+        nfull, tail = self._tail()
+        if not (self.bits[:nfull] == 0xff).all():
+            return False
+        return tail == 0 or self.bits[nfull] & tail == tail
+
+    def any(self):
+        nfull, tail = self._tail()
+        if self.bits[:nfull].any():
+            return True
+        return tail != 0 and self.bits[nfull] & tail != 0
+
+    def bad_intervals(self):
+        """
+        The start and stop indices of the runs of bad samples in the
+        mask, as an (n, 2) array.
+        """
+        bad = np.concatenate([[False], ~self.unpack(), [False]])
+        return np.flatnonzero(bad[1:] != bad[:-1]).reshape(-1, 2)
+
+    def broadcast_to(self, size):
+        """
+        Broadcast the mask to *size* samples, which only changes the mask
+        if it has a single sample, like a mask of a scalar.
+        """
+        if size == self.size:
+            return self
+        if self.size != 1:
+            raise ValueError("A mask of size %d cannot be broadcast to size %d!" %
+                             (self.size, size))
+        fill = 0xff if self[0] else 0
+        return Mask(np.full((size + 7) >> 3, fill, dtype='uint8'), size)
+
+    def _binary_op(self, other, op):
+        if not isinstance(other, Mask):
+            other = np.asarray(other, dtype='bool').ravel()
+            other = Mask(np.packbits(other), other.size)
+        mask = self
+        # Masks of a single sample broadcast against the other mask,
+        # like the arrays they belong to
+        if other.size == 1:
+            other = other.broadcast_to(mask.size)
+        elif mask.size == 1:
+            mask = mask.broadcast_to(other.size)
+        if other.size != mask.size:
+            raise ValueError("Masks of sizes %d and %d cannot be combined!" %
+                             (mask.size, other.size))
+        return Mask(op(mask.bits, other.bits), mask.size)
+
+    def __and__(self, other):
+        if other is None or other is self:
+            return self
+        return self._binary_op(other, np.bitwise_and)
+
+    def __or__(self, other):
+        if other is None:
+            return None
+        if other is self:
+            return self
+        return self._binary_op(other, np.bitwise_or)
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+    def __invert__(self):
+        return np.invert(self.unpack())
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            i = item + self.size if item < 0 else item
+            if i < 0 or i >= self.size:
+                raise IndexError("index %d is out of bounds for size %d" %
+                                 (item, self.size))
+            return bool((self.bits[i >> 3] >> (7 - (i & 7))) & 1)
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.size)
+            n = len(range(start, stop, step))
+            if step != 1:
+                item = np.arange(start, stop, step)
+            elif start % 8 == 0:
+                # Slices which begin on a byte boundary are views
+                return Mask(self.bits[start >> 3:(start + n + 7) >> 3], n)
+            else:
+                bits = np.unpackbits(self.bits[start >> 3:(stop + 7) >> 3])
+                return Mask(np.packbits(bits[start & 7:(start & 7) + n]), n)
+        item = np.asarray(item)
+        if item.dtype == 'bool':
+            item = np.flatnonzero(item)
+        item = np.where(item < 0, item + self.size, item)
+        bits = (self.bits[item >> 3] >> (7 - (item & 7))) & 1
+        return Mask(np.packbits(bits), bits.size)
+
+    def __repr__(self):
+        return "Mask(%d bad of %d)" % (self.size - np.count_nonzero(self.unpack()),
+                                       self.size)
+
+
+def _combine_masks(mask1, mask2):
+    # Good only where both masks are good, where None is all good
+    if mask1 is None:
+        return mask2
+    return mask1 & mask2
+
+
+def _unpack_mask(mask, shape):
+    if mask is None:
+        return np.ones(shape, dtype='bool')
+    return mask.unpack().reshape(shape)
 
 
 class APStringArray(object):
     def __init__(self, value, times, mask=None):
         self.value = value
         self.times = times
-        if mask is None:
-            mask = np.ones(value.size, dtype='bool')
         self.mask = mask
         self.dtype = self.value.dtype
 
+    @property
+    def shape(self):
+        return self.value.shape
+
+    @property
+    def size(self):
+        return self.value.size
+
+    @property
+    def mask(self):
+        return _unpack_mask(self._mask, self.shape)
+
+    @mask.setter
+    def mask(self, value):
+        self._mask = Mask.from_array(value)
+
     def __getitem__(self, item):
-        idxs, t = find_indices(item, self.times.value)
-        mask = self.mask[idxs]
+        idxs, t = find_indices(item, self.times)
         v = self.value[idxs]
         if isinstance(v, np.ndarray):
-            return APStringArray(v, t, mask=mask)
+            mask = self._mask
+            return APStringArray(v, t, mask=None if mask is None else mask[idxs])
         else:
             return v
 
     def __getslice__(self, i, j):
         v = self.value[i,j]
         t = self.times[i:j]
-        mask = self.mask[i:j]
+        mask = self._mask
+        if mask is not None:
+            mask = mask[i:j]
         if isinstance(v, np.ndarray):
             return APStringArray(v, t, mask=mask)
         else:
@@ -225,7 +817,7 @@ class APStringArray(object):
 
     @property
     def dates(self):
-        return secs2date(self.times.value)
+        return time_dates(self.times)
 
     def __repr__(self):
         return self.value.__repr__()
@@ -237,32 +829,174 @@ class APStringArray(object):
         return self.value.__eq__(other)
 
     def __ne__(self, other):
+        return self.value.__ne__(other)
+
+    def isin(self, values):
+        """
+        Return a boolean array which is True where the value is one
+        of *values*.
+        """
+        return np.isin(self.value, values)
+
+    def to_state_codes(self, state_codes, default=-1):
+        """
+        Convert the values to integers using the dict *state_codes*,
+        with *default* for values which are not in it.
+        """
+        return np.array([state_codes.get(v, default) for v in self.value],
+                        dtype='int64')
+
+
+def encode_categories(value, categories=None):
+    """
+    Encode the array of strings *value* as integer codes into an array
+    of its distinct values. If *categories* is given, the codes index
+    into it, and any values which are not in it are added to the end.
+    Returns the codes and the categories, where the codes have the
+    smallest integer type which can index the categories.
+    """
+    value = np.asarray(value)
+    if value.dtype.char == "O":
+        value = value.astype("str")
+    uniq, inverse = np.unique(value.ravel(), return_inverse=True)
+    if categories is None:
+        categories = uniq
+        lut = np.arange(uniq.size)
+    else:
+        index = dict((c, i) for i, c in enumerate(categories))
+        new = [c for c in uniq if c not in index]
+        if new:
+            index.update((c, i + len(index)) for i, c in enumerate(new))
+            categories = np.concatenate([categories, np.array(new)])
+        lut = np.array([index[c] for c in uniq], dtype='int64')
+    dtype = np.min_scalar_type(max(categories.size - 1, 0))
+    return lut[inverse].astype(dtype), categories
+
+
+class APCategoricalArray(APStringArray):
+    """
+    An array of strings with times and a mask, like
+    :class:`APStringArray`, which is stored as integer codes into a
+    small array of the distinct values. Most string-valued states and
+    MSIDs only ever take a handful of values, so this uses a fraction
+    of the memory of the strings, and comparisons and conversions to
+    state codes are done once for each distinct value.
+
+    Parameters
+    ----------
+    codes : NumPy array of integers
+        The index into *categories* of each value.
+    categories : NumPy array of strings
+        The distinct values.
+    times : :class:`~astropy.units.Quantity`
+        The times of the values.
+    mask : NumPy boolean array or :class:`Mask`, optional
+        The mask of good values. Default: None, which means all of the
+        values are good.
+    """
+    def __init__(self, codes, categories, times, mask=None):
+        self.codes = codes
+        self.categories = categories
+        self.times = times
+        self.mask = mask
+        self.dtype = categories.dtype
+
+    @classmethod
+    def from_array(cls, value, times, mask=None):
+        """
+        Create a :class:`APCategoricalArray` from the array of strings
+        *value*.
+        """
+        codes, categories = encode_categories(value)
+        return cls(codes, categories, times, mask=mask)
+
+    @property
+    def value(self):
+        return self.categories[self.codes]
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def size(self):
+        return self.codes.size
+
+    def __getitem__(self, item):
+        idxs, t = find_indices(item, self.times)
+        codes = self.codes[idxs]
+        if isinstance(codes, np.ndarray):
+            mask = self._mask
+            return APCategoricalArray(codes, self.categories, t,
+                                      mask=None if mask is None else mask[idxs])
+        else:
+            return self.categories[codes]
+
+    def _is_scalar(self, other):
+        return isinstance(other, (str, bytes, np.str_, np.bytes_))
+
+    def __eq__(self, other):
+        if self._is_scalar(other):
+            return (self.categories == other)[self.codes]
         return self.value.__eq__(other)
 
+    def __ne__(self, other):
+        if self._is_scalar(other):
+            return (self.categories != other)[self.codes]
+        return self.value.__ne__(other)
+
+    def isin(self, values):
+        return np.isin(self.categories, values)[self.codes]
+
+    def to_state_codes(self, state_codes, default=-1):
+        lut = np.array([state_codes.get(c, default) for c in self.categories],
+                       dtype='int64')
+        return lut[self.codes]
+
+
+def get_mask(a):
+    """
+    The packed :class:`Mask` of the array *a* without unpacking it, or
+    None if all of its values are good or it is not an
+    :class:`APQuantity` or :class:`APStringArray`.
+    """
+    if isinstance(a, (APQuantity, APStringArray)):
+        return a._mask
+    return None
+
 
 class APQuantity(Quantity):
     def __new__(cls, value, times, unit=None, mask=None, dtype=None, copy=True,
                 order=None, ndmin=0):
         ret = Quantity.__new__(cls, value, unit=unit, dtype=dtype, copy=copy,
                                order=order, subok=True, ndmin=ndmin)
-        if mask is None:
-            mask = np.ones(ret.size, dtype='bool')
         ret.mask = mask
         ret.times = times
         return ret
 
+    # The mask is stored packed, and not at all when every value is
+    # good, so the boolean array is only created when it is asked for
+    _mask = None
+
+    @property
+    def mask(self):
+        return _unpack_mask(self._mask, self.shape)
+
+    @mask.setter
+    def mask(self, value):
+        self._mask = Mask.from_array(value)
+
     if LooseVersion(np.__version__) < LooseVersion('1.13.0'):
 
         def __array_wrap__(self, obj, context=None):
             ret = super(APQuantity, self).__array_wrap__(obj, context=context)
             if ret.dtype == 'bool':
                 return ret
-            mask = self.mask
+            mask = self._mask
             if context[0] in binary_operators:
-                mask2 = getattr(context[1][1], "mask", None)
-                if mask2 is not None:
-                    mask = np.logical_and(mask, mask2)
-            ret.mask = mask
+                mask = _combine_masks(mask, get_mask(context[1][1]))
+            if ret.shape == self.shape:
+                ret.mask = mask
             ret.times = self.times
             return ret
 
@@ -274,39 +1008,60 @@ class APQuantity(Quantity):
                                                           **kwargs)
             if ret.dtype == 'bool':
                 return ret
-            mask = self.mask
+            mask = self._mask
             if len(inputs) == 2:
-                mask2 = getattr(inputs[1], "mask", None)
-                if mask2 is not None:
-                    mask = np.logical_and(mask, mask2)
-            ret.mask = mask
+                mask = _combine_masks(mask, get_mask(inputs[1]))
+            if method == "__call__":
+                # A scalar combined with an array broadcasts to its shape
+                if mask is not None:
+                    mask = mask.broadcast_to(ret.size)
+                ret.mask = mask
+            elif ret.shape == self.shape:
+                # Reductions have a different shape, so the mask of the
+                # samples does not apply to them
+                ret.mask = mask
             ret.times = self.times
             return ret
 
     def __getitem__(self, item):
-        idxs, t = find_indices(item, self.times.value)
+        idxs, t = find_indices(item, self.times)
         ret = super(APQuantity, self).__getitem__(idxs)
-        mask = self.mask[idxs]
-        return APQuantity(ret.value, t, unit=self.unit, 
-                          dtype=self.dtype, mask=mask)
+        mask = self._mask
+        if mask is not None:
+            mask = mask[idxs]
+        # Slices are views of this array, like NumPy slices
+        v = ret.value
+        return APQuantity(v, t, unit=self.unit, dtype=self.dtype, mask=mask,
+                          copy=not isinstance(v, np.ndarray))
 
     def __getslice__(self, i, j):
         ret = super(APQuantity, self).__getslice__(i, j)
         t = self.times[i:j]
-        mask = self.mask[i:j]
+        mask = self._mask
+        if mask is not None:
+            mask = mask[i:j]
         return APQuantity(ret.value, t, unit=self.unit,
-                          dtype=self.dtype, mask=mask)
+                          dtype=self.dtype, mask=mask, copy=False)
 
     def to(self, unit, equivalencies=[]):
+        unit = u.Unit(unit)
+        if not equivalencies and self.unit.is_equivalent(unit) and \
+                self.unit.to(unit) == 1.0:
+            # Only the name of the unit changes (e.g. "A V" to "W"),
+            # so the values are shared rather than copied
+            v = self.value
+            return APQuantity(v, self.times, unit=unit, mask=self._mask,
+                              dtype=self.dtype, copy=not isinstance(v, np.ndarray))
         ret = super(APQuantity, self).to(unit, equivalencies=equivalencies)
-        return APQuantity(ret.value, self.times, unit=ret.unit, mask=self.mask,
-                          dtype=ret.dtype)
+        v = ret.value
+        return APQuantity(v, self.times, unit=ret.unit, mask=self._mask,
+                          dtype=ret.dtype, copy=not isinstance(v, np.ndarray))
 
     _dates = None
     @property
     def dates(self):
         if self._dates is None:
-            self._dates = secs2date(self.times.value)
+            self._dates = time_dates(self.times)
         return self._dates
 
     def argmax(self, dates=False):
@@ -326,6 +1081,33 @@ class APQuantity(Quantity):
             return times
 
 
+def concatenate(arrays):
+    """
+    Join a sequence of :class:`~acispy.units.APQuantity` or
+    :class:`~acispy.units.APStringArray` instances along the time axis.
+    """
+    t = Quantity(np.concatenate([a.times.value for a in arrays]), "s")
+    if all(get_mask(a) is None for a in arrays):
+        mask = None
+    else:
+        mask = np.concatenate([a.mask for a in arrays])
+    if all(isinstance(a, APCategoricalArray) for a in arrays):
+        # Only the categories need to be merged, not the values
+        categories = None
+        codes = []
+        for a in arrays:
+            lut, categories = encode_categories(a.categories, categories)
+            codes.append(lut[a.codes])
+        dtype = np.min_scalar_type(max(categories.size - 1, 0))
+        codes = np.concatenate(codes).astype(dtype)
+        return APCategoricalArray(codes, categories, t, mask=mask)
+    v = np.concatenate([a.value for a in arrays])
+    if v.dtype.char in ['S', 'U']:
+        return APStringArray(v, t, mask=mask)
+    else:
+        return APQuantity(v, t, unit=arrays[0].unit, dtype=v.dtype, mask=mask)
+
+
 units_trans = {"DEGC": "deg_C",
                "STEP": "",
                "0": "",
@@ -75,11 +75,104 @@ def ensure_numpy_array(obj):
         return np.asarray([obj])
 
 
+def _sun_positions(times):
+    """
+    The RA and Dec of the sun in degrees at an array of *times*. Versions
+    of Ska.Sun.position which only take a single time are called for each
+    unique time in turn.
+    """
+    try:
+        ra, dec = Ska.Sun.position(times)
+        ra = np.broadcast_to(np.asarray(ra, dtype='float64'), times.shape)
+        dec = np.broadcast_to(np.asarray(dec, dtype='float64'), times.shape)
+    except (TypeError, ValueError):
+        utimes, inverse = np.unique(times, return_inverse=True)
+        pos = np.array([Ska.Sun.position(t) for t in utimes],
+                       dtype='float64').reshape(-1, 2)
+        ra, dec = pos[inverse, 0], pos[inverse, 1]
+    return ra, dec
+
+
 def calc_off_nom_rolls(states):
-    times = np.array(0.5*(states['tstart'] + states['tstop']))
-    atts = np.array([states["q%d" % x] for x in range(1, 5)]).transpose()
-    return np.array([Ska.Sun.off_nominal_roll(att, time)
-                     for time, att in zip(times, atts)])
+    """
+    Compute the off-nominal roll angle in degrees for each row of a
+    states table, at the midpoint of the state. This is the same
+    calculation as ``Ska.Sun.off_nominal_roll``, done for all of the
+    rows at once: the sun position is rotated into the body frame of
+    each attitude quaternion, and the roll is the angle of the sun
+    from the body -Z axis about the body X axis.
+    """
+    times = np.array(0.5*(states['tstart'] + states['tstop']), dtype='float64')
+    q = np.array([states["q%d" % x] for x in range(1, 5)], dtype='float64')
+    x, y, z, w = q / np.sqrt(np.sum(q**2, axis=0))
+    ra, dec = _sun_positions(times)
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    sun_eci = np.array([np.cos(dec)*np.cos(ra),
+                        np.cos(dec)*np.sin(ra),
+                        np.sin(dec)])
+    # The second and third columns of the rotation matrix of each
+    # quaternion, which take the sun from ECI into the body Y and Z axes
+    col_y = np.array([2.0*(x*y - z*w),
+                      1.0 - 2.0*(x*x + z*z),
+                      2.0*(y*z + x*w)])
+    col_z = np.array([2.0*(z*x + y*w),
+                      2.0*(y*z - x*w),
+                      1.0 - 2.0*(x*x + y*y)])
+    sun_body_y = np.sum(col_y*sun_eci, axis=0)
+    sun_body_z = np.sum(col_z*sun_eci, axis=0)
+    return np.degrees(np.arctan2(-sun_body_y, -sun_body_z))
+
+
+_leap_table = None
+
+
+def _get_leap_table():
+    """
+    The days since 1998:001 at which the offset between UTC and CXC
+    seconds can change (January 1 and July 1 of each year), along with
+    that offset, taken from Chandra.Time so that leap seconds are
+    handled in exactly the same way.
+    """
+    global _leap_table
+    if _leap_table is None:
+        from Chandra.Time import date2secs
+        years = np.arange(1998, int(DateTime().date[:4]) + 2)
+        doys = np.array([1, 182])
+        year, doy = [a.ravel() for a in np.meshgrid(years, doys, indexing='ij')]
+        doy = doy + np.logical_and(doy > 1, _is_leap_year(year))
+        days = _days_since_1998(year, doy)
+        dates = ["%04d:%03d:00:00:00.000" % (y, d) for y, d in zip(year, doy)]
+        _leap_table = days, np.asarray(date2secs(dates)) - days*86400.0
+    return _leap_table
+
+
+def _is_leap_year(year):
+    return np.logical_and(year % 4 == 0,
+                          np.logical_or(year % 100 != 0, year % 400 == 0))
+
+
+def _days_since_1998(year, doy):
+    def _num_leap_years(y):
+        return y // 4 - y // 100 + y // 400
+    return 365*(year - 1998) + _num_leap_years(year - 1) - \
+        _num_leap_years(1997) + doy - 1
+
+
+def ydoy2secs(year, doy, sec):
+    """
+    Convert arrays of UTC year, day of year, and seconds of the day into
+    seconds from the beginning of the mission, without formatting any
+    date strings. A leap second is represented by a seconds of the day
+    value of 86400 or more, as it is by Chandra.Time.
+    """
+    year = np.asarray(year, dtype='int64')
+    doy = np.asarray(doy, dtype='int64')
+    days = _days_since_1998(year, doy)
+    leap_days, offsets = _get_leap_table()
+    idxs = np.clip(np.searchsorted(leap_days, days, side='right') - 1,
+                   0, None)
+    return days*86400.0 + np.asarray(sec, dtype='float64') + offsets[idxs]
 
 
 default_states = ["ccd_count", "clocking", "ra", "dec", "dither", "fep_count",
@@ -195,7 +288,7 @@ def get_state_codes(msid):
 
 
 def convert_state_code(ds, field):
-    return np.array([ds.state_codes[field].get(val, -1) for val in ds[field]])
+    return ds[field].to_state_codes(ds.state_codes[field])
 
 
 lr_root = "/data/acis/LoadReviews"
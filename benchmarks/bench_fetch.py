@@ -0,0 +1,41 @@
+"""
+Compare fetching a set of MSIDs from the engineering archive in one call
+with fetching them concurrently on a thread pool, against a fake archive
+in which fetching each MSID takes a fixed time.
+
+Usage: python benchmarks/bench_fetch.py [latency]
+"""
+import sys
+import time
+from acispy.msids import MSIDs
+from acispy.utils import mylog
+from acispy.tests.fake_archive import fake_archive
+
+msids = ["1deamzt", "1dpamzt", "1pdeaat", "1pin1at", "tmp_fep1_mong",
+         "tmp_fep1_actel", "tmp_bep_pcb", "1dp28avo", "1dpicacu",
+         "1dp28bvo", "1dpicbcu", "1de28avo", "1deicacu", "1de28bvo",
+         "1deicbcu", "1crat", "1crbt", "1wrat", "1wrbt", "1cbat",
+         "1cbbt", "1dactbt", "1oahat", "1oahbt", "1ssmyt", "1ssptt",
+         "1mahcat", "1mahcbt", "1ohppt", "1ohpbt"]
+
+
+def run(latency):
+    with fake_archive(latency=latency):
+        for max_workers in [None, 2, 4, 8, 16]:
+            t0 = time.perf_counter()
+            MSIDs.from_database(msids, "2020:001:00:00:00",
+                                "2020:091:00:00:00", max_workers=max_workers,
+                                use_cache=False)
+            t = time.perf_counter() - t0
+            if max_workers is None:
+                t_serial = t
+            print("max_workers = %-4s %8.3f s  speedup %5.2fx" %
+                  (max_workers, t, t_serial/t))
+
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.1
+    mylog.setLevel("ERROR")
+    print("Fetching %d MSIDs over 90 days, %.3f s per MSID" %
+          (len(msids), latency))
+    run(latency)
@@ -0,0 +1,68 @@
+"""
+Time resolving bare field names to (type, name) fields on a dataset with
+over a thousand fields, using the name index of the field container and
+using the old scan over every field type.
+
+Usage: python benchmarks/bench_field_lookup.py [num_msids]
+"""
+import sys
+import time
+import numpy as np
+from acispy.dataset import Dataset
+from acispy.msids import MSIDs
+from acispy.time_series import EmptyTimeSeries
+from acispy.utils import mylog
+
+
+def make_dataset(n):
+    t = np.arange(10.0)
+    names = ["msid%04d" % i for i in range(n)]
+    msids = MSIDs(dict((k, np.arange(10.0)) for k in names),
+                  dict((k, t) for k in names))
+    ds = Dataset(msids, EmptyTimeSeries(), EmptyTimeSeries())
+    # Averaged fields double the number of fields
+    for k in names:
+        ds.add_averaged_field(("msids", k))
+    # A few fields of the other types, as in a dataset with states and
+    # several models
+    for ftype in ["states", "model", "model0", "model1"]:
+        for i in range(10):
+            ds.add_derived_field(ftype, "%s_%d" % (ftype, i),
+                                 lambda ds: None, "")
+    return ds, names
+
+
+def scan_determine_field(ds, field):
+    fd = field.lower()
+    candidates = []
+    for ftype in ds.fields.types:
+        if (ftype, fd) in ds.fields:
+            candidates.append((ftype, fd))
+    if len(candidates) != 1:
+        raise RuntimeError(field)
+    return candidates[0]
+
+
+def timeit(func, ds, names, repeat=10):
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        for k in names:
+            func(ds, k)
+    return (time.perf_counter() - t0) / (repeat*len(names))
+
+
+def run(n):
+    ds, names = make_dataset(n)
+    names = names + ["avg_" + k for k in names]
+    print("%d fields in %d field types" %
+          (len(ds.fields.list_all_fields()), len(ds.fields.types)))
+    t_scan = timeit(scan_determine_field, ds, names)
+    t_index = timeit(Dataset._determine_field, ds, names)
+    print("scan   %8.3f us per lookup" % (t_scan*1.0e6))
+    print("index  %8.3f us per lookup  speedup %5.2fx" %
+          (t_index*1.0e6, t_scan/t_index))
+
+
+if __name__ == "__main__":
+    mylog.setLevel("ERROR")
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,71 @@
+"""
+Compare converting the YEAR/DOY/SEC columns of a MIT file to seconds
+and splitting its bilevels the way MSIDs.from_mit_file used to, by
+formatting a date string for each row and splitting each bilevel in a
+list comprehension, with the array-based conversion and split.
+
+Usage: python benchmarks/bench_mit_times.py [num_rows]
+"""
+import sys
+import time
+import numpy as np
+from Chandra.Time import date2secs
+from acispy.utils import ydoy2secs
+
+
+def make_columns(nrows):
+    t = np.sort(np.random.uniform(0.0, 20.0*86400.0, nrows)) + \
+        (2017*365 + 300)*86400.0
+    days = np.floor(t / 86400.0)
+    year = np.full(nrows, 2017) + (days >= 2017*365 + 365).astype(int)
+    doy = (days - 2017*365).astype(int) % 365 + 1
+    sec = t - days*86400.0
+    bits = np.random.randint(0, 2, (nrows, 8)).astype(str)
+    bilevels = np.char.add("b", np.array(["".join(b) for b in bits]))
+    return year, doy, sec, bilevels
+
+
+def strings_times(year, doy, sec):
+    mins, hours = np.modf(sec/3600.)
+    secs, mins = np.modf(mins*60.)
+    secs *= 60.0
+    time_arr = ["%04d:%03d:%02d:%02d:%06.3f" % (y, d, h, m, s)
+                for y, d, h, m, s in zip(year, doy, hours, mins, secs)]
+    return date2secs(time_arr)
+
+
+def loop_bilevels(bilevels):
+    bilevels = np.char.strip(bilevels, "b")
+    return [np.array([b[i] for b in bilevels]) for i in range(8)]
+
+
+def array_bilevels(bilevels):
+    bilevels = np.char.strip(bilevels, "b")
+    bits = bilevels.astype("U8").view("U1").reshape(-1, 8)
+    return [bits[:, i] for i in range(8)]
+
+
+def timeit(func, *args):
+    t0 = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - t0
+
+
+def run(nrows):
+    year, doy, sec, bilevels = make_columns(nrows)
+    print("%d rows" % nrows)
+    old, t_old = timeit(strings_times, year, doy, sec)
+    new, t_new = timeit(ydoy2secs, year, doy, sec)
+    # The date strings only keep milliseconds
+    assert np.allclose(old, new, rtol=0, atol=1.0e-3)
+    print("times:    strings %8.3f s  arrays %8.3f s  speedup %7.1fx" %
+          (t_old, t_new, t_old/t_new))
+    old, t_old = timeit(loop_bilevels, bilevels)
+    new, t_new = timeit(array_bilevels, bilevels)
+    assert all(np.array_equal(o, n) for o, n in zip(old, new))
+    print("bilevels: loop    %8.3f s  arrays %8.3f s  speedup %7.1fx" %
+          (t_old, t_new, t_old/t_new))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
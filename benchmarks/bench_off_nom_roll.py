@@ -0,0 +1,50 @@
+"""
+Compare computing the off-nominal roll of each row of a synthetic
+multi-year states table with Ska.Sun.off_nominal_roll in a loop, as
+States used to, with the array-based calc_off_nom_rolls.
+
+Usage: python benchmarks/bench_off_nom_roll.py [num_states]
+"""
+import sys
+import time
+import numpy as np
+import Ska.Sun
+from acispy.utils import calc_off_nom_rolls
+
+
+def make_states(n):
+    rng = np.random.RandomState(0)
+    # About five years of states
+    tstart = np.sort(rng.uniform(6.0e8, 6.0e8 + 5*365*86400.0, n))
+    tstop = np.append(tstart[1:], tstart[-1] + 3600.0)
+    q = rng.normal(size=(n, 4))
+    q /= np.sqrt(np.sum(q**2, axis=1))[:, np.newaxis]
+    states = {"tstart": tstart, "tstop": tstop}
+    for i in range(4):
+        states["q%d" % (i+1)] = q[:, i]
+    return states
+
+
+def loop_off_nom_rolls(states):
+    times = np.array(0.5*(states['tstart'] + states['tstop']))
+    atts = np.array([states["q%d" % x] for x in range(1, 5)]).transpose()
+    return np.array([Ska.Sun.off_nominal_roll(att, time)
+                     for time, att in zip(times, atts)])
+
+
+def run(n):
+    states = make_states(n)
+    print("%d states" % n)
+    t0 = time.perf_counter()
+    old = loop_off_nom_rolls(states)
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = calc_off_nom_rolls(states)
+    t_new = time.perf_counter() - t0
+    print("max difference %.3g deg" % np.abs(old - new).max())
+    print("loop    %8.3f s" % t_old)
+    print("arrays  %8.3f s  speedup %7.1fx" % (t_new, t_old/t_new))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,101 @@
+"""
+Time the builtin DPA and DEA power fields, (v*i).to("W"), and slicing
+of the voltages and currents, with APQuantity against the APQuantity
+class as it was before masks became lazy and slices became views.
+
+Usage: python benchmarks/bench_power_fields.py [num_samples]
+"""
+import sys
+import time
+import numpy as np
+from astropy.units import Quantity
+from acispy.units import APQuantity, find_indices
+
+
+class OldAPQuantity(Quantity):
+    # APQuantity before masks became lazy and slices became views
+    def __new__(cls, value, times, unit=None, mask=None, dtype=None,
+                copy=True):
+        ret = Quantity.__new__(cls, value, unit=unit, dtype=dtype, copy=copy,
+                               subok=True)
+        if mask is None:
+            mask = np.ones(ret.size, dtype='bool')
+        ret.mask = mask
+        ret.times = times
+        return ret
+
+    def __array_ufunc__(self, function, method, *inputs, **kwargs):
+        ret = super(OldAPQuantity, self).__array_ufunc__(function, method,
+                                                         *inputs, **kwargs)
+        if ret.dtype == 'bool':
+            return ret
+        mask = self.mask
+        if len(inputs) == 2:
+            mask2 = getattr(inputs[1], "mask", None)
+            if mask2 is not None:
+                mask = np.logical_and(mask, mask2)
+        ret.mask = mask
+        ret.times = self.times
+        return ret
+
+    def __getitem__(self, item):
+        idxs, t = find_indices(item, self.times.value)
+        ret = super(OldAPQuantity, self).__getitem__(idxs)
+        mask = self.mask[idxs]
+        return OldAPQuantity(ret.value, t, unit=self.unit,
+                             dtype=self.dtype, mask=mask)
+
+    def to(self, unit, equivalencies=[]):
+        ret = super(OldAPQuantity, self).to(unit, equivalencies=equivalencies)
+        return OldAPQuantity(ret.value, self.times, unit=ret.unit,
+                             mask=self.mask, dtype=ret.dtype)
+
+
+def make_fields(cls, n):
+    times = Quantity(np.arange(n)*0.25 + 6.0e8, "s")
+    times.flags.writeable = False
+    rng = np.random.RandomState(0)
+    fields = {}
+    for side in "ab":
+        for ftype in ["dp", "de"]:
+            mask = rng.random_sample(n) > 1.0e-3
+            fields[ftype, side, "v"] = cls(rng.normal(28.0, 0.1, n), times,
+                                           unit="V", mask=mask)
+            fields[ftype, side, "i"] = cls(rng.normal(1.5, 0.01, n), times,
+                                           unit="A")
+    return fields
+
+
+def powers(fields):
+    return [(fields[k, s, "v"]*fields[k, s, "i"]).to("W")
+            for k in ["dp", "de"] for s in "ab"]
+
+
+def slices(fields):
+    n = fields["dp", "a", "v"].size
+    return [v[n//4:3*n//4] for v in fields.values()]
+
+
+def timeit(func, fields, repeat=20):
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        func(fields)
+    return (time.perf_counter() - t0) / repeat
+
+
+def run(n):
+    old = make_fields(OldAPQuantity, n)
+    new = make_fields(APQuantity, n)
+    for p_old, p_new in zip(powers(old), powers(new)):
+        assert np.array_equal(p_old.value, p_new.value)
+        assert np.array_equal(p_old.mask, p_new.mask)
+    print("%d samples" % n)
+    for name, func in [("power fields", powers), ("slices", slices)]:
+        t_old = timeit(func, old)
+        t_new = timeit(func, new)
+        print("%-12s  old %8.3f ms  new %8.3f ms  speedup %6.1fx" %
+              (name, t_old*1.0e3, t_new*1.0e3, t_old/t_new))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
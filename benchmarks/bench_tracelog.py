@@ -0,0 +1,71 @@
+"""
+Compare parsing a synthetic 10-day tracelog file a line at a time, as
+MSIDs.from_tracelog used to, with the chunked, vectorized parser.
+
+Usage: python benchmarks/bench_tracelog.py [num_columns]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from acispy.tracelog import read_tracelog, read_tracelog_header
+
+
+def make_tracelog(filename, ncols, days=10.0, dt=32.8):
+    times = 410227200.0 + 6.0e8 + np.arange(0.0, days*86400.0, dt)
+    names = ["TIME"] + ["MSID%03d" % i for i in range(ncols)]
+    cols = [np.char.mod("%.2f", times)]
+    for i in range(ncols):
+        if i % 10 == 0:
+            # A state-code column
+            cols.append(np.array(["FMT%d" % (j % 6 + 1)
+                                  for j in range(times.size)]))
+        else:
+            cols.append(np.char.mod("%.3f", np.sin(times/1.0e3 + i)*20.0))
+    with open(filename, "w") as f:
+        f.write(" ".join(names) + "\n")
+        f.write("\n".join("\t".join(row) for row in zip(*cols)) + "\n")
+    return times.size
+
+
+def get_dtype(filename):
+    header, _ = read_tracelog_header(filename)
+    return [(k.lower(), "|U4" if i > 0 and (i-1) % 10 == 0 else "<f8")
+            for i, k in enumerate(header)]
+
+
+def read_lines(filename, dtype):
+    f = open(filename, "r")
+    f.readline()
+    data = []
+    for line in f:
+        words = line.split()
+        if len(words) == len(dtype):
+            data.append(tuple(words))
+    f.close()
+    return np.array(data, dtype=dtype)
+
+
+def run(ncols):
+    filename = os.path.join(tempfile.mkdtemp(), "bench.tl")
+    nlines = make_tracelog(filename, ncols)
+    print("%d lines, %d columns, %.1f MB" %
+          (nlines, ncols + 1, os.path.getsize(filename)/1.0e6))
+    dtype = get_dtype(filename)
+    t0 = time.perf_counter()
+    old = read_lines(filename, dtype)
+    t_old = time.perf_counter() - t0
+    _, offset = read_tracelog_header(filename)
+    t0 = time.perf_counter()
+    new, _ = read_tracelog(filename, dtype, start=offset)
+    t_new = time.perf_counter() - t0
+    for name, _ in dtype:
+        assert np.array_equal(old[name], new[name])
+    print("line by line  %8.3f s" % t_old)
+    print("vectorized    %8.3f s  speedup %5.2fx" % (t_new, t_old/t_new))
+    os.remove(filename)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 60)